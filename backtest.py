@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import argparse
+import json
+from collections import defaultdict
+
+import pandas as pd
+
+from gauntlet.backtest import backtest_markets
+from gauntlet.backtest import rank_lltvs
+from gauntlet.data_utils import get_prices
+from gauntlet.lltv_table import optimal_lltv
+from gauntlet.logger import get_logger
+from gauntlet.runner import Market
+from gauntlet.runner import market_inputs
+from gauntlet.runner import resolve_markets
+from gauntlet.tokens import token_id
+
+
+log = get_logger(__name__)
+
+
+def main(args: argparse.Namespace):
+    """
+    Backtests every candidate LLTV of the markets listed in the input json
+    file over the historical price ratio of each market, and compares the
+    recommended LLTV to the largest LLTV without realized bad debt.
+    """
+    with open(args.markets, "r") as f:
+        markets = [Market(**m) for m in json.load(f)]
+
+    by_chain = defaultdict(dict)
+    for mkt, pair in resolve_markets(markets).items():
+        by_chain[mkt.chain][mkt] = pair
+
+    out = []
+    frames = []
+    for chain, pairs in by_chain.items():
+        params = market_inputs(pairs, use_cache=args.use_cache)
+        tokens = list(
+            dict.fromkeys(t for pair in pairs.values() for t in pair)
+        )
+        hist_prices = get_prices(tokens, start_date=args.start_date)
+        results = backtest_markets(
+            {pairs[mkt]: p for mkt, p in params.items()},
+            hist_prices,
+            start_date=args.start_date,
+            horizon=args.horizon,
+            steps_per_obs=args.steps_per_obs,
+            start_window=args.start_window,
+        )
+        frames.append(results)
+        ranks = rank_lltvs(results)
+
+        for mkt, (collateral, debt) in pairs.items():
+            lltv, _ = optimal_lltv(params[mkt], pct_decrease=args.pct_decrease)
+            key = (token_id(collateral), token_id(debt))
+            market = results.loc[key]
+            realized = (
+                market.loc[round(lltv, 4)].to_dict()
+                if lltv is not None
+                else {}
+            )
+            max_safe = ranks.loc[key]
+            out.append(
+                {
+                    "chain": chain,
+                    "collateral": mkt.collateral,
+                    "borrow": mkt.borrow,
+                    "recommended_lltv": lltv,
+                    "recommended_bad_debt_mean": realized.get("bad_debt_mean"),
+                    "recommended_bad_debt_max": realized.get("bad_debt_max"),
+                    "max_safe_lltv": max_safe["max_safe_lltv"],
+                    "ranking": max_safe["ranking"],
+                }
+            )
+            log.info(
+                f"{collateral.symbol} / {debt.symbol} | recommended LLTV: "
+                + f"{lltv} | max realized safe LLTV: {max_safe['max_safe_lltv']}"
+            )
+
+    with open(args.save_path, "w") as f:
+        json.dump(out, f, indent=4, default=str)
+    log.info(f"Saved {len(out)} market backtests to {args.save_path}")
+    if args.csv_path:
+        pd.concat(frames).to_csv(args.csv_path)
+        log.info(f"Saved the per LLTV backtests to {args.csv_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "markets",
+        type=str,
+        help='json file with a list of markets, ex: [{"chain": "base", "collateral": "0x...", "borrow": "0x..."}]',
+    )
+    parser.add_argument(
+        "--save_path",
+        type=str,
+        default="backtest.json",
+        help="Path of the json file the per market summaries are saved to",
+    )
+    parser.add_argument(
+        "--csv_path",
+        type=str,
+        default=None,
+        help="[Optional] Path of a csv file the realized bad debt of every market at every LLTV is saved to",
+    )
+    parser.add_argument(
+        "--start_date",
+        type=str,
+        default="2022-07-01",
+        help="First date of the historical prices replayed",
+    )
+    parser.add_argument(
+        "--horizon",
+        type=int,
+        default=30,
+        help="Number of daily observations each backtested position is held",
+    )
+    parser.add_argument(
+        "--steps_per_obs",
+        type=int,
+        default=24,
+        help="Liquidation steps between two daily observations, the price ratio is interpolated geometrically in between",
+    )
+    parser.add_argument(
+        "--start_window",
+        type=int,
+        default=None,
+        help="[Optional] Only open positions on the last N dates. Defaults to every date with a full horizon ahead",
+    )
+    parser.add_argument(
+        "--pct_decrease",
+        type=float,
+        default=0.005,
+        help="Per iter percent drop of the collateral price to debt price, used for the recommended LLTVs",
+    )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        default=True,
+        help="If true/set, use precomputed price impact, and historical drawdown numbers",
+    )
+    main(parser.parse_args())
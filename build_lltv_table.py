@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from gauntlet.constants import LLTV_TABLE_PATH
+from gauntlet.lltv_table import build_lltv_table
+from gauntlet.lltv_table import PCT_DECREASES
+from gauntlet.logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+def main(args: argparse.Namespace):
+    """
+    Builds the LLTV lookup table used by main.py (see
+    gauntlet/lltv_table.py) and saves it to the data directory.
+    """
+    table = build_lltv_table(
+        pct_decreases=args.pct_decreases,
+        m=args.m,
+        beta=args.beta,
+        min_liq_bonus=args.min_liq_bonus,
+        processes=args.processes,
+    )
+    table.save(Path(args.save_path))
+    log.info(
+        f"Saved a {'x'.join(map(str, table.lltv_index.shape))} LLTV table"
+        + f" (version {table.version}) to {args.save_path}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pct_decreases",
+        type=float,
+        nargs="+",
+        default=list(PCT_DECREASES),
+        help="Per iter percent drops of the collateral price to tabulate",
+    )
+    parser.add_argument(
+        "--m",
+        type=float,
+        default=0.15,
+        help="Liquidation incentive parameter that determines the largest liquidation incentive allowed",
+    )
+    parser.add_argument(
+        "--beta",
+        type=float,
+        default=0.3,
+        help="Liquidation incentive parameter",
+    )
+    parser.add_argument(
+        "--min_liq_bonus",
+        type=float,
+        default=0.005,
+        help="Minimum liquidation bonus",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of worker processes. Defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--save_path",
+        type=str,
+        default=str(LLTV_TABLE_PATH),
+        help="Path of the table file",
+    )
+    main(parser.parse_args())
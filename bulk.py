@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import json
+from contextlib import nullcontext
+from pathlib import Path
+
+from gauntlet.coingecko import take_price_snapshot
+from gauntlet.incremental import DEFAULT_RTOL
+from gauntlet.incremental import update_recommendations
+from gauntlet.logger import get_logger
+from gauntlet.output import market_record
+from gauntlet.output import open_ndjson
+from gauntlet.plan import plan_run
+from gauntlet.results import ResultStore
+from gauntlet.runner import evaluate_universes
+from gauntlet.runner import Market
+from gauntlet.runner import resolve_markets
+from gauntlet.snapshot import activate_snapshot
+from gauntlet.snapshot import PriceSnapshot
+
+
+log = get_logger(__name__)
+
+
+def main(args: argparse.Namespace):
+    """
+    Computes the optimal LLTV of every market listed in the input json file
+    and saves the results as json. Markets of different chains are
+    evaluated in parallel.
+    """
+    with open(args.markets, "r") as f:
+        markets = [Market(**m) for m in json.load(f)]
+
+    if args.plan:
+        snapshot_path = Path(args.price_snapshot or "")
+        reuse = args.price_snapshot and snapshot_path.exists()
+        plan = plan_run(
+            markets,
+            interval=args.interval,
+            update_cache=args.update_cache,
+            use_cache=args.use_cache,
+            snapshot=PriceSnapshot.load(snapshot_path) if reuse else None,
+            take_snapshot=args.price_snapshot is not None and not reuse,
+        )
+        plan.log()
+        print(json.dumps(plan.to_dict(), indent=4))
+        return
+
+    if args.price_snapshot is not None:
+        path = Path(args.price_snapshot) if args.price_snapshot else None
+        if path is None or not path.exists():
+            tokens = [
+                t for pair in resolve_markets(markets).values() for t in pair
+            ]
+            path = take_price_snapshot(tokens).save(path)
+            log.info(f"Saved the current prices to {path}")
+        # every chain worker and process of the run reads this snapshot
+        activate_snapshot(path)
+
+    kwargs = dict(
+        max_workers=args.max_workers,
+        interval=args.interval,
+        update_cache=args.update_cache,
+        use_cache=args.use_cache,
+        pct_decrease=args.pct_decrease,
+    )
+    if args.adaptive:
+        kwargs["adaptive"] = True
+    output = open_ndjson(args.ndjson) if args.ndjson else nullcontext()
+    with output as writer:
+        if writer is not None:
+            # one record per market, written as soon as it is evaluated
+            kwargs["on_result"] = lambda *r: writer.write(
+                market_record(*r, pct_decrease=args.pct_decrease)
+            )
+        if args.incremental:
+            results = update_recommendations(
+                markets, rtol=args.rtol, force=args.force, **kwargs
+            )
+        elif args.curves_dir:
+            if args.processes:
+                raise ValueError("--curves_dir does not support --processes")
+            with ResultStore(args.curves_dir) as store:
+                results = evaluate_universes(markets, store=store, **kwargs)
+            log.info(
+                f"Saved {len(store)} LLTV insolvencies to {args.curves_dir}"
+            )
+        else:
+            results = evaluate_universes(
+                markets, processes=args.processes, **kwargs
+            )
+    out = [
+        {
+            "chain": mkt.chain,
+            "collateral": mkt.collateral,
+            "borrow": mkt.borrow,
+            "lltv": lltv,
+            "liquidation_incentive": li,
+        }
+        for mkt, (lltv, li) in results.items()
+    ]
+    with open(args.save_path, "w") as f:
+        json.dump(out, f, indent=4)
+    log.info(f"Saved {len(out)} market results to {args.save_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "markets",
+        type=str,
+        help='json file with a list of markets, ex: [{"chain": "base", "collateral": "0x...", "borrow": "0x..."}]',
+    )
+    parser.add_argument(
+        "--save_path",
+        type=str,
+        default="lltvs.json",
+        help="Path of the json file the results are saved to",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=None,
+        help="Number of chains evaluated concurrently. Defaults to one worker per chain",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="Number of worker processes evaluating the markets of each chain. The market inputs are shared with the workers through shared memory",
+    )
+    parser.add_argument(
+        "--curves_dir",
+        type=str,
+        default=None,
+        help="Directory of a result store the insolvent debt of every market at every LLTV is appended to (see gauntlet/results.py)",
+    )
+    parser.add_argument(
+        "--ndjson",
+        type=str,
+        default=None,
+        help="[Optional] Stream one json record per market (inputs, LLTV, liquidation incentive, insolvency curve and timings) to this file, or to stdout with '-', as soon as each market is evaluated",
+    )
+    parser.add_argument(
+        "--price_snapshot",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="Price every market from one snapshot of the current prices, fetched in bulk once per run. Without a value, a new snapshot is saved to data/snapshots/prices_<UTC time>.json. With the path of an existing snapshot, its prices are reused, which makes reruns deterministic",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        default=False,
+        help="Only plan the run, without any network call: print the requests it would send to each API (from the token registry, the swap size and drawdown caches and the price snapshot), the wall time their rate limits impose and an upper bound of the sim steps of every market, as json to stdout",
+    )
+    parser.add_argument(
+        "--interval",
+        type=str,
+        choices=["daily", "hourly"],
+        default="daily",
+        help="Granularity of the price history used for the historical drawdowns",
+    )
+    parser.add_argument(
+        "--pct_decrease",
+        type=float,
+        default=0.005,
+        help="Per iter percent drop of the collateral price to debt price",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        default=False,
+        help="Simulate with the variable step size stepper (see main.py --adaptive)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only rerun the markets whose inputs moved by more than --rtol since their last persisted recommendation",
+    )
+    parser.add_argument(
+        "--rtol",
+        type=float,
+        default=DEFAULT_RTOL,
+        help="Relative change of a market input (repay amount, drawdown, position size, prices) that triggers a rerun in --incremental mode",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Rerun every market in --incremental mode and refresh the persisted recommendations",
+    )
+    parser.add_argument(
+        "--update_cache",
+        action="store_true",
+        default=False,
+        help="Update the drawdown and price impact caches with newly computed values.",
+    )
+    parser.add_argument(
+        "--use_cache",
+        action="store_true",
+        default=True,
+        help="If true/set, use precomputed price impact, and historical drawdown numbers",
+    )
+    args = parser.parse_args()
+    if args.ndjson and args.incremental:
+        parser.error("--ndjson does not support --incremental")
+    main(args)
@@ -0,0 +1,224 @@
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .data_utils import pair_ratio
+from .logger import get_logger
+from .price_calendar import PriceCalendar
+from .runner import liquidation_bonuses
+from .runner import LLTVS
+from .runner import MarketParams
+from .tokens import Token
+from .tokens import token_id
+
+log = get_logger(__name__)
+
+# Positions are simulated with 1 unit of collateral, so tolerances are
+# relative to the initial position
+REL_TOL = 1e-12
+
+
+def ratio_paths(
+    ratio: np.ndarray, horizon: int, steps_per_obs: int = 24
+) -> np.ndarray:
+    """
+    Price ratio paths of every `horizon` observations long window of the
+    series, one row per start date, normalized to start at 1. Each
+    observation interval is split into `steps_per_obs` liquidation steps,
+    geometrically interpolated between the observations.
+
+    Returns: (n_starts, horizon * steps_per_obs + 1) array
+    """
+    log_ratio = np.log(np.asarray(ratio, dtype=np.float64))
+    windows = sliding_window_view(log_ratio, horizon + 1)
+    windows = windows - windows[:, :1]
+
+    pos = np.arange(horizon * steps_per_obs + 1) / steps_per_obs
+    lo = np.minimum(pos.astype(int), horizon - 1)
+    frac = pos - lo
+    return np.exp(windows[:, lo] * (1 - frac) + windows[:, lo + 1] * frac)
+
+
+def _replay(
+    paths: np.ndarray,
+    lltv: np.ndarray,
+    bonus: np.ndarray,
+    repay_ratio: float,
+) -> np.ndarray:
+    shape = (len(lltv), len(paths))
+    tokens = np.ones(shape)
+    debt = np.broadcast_to(lltv, shape).copy()
+    bad_debt = np.zeros(shape)
+    active = np.ones(shape, dtype=bool)
+
+    for k in range(1, paths.shape[1]):
+        price = paths[:, k]
+        collateral = tokens * price
+        liquidatable = active & (debt >= lltv * collateral)
+        if not liquidatable.any():
+            continue
+        claim = np.where(
+            liquidatable,
+            np.minimum(
+                np.minimum(debt, repay_ratio) * (1 + bonus), collateral
+            ),
+            0.0,
+        )
+        tokens -= claim / price
+        debt -= claim / (1 + bonus)
+
+        exhausted = liquidatable & (collateral - claim < REL_TOL)
+        bad_debt[exhausted] = debt[exhausted]
+        active &= ~exhausted & (debt > REL_TOL)
+
+    shortfall = np.maximum(debt - tokens * paths[:, -1], 0)
+    bad_debt[active] = shortfall[active]
+    return bad_debt
+
+
+def replay_liquidations(
+    paths: np.ndarray,
+    lltvs: np.ndarray,
+    liq_bonuses: np.ndarray,
+    repay_ratio: float,
+    block_size: int = 8,
+) -> np.ndarray:
+    """
+    Replays the liquidation cascade of `simulate_insolvency` along real
+    price ratio paths instead of a constant price decrease, for every
+    (LLTV, path) pair at once.
+
+    Every position starts with 1 unit of collateral (price 1) and maxes out
+    its borrow power. At each step the collateral is repriced along the
+    path, and a liquidatable position repays at most `repay_ratio` of debt
+    in exchange for repay * (1 + liq_bonus) of collateral. Paths are real
+    series, so prices can also recover.
+
+    Liquidations preserve the equity C - D * (1 + liq_bonus) (see
+    `classify_lltvs`), so a path that stays above lltv * (1 + liq_bonus)
+    cannot create bad debt. Blocks of `block_size` LLTVs only replay the
+    paths that dip below that level.
+
+    Returns: (n_lltvs, n_paths) bad debt as a fraction of the initial
+        collateral: the debt left when the collateral runs out, or the
+        debt not covered by the collateral at the end of the path.
+    """
+    lltvs = np.asarray(lltvs, dtype=np.float64)
+    liq_bonuses = np.asarray(liq_bonuses, dtype=np.float64)
+    bad_debt = np.zeros((len(lltvs), len(paths)))
+    path_min = paths.min(axis=1)
+    for i in range(0, len(lltvs), block_size):
+        block = slice(i, i + block_size)
+        level = (lltvs[block] * (1 + liq_bonuses[block])).max()
+        rows = np.flatnonzero(path_min < level)
+        if len(rows):
+            bad_debt[block, rows] = _replay(
+                paths[rows],
+                lltvs[block, None],
+                liq_bonuses[block, None],
+                repay_ratio,
+            )
+    return bad_debt
+
+
+def backtest_ratio(
+    ratio: pd.Series,
+    repay_ratio: float,
+    lltvs: np.ndarray = LLTVS,
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    horizon: int = 30,
+    steps_per_obs: int = 24,
+    start_window: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Realized bad debt of every candidate LLTV of a market when its position
+    is opened on each date of the ratio series and held `horizon`
+    observations.
+
+    ratio: pd.Series, collateral / debt price ratio indexed by date
+    repay_ratio: float, repay amount per liquidation step / initial
+        collateral (see `MarketParams`)
+    start_window: int, only start on the last `start_window` eligible
+        dates. Defaults to every date with a full horizon ahead.
+
+    Returns: DataFrame indexed by LLTV with the mean and max bad debt (as
+        a fraction of the position), the share of start dates that end
+        with bad debt and the start date of the worst outcome
+    """
+    ratio = ratio.dropna()
+    ratio = ratio[ratio > 0]
+    if len(ratio) <= horizon:
+        raise ValueError(
+            f"{len(ratio)} observations is too short for a {horizon} horizon"
+        )
+    paths = ratio_paths(ratio.to_numpy(), horizon, steps_per_obs)
+    starts = ratio.index[: len(paths)]
+    if start_window is not None:
+        paths, starts = paths[-start_window:], starts[-start_window:]
+
+    bonuses = liquidation_bonuses(lltvs, m, beta, min_liq_bonus)
+    bad_debt = replay_liquidations(paths, lltvs, bonuses, repay_ratio)
+    return pd.DataFrame(
+        {
+            "liq_bonus": bonuses,
+            "bad_debt_mean": bad_debt.mean(axis=1),
+            "bad_debt_max": bad_debt.max(axis=1),
+            "pct_insolvent_starts": (bad_debt > REL_TOL).mean(axis=1),
+            "worst_start": starts[bad_debt.argmax(axis=1)],
+        },
+        index=pd.Index(np.round(lltvs, 4), name="lltv"),
+    )
+
+
+def backtest_markets(
+    pairs: dict[Tuple[Token, Token], MarketParams],
+    hist_prices: dict[Token, pd.DataFrame],
+    start_date: str = "2022-07-01",
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    `backtest_ratio` of every (collateral, debt) pair on the historical
+    ratio series of `compute_pair_drawdown`. The historical prices are
+    aligned once on a master calendar shared by every pair.
+
+    kwargs: passed to `backtest_ratio`
+    Returns: DataFrame indexed by (collateral, debt, lltv), the tokens of
+        each market given by their `token_id`
+    """
+    calendar = PriceCalendar.from_prices(hist_prices, start_date)
+    frames = {}
+    for (t1, t2), params in pairs.items():
+        ratio = pair_ratio(t1, t2, calendar, start_date)
+        frames[(token_id(t1), token_id(t2))] = backtest_ratio(
+            ratio,
+            params.repay_amount_usd / params.initial_collateral_usd,
+            **kwargs,
+        )
+        log.debug(f"Backtested {t1.symbol} / {t2.symbol}")
+    return pd.concat(frames, names=["collateral", "debt"])
+
+
+def rank_lltvs(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per market, the largest LLTV without realized bad debt and the LLTVs
+    ranked by realized bad debt (lowest first, larger LLTVs first among
+    ties).
+    """
+    rows = {}
+    for market, df in results.groupby(level=["collateral", "debt"]):
+        df = df.droplevel(["collateral", "debt"]).reset_index()
+        safe = df.loc[df["bad_debt_max"] <= REL_TOL, "lltv"]
+        ranked = df.sort_values(
+            ["bad_debt_mean", "bad_debt_max", "lltv"],
+            ascending=[True, True, False],
+        )
+        rows[market] = {
+            "max_safe_lltv": safe.max() if len(safe) else None,
+            "ranking": ranked["lltv"].tolist(),
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
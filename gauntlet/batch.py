@@ -0,0 +1,119 @@
+import csv
+import json
+import threading
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+from .constants import OPTIMIZE_CHECKPOINT_PATH
+from .io_utils import write_atomic
+from .logger import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class BatchJob:
+    """
+    One market of an `optimize.py` batch. `lltv` is the LLTV the supply cap
+    is computed for, the recommended LLTV if not given.
+    """
+
+    collateral: str
+    loan: str
+    lltv: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.collateral.lower()}/{self.loan.lower()}/{self.lltv}"
+
+
+def load_jobs(path: Path) -> list[BatchJob]:
+    """
+    Reads a market list from a csv file with a `collateral`, `loan` and
+    optional `lltv` column, or a json list of objects with the same keys.
+    """
+    path = Path(path)
+    with open(path, "r") as f:
+        if path.suffix == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = json.load(f)
+    return [
+        BatchJob(
+            collateral=row["collateral"],
+            loan=row["loan"],
+            lltv=float(row["lltv"]) if row.get("lltv") else None,
+        )
+        for row in rows
+    ]
+
+
+class Checkpoint:
+    """
+    Results of the completed jobs of a batch, keyed by `BatchJob.key`. The
+    file is rewritten atomically after every completed job, so a batch
+    interrupted at any point resumes from its last completed job.
+    """
+
+    def __init__(self, path: Path = OPTIMIZE_CHECKPOINT_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.results: dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.results = json.load(f)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.results
+
+    def record(self, key: str, result: dict):
+        with self._lock:
+            self.results[key] = dict(result, completed_at=time.time())
+            write_atomic(
+                self.path, lambda f: json.dump(self.results, f, indent=4)
+            )
+
+
+def run_batch(
+    jobs: Iterable[BatchJob],
+    run: Callable[[BatchJob], dict[str, Any]],
+    checkpoint: Checkpoint,
+    max_workers: int = 4,
+) -> dict[str, str]:
+    """
+    Runs `run` on every job not yet in the checkpoint, `max_workers` jobs
+    at a time, and checkpoints each result as soon as its job completes.
+    API requests of concurrent jobs share the per API rate limiters (see
+    `coingecko.rate_limiter`). A failed job is logged and left out of the
+    checkpoint, so it is retried by the next run.
+
+    Returns: job key -> error of the failed jobs
+    """
+    jobs = list(dict.fromkeys(jobs))
+    pending = [job for job in jobs if job.key not in checkpoint]
+    log.info(
+        f"Running {len(pending)} / {len(jobs)} jobs,"
+        + f" {len(jobs) - len(pending)} already checkpointed"
+    )
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers) as pool:
+        futures = {pool.submit(run, job): job for job in pending}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                log.warning(f"{job.key} failed: {e!r}")
+                failures[job.key] = repr(e)
+                continue
+            checkpoint.record(job.key, result)
+            log.info(f"{job.key} done: {result}")
+    return failures
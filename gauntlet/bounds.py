@@ -0,0 +1,226 @@
+from enum import IntEnum
+from typing import Optional
+
+import numpy as np
+
+from .constants import TOL
+from .impact_table import MarketLiquidity
+from .logger import get_logger
+from .sim import simulate_insolvency
+from .sim import simulate_insolvency_adaptive
+
+log = get_logger(__name__)
+
+# Margin (relative to the initial collateral) the bounds must clear before
+# an LLTV is classified, to absorb floating point drift in the sim
+BOUND_RTOL = 1e-9
+
+
+class Verdict(IntEnum):
+    SOLVENT = 0
+    INSOLVENT = 1
+    UNKNOWN = 2
+
+
+def price_path(
+    collateral_price: float, max_drawdown: float, pct_decrease: float
+) -> np.ndarray:
+    """
+    Collateral price after each step of `simulate_insolvency`, up to the
+    first step that reaches the max drawdown. The price stays constant
+    afterwards.
+    """
+    min_price = collateral_price * (1 - max_drawdown)
+    decrement = collateral_price * pct_decrease
+    if decrement <= 0 or max_drawdown <= 0:
+        return np.array([])
+    # same float accumulation as the sim
+    prices = []
+    price = collateral_price
+    while price > min_price:
+        price = max(min_price, price - decrement)
+        prices.append(price)
+    return np.array(prices)
+
+
+def classify_lltvs(
+    *,
+    initial_collateral_usd: float,
+    collateral_price: float,
+    lltvs: np.ndarray,
+    repay_amount_usd: float,
+    liq_bonuses: np.ndarray,
+    max_drawdown: float,
+    pct_decrease: float,
+) -> np.ndarray:
+    """
+    Classifies every (LLTV, liquidation bonus) pair as certainly solvent,
+    certainly insolvent or unknown without running `simulate_insolvency`.
+
+    The bounds rely on the equity E = C - D * (1 + b) of the position
+    (C collateral usd, D debt usd, b liquidation bonus). A liquidation
+    removes c usd of collateral and c / (1 + b) usd of debt, so it leaves E
+    unchanged: only price drops lower E, by the price drop times the
+    collateral tokens held. The position ends insolvent iff E goes negative.
+
+    - Every liquidation claims at most repay_amount_usd * (1 + b) usd of
+      collateral, which gives a lower bound on the tokens held at each step,
+      so an upper bound on E. If it goes negative, the LLTV is insolvent
+      (provided the sim has enough steps left to liquidate the collateral).
+    - A position is liquidated iff C * (1 - lltv * (1 + b)) >= E, so after
+      each step its collateral is at most the larger of E / (1 -
+      lltv * (1 + b)) and what is left after a full liquidation. This gives
+      an upper bound on the tokens held, so a lower bound on E. If it stays
+      positive, the LLTV is solvent.
+
+    Returns: array of `Verdict` values, one per LLTV
+    """
+    lltvs = np.asarray(lltvs, dtype=np.float64)
+    bonus = np.asarray(liq_bonuses, dtype=np.float64)
+    margin = BOUND_RTOL * initial_collateral_usd + 10 * TOL
+    max_iters = int(np.ceil((initial_collateral_usd / repay_amount_usd) + 1))
+
+    prices = price_path(collateral_price, max_drawdown, pct_decrease)
+    drops = -np.diff(prices, prepend=collateral_price)
+    k = 1 - lltvs * (1 + bonus)
+    k_pos = np.where(k > 0, k, 1.0)
+    max_claim_usd = repay_amount_usd * (1 + bonus)
+
+    tokens_lo = np.full(len(lltvs), initial_collateral_usd / collateral_price)
+    tokens_hi = tokens_lo.copy()
+    equity_lo = initial_collateral_usd * k
+    equity_hi = equity_lo.copy()
+    insolvent = np.zeros(len(lltvs), dtype=bool)
+
+    # collateral tokens left by a full liquidation at the previous step
+    full_liquidation_hi = tokens_hi.copy()
+    prev_price = collateral_price
+    for t, (price, drop) in enumerate(zip(prices, drops)):
+        # The tokens held are at most max(E / (k * p), full_liquidation_hi),
+        # and E - drop * max(E / (k * p), ...) is non decreasing in E while
+        # drop <= k * p, so the lower bound of E can be substituted for E.
+        monotone = (drop <= k_pos * prev_price) & (k > 0) & (t > 0)
+        equity_lo = np.maximum(
+            equity_lo - drop * tokens_hi,
+            np.where(
+                monotone,
+                equity_lo
+                - drop
+                * np.maximum(
+                    equity_lo / (k_pos * prev_price), full_liquidation_hi
+                ),
+                -np.inf,
+            ),
+        )
+        equity_hi -= drop * tokens_lo
+
+        # Once E < 0 every step liquidates min(C, max claim) of collateral
+        steps_left = np.ceil(tokens_hi * price / max_claim_usd)
+        insolvent |= (equity_hi < -margin) & (t + steps_left < max_iters + 9)
+
+        # A liquidation only happens if C >= E / k, and claims at most the
+        # max claim, so whether or not it happens at least
+        # min(C, E / k - max claim) of collateral is left
+        max_claim_tokens = max_claim_usd / price
+        tokens_lo = np.maximum(
+            tokens_lo - max_claim_tokens,
+            np.where(
+                k > 0,
+                np.minimum(
+                    tokens_lo, equity_lo / (k_pos * price) - max_claim_tokens
+                ),
+                0,
+            ),
+        ).clip(0)
+        full_liquidation_hi = np.maximum(0, tokens_hi - max_claim_usd / price)
+        prev_price = price
+        tokens_hi = np.clip(
+            np.maximum(
+                equity_hi / (k_pos * price), tokens_hi - max_claim_usd / price
+            ),
+            0,
+            tokens_hi,
+        )
+
+    verdicts = np.full(len(lltvs), Verdict.UNKNOWN, dtype=np.int8)
+    verdicts[insolvent] = Verdict.INSOLVENT
+    verdicts[(k > 0) & (equity_lo > margin)] = Verdict.SOLVENT
+    return verdicts
+
+
+def last_solvent_index(
+    *,
+    initial_collateral_usd: float,
+    collateral_price: float,
+    debt_price: float,
+    lltvs: np.ndarray,
+    repay_amount_usd: float,
+    liq_bonuses: np.ndarray,
+    max_drawdown: float,
+    pct_decrease: float,
+    use_bounds: bool = True,
+    liquidity: Optional[MarketLiquidity] = None,
+    adaptive: bool = False,
+) -> Optional[int]:
+    """
+    Sweeps the LLTVs in increasing order and returns the index of the last
+    one before the first insolvent LLTV (None if the first one is
+    insolvent), like a loop of `simulate_insolvency` calls would. LLTVs
+    that `classify_lltvs` can decide are not simulated. The bounds assume
+    a fixed repay amount, so they are not used with `liquidity`.
+
+    adaptive: bool, simulate with `simulate_insolvency_adaptive`. The
+        cost of the bounds grows with the number of steps of the price
+        path while the adaptive stepper's does not, so they are not used
+        either.
+    """
+    if use_bounds and liquidity is None and not adaptive:
+        verdicts = classify_lltvs(
+            initial_collateral_usd=initial_collateral_usd,
+            collateral_price=collateral_price,
+            lltvs=lltvs,
+            repay_amount_usd=repay_amount_usd,
+            liq_bonuses=liq_bonuses,
+            max_drawdown=max_drawdown,
+            pct_decrease=pct_decrease,
+        )
+    else:
+        verdicts = np.full(len(lltvs), Verdict.UNKNOWN, dtype=np.int8)
+
+    last = None
+    n_sims = 0
+    n_steps = 0
+    n_fixed_steps = 0
+    for i, (ltv, liq_bonus) in enumerate(zip(lltvs, liq_bonuses)):
+        if verdicts[i] == Verdict.INSOLVENT:
+            break
+        if verdicts[i] == Verdict.UNKNOWN:
+            n_sims += 1
+            sim_inputs = dict(
+                initial_collateral_usd=initial_collateral_usd,
+                collateral_price=collateral_price,
+                debt_price=debt_price,
+                lltv=ltv,
+                repay_amount_usd=repay_amount_usd,
+                liq_bonus=liq_bonus,
+                max_drawdown=max_drawdown,
+                pct_decrease=pct_decrease,
+                liquidity=liquidity,
+            )
+            if adaptive:
+                run = simulate_insolvency_adaptive(**sim_inputs)
+                insolvency = run.insolvency
+                n_steps += run.n_steps
+                n_fixed_steps += run.n_fixed_steps
+            else:
+                insolvency = simulate_insolvency(**sim_inputs)
+            if insolvency > 0:
+                break
+        last = i
+
+    log.debug("Simulated %d of %d LLTVs", n_sims, len(lltvs))
+    if adaptive:
+        log.debug(
+            "Adaptive steps: %d for %d fixed steps", n_steps, n_fixed_steps
+        )
+    return last
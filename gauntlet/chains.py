@@ -0,0 +1,90 @@
+from typing import NamedTuple
+from typing import Optional
+
+from .tokens import Token
+from .tokens import Tokens
+
+
+class Chain(NamedTuple):
+    name: str
+    chain_id: int
+    # asset platform id used in CoinGecko urls
+    coingecko_platform: str
+    # network name in CowSwap urls, None if CowSwap is not deployed
+    cowswap_network: Optional[str]
+    # stablecoins price impacts are measured against. The second one is used
+    # for the first stablecoin itself.
+    usd_quote: Token
+    usd_quote_alt: Token
+
+
+DEFAULT_CHAIN = "ethereum"
+
+CHAINS = {
+    "ethereum": Chain(
+        name="ethereum",
+        chain_id=1,
+        coingecko_platform="ethereum",
+        cowswap_network="mainnet",
+        usd_quote=Tokens.USDC,
+        usd_quote_alt=Tokens.USDT,
+    ),
+    "base": Chain(
+        name="base",
+        chain_id=8453,
+        coingecko_platform="base",
+        cowswap_network="base",
+        usd_quote=Token(
+            symbol="usdc",
+            address="0x833589fcd6edb6e08f4c7c32d4f71b54bda02913",
+            decimals=6,
+            coingecko_id="usd-coin",
+            chain="base",
+        ),
+        usd_quote_alt=Token(
+            symbol="usdbc",
+            address="0xd9aaec86b65d86f6a7b5b1b0c42ffa531710b6ca",
+            decimals=6,
+            coingecko_id="bridged-usd-coin-base",
+            chain="base",
+        ),
+    ),
+    "arbitrum": Chain(
+        name="arbitrum",
+        chain_id=42161,
+        coingecko_platform="arbitrum-one",
+        cowswap_network="arbitrum_one",
+        usd_quote=Token(
+            symbol="usdc",
+            address="0xaf88d065e77c8cc2239327c5edb3a432268e5831",
+            decimals=6,
+            coingecko_id="usd-coin",
+            chain="arbitrum",
+        ),
+        usd_quote_alt=Token(
+            symbol="usdt",
+            address="0xfd086bc7cd5c481dcc9c85ebe478a1c0b69fcbb9",
+            decimals=6,
+            coingecko_id="tether",
+            chain="arbitrum",
+        ),
+    ),
+}
+
+
+def get_chain(name: str) -> Chain:
+    if name not in CHAINS:
+        raise ValueError(
+            f"Unsupported chain {name}. Supported chains: {list(CHAINS)}"
+        )
+    return CHAINS[name]
+
+
+def usd_quote_token(token: Token) -> Token:
+    """
+    Stablecoin to measure the price impact of selling `token` against.
+    """
+    chain = get_chain(token.chain)
+    if token.address.lower() == chain.usd_quote.address:
+        return chain.usd_quote_alt
+    return chain.usd_quote
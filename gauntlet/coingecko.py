@@ -1,86 +1,193 @@
 import datetime
 import os
+import threading
 import time
 from abc import ABC
 from abc import abstractproperty
 from dataclasses import dataclass
 from functools import lru_cache
+from typing import Iterable
 from typing import Optional
 
 import pandas as pd
 import requests
 
-from .constants import ADDRESS_MAP
-from .constants import SYMBOL_MAP
+from .chains import CHAINS
+from .chains import DEFAULT_CHAIN
+from .chains import get_chain
 from .logger import get_logger
+from .registry import default_registry
+from .registry import is_address
+from .registry import normalize_address
+from .registry import TokenRegistry
+from .snapshot import active_snapshot
+from .snapshot import PriceSnapshot
 from .tokens import Token
 
 log = get_logger(__name__)
 
 
-def ms_to_dt(ms: float) -> str:
+DATE_FORMATS = {"daily": "%Y-%m-%d", "hourly": "%Y-%m-%d %H:%M"}
+
+
+def ms_to_dt(ms: float, interval: str = "daily") -> str:
     timestamp_seconds = ms / 1000
     dt_object = datetime.datetime.fromtimestamp(timestamp_seconds)
-    return dt_object.strftime("%Y-%m-%d")
+    return dt_object.strftime(DATE_FORMATS[interval])
+
+
+def market_chart_to_df(res_js: dict, interval: str = "daily") -> pd.DataFrame:
+    """
+    Converts a CoinGecko market chart response (lists of timestamp, field
+    value pairs) into a DataFrame indexed by date.
+    """
+    res_js["date"] = [ms_to_dt(t, interval) for t, _ in res_js["prices"]]
+    res_js["prices"] = [x for _, x in res_js["prices"]]
+    res_js["market_caps"] = [x for _, x in res_js["market_caps"]]
+    res_js["total_volumes"] = [x for _, x in res_js["total_volumes"]]
+    return pd.DataFrame(res_js).set_index("date")
+
+
+class RateLimiter:
+    """
+    Request counter of one upstream API. Every client of the same API shares
+    one limiter (see `API`), so clients created in different modules or
+    worker threads stay under the API's rate limit together.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_call_time = 0  # time of last request
+        # number of api requests in the current period
+        self.calls_in_period = 0
+        # totals since the process started, see `api_stats`
+        self.requests = 0
+        self.retries = 0
+        self.bytes = 0
+
+
+_RATE_LIMITERS: dict[str, RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def rate_limiter(api_name: str) -> RateLimiter:
+    with _RATE_LIMITERS_LOCK:
+        return _RATE_LIMITERS.setdefault(api_name, RateLimiter())
+
+
+def api_stats() -> dict[str, dict[str, int]]:
+    """
+    Number of requests, retries and response bytes sent to each API so far.
+    """
+    with _RATE_LIMITERS_LOCK:
+        return {
+            name: {
+                "requests": limiter.requests,
+                "retries": limiter.retries,
+                "bytes": limiter.bytes,
+            }
+            for name, limiter in _RATE_LIMITERS.items()
+        }
 
 
 @dataclass
 class API(ABC):
     PERIOD_LENGTH = 60
+    MAX_RETRIES = 3
+    RETRY_BACKOFF_SEC = 2.0
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
 
     def __init__(self):
-        self._last_call_time = 0  # time of last request
-        self._calls_in_period = (
-            0  # number of api requests in the current period
-        )
+        self._limiter = rate_limiter(type(self).__name__)
 
     @abstractproperty
     def requests_per_minute(self) -> float:
         raise NotImplementedError
 
     def calculate_wait_time(self) -> float:
-        if self._calls_in_period >= self.requests_per_minute:
+        if self._limiter.calls_in_period >= self.requests_per_minute:
             return API.PERIOD_LENGTH
         else:
             # no need to wait since we are under the rate limit
             return 0
 
-    def make_request(self, **request_kwargs) -> requests.request:
+    def make_request(
+        self, method: str = "get", **request_kwargs
+    ) -> requests.request:
         """
         This function handles making the api request while potentially
         sleeping to avoid hitting the API request limit.
+        Connection errors, timeouts, 429 and 5xx responses are retried up to
+        MAX_RETRIES times with exponential backoff (or the Retry-After delay
+        the API asks for).
         """
-        now = time.time()
-        wt = self.calculate_wait_time()
-
-        if wt > 0:
-            # Obey the rate limit
-            log.debug(f"Rate limit hit. Sleeping for {wt:.3f}s ...")
-            time.sleep(wt)
-            # reset the counter
-            self._calls_in_period = 0
-        if wt == 0 and now - self._last_call_time > API.PERIOD_LENGTH:
-            self._calls_in_period = 0
-
-        self._last_call_time = now
-        self._calls_in_period += 1
+        limiter = self._limiter
         header = self.get_header()
         if header:
             request_kwargs["headers"] = header
 
-        response = requests.get(**request_kwargs)
-        log.debug(f"Sent get request to url: {request_kwargs['url']}")
+        for attempt in range(API.MAX_RETRIES + 1):
+            self._wait_for_rate_limit()
+            backoff = API.RETRY_BACKOFF_SEC * 2**attempt
+            try:
+                response = requests.request(method, **request_kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == API.MAX_RETRIES:
+                    raise
+                log.debug(f"{e}. Retrying in {backoff:.1f}s ...")
+            else:
+                log.debug(
+                    f"Sent {method} request to url: {request_kwargs['url']}"
+                )
+                with limiter.lock:
+                    limiter.bytes += len(response.content)
+                retryable = response.status_code in API.RETRY_STATUSES
+                if response.ok or not retryable or attempt == API.MAX_RETRIES:
+                    break
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    backoff = float(retry_after)
+                log.debug(
+                    f"Status {response.status_code}. Retrying in {backoff:.1f}s ..."
+                )
+            with limiter.lock:
+                limiter.retries += 1
+            time.sleep(backoff)
+
         if not response.ok:
             response.raise_for_status()
 
         return response
 
+    def _wait_for_rate_limit(self):
+        limiter = self._limiter
+        # Holding the lock while sleeping makes every other client of this
+        # API wait for the rate limit window as well.
+        with limiter.lock:
+            now = time.time()
+            wt = self.calculate_wait_time()
+
+            if wt > 0:
+                # Obey the rate limit
+                log.debug(f"Rate limit hit. Sleeping for {wt:.3f}s ...")
+                time.sleep(wt)
+                # reset the counter
+                limiter.calls_in_period = 0
+            if wt == 0 and now - limiter.last_call_time > API.PERIOD_LENGTH:
+                limiter.calls_in_period = 0
+
+            limiter.last_call_time = now
+            limiter.calls_in_period += 1
+            limiter.requests += 1
+
     def get_header(self) -> dict[str, str]:
         return {}
 
 
 class CoinGecko(API):
-    CHAIN_IDS = {"ethereum": 1}
+    CHAIN_IDS = {name: c.chain_id for name, c in CHAINS.items()}
+    # CoinGecko only serves hourly granularity for ranges of at most 90 days
+    HOURLY_RANGE_DAYS = 90
     PUBLIC_URL = "https://api.coingecko.com/api/v3"
     PRO_URL = "https://pro-api.coingecko.com/api/v3"
 
@@ -103,30 +210,102 @@ class CoinGecko(API):
         """
         return 500 if self.get_coingecko_api_key() else 10
 
-    def token_info(self, address: str, chain: str = "ethereum"):
-        chain_id = self.CHAIN_IDS.get(chain)
-        url = f"{self.api_url}/coins/{chain_id}/contract/{address}"
+    def token_info(self, address: str, chain: str = DEFAULT_CHAIN):
+        platform = get_chain(chain).coingecko_platform
+        url = f"{self.api_url}/coins/{platform}/contract/{address}"
         response = self.make_request(url=url)
         return response.json()
 
+    def token_list(self, chain: str = DEFAULT_CHAIN) -> list[dict]:
+        """
+        Every token CoinGecko knows on the chain, in the token list format
+        (address, symbol, name, decimals), in a single request.
+        """
+        platform = get_chain(chain).coingecko_platform
+        url = f"{self.api_url}/token_lists/{platform}/all.json"
+        response = self.make_request(url=url)
+        return response.json()["tokens"]
+
+    def coins_list(self) -> list[dict]:
+        """
+        Every coin id with its contract address on each platform.
+        """
+        url = f"{self.api_url}/coins/list"
+        response = self.make_request(
+            url=url, params={"include_platform": "true"}
+        )
+        return response.json()
+
+    def coins_markets(
+        self, coingecko_ids: list[str], currency: str = "usd"
+    ) -> list[dict]:
+        """
+        Market data (including total supply) of up to 250 coin ids per page.
+        """
+        markets = []
+        page_size = 250
+        for i in range(0, len(coingecko_ids), page_size):
+            params = {
+                "vs_currency": currency,
+                "ids": ",".join(coingecko_ids[i : i + page_size]),
+                "per_page": page_size,
+            }
+            url = f"{self.api_url}/coins/markets"
+            response = self.make_request(url=url, params=params)
+            markets.extend(response.json())
+        return markets
+
     def current_price(
-        self, address: str, chain: str = "ethereum", currency="usd"
+        self, address: str, chain: str = DEFAULT_CHAIN, currency="usd"
     ):
         address = address.lower()
-        url = f"{self.api_url}/simple/token_price/{chain}?contract_addresses={address}&vs_currencies={currency}"
+        platform = get_chain(chain).coingecko_platform
+        url = f"{self.api_url}/simple/token_price/{platform}?contract_addresses={address}&vs_currencies={currency}"
         response = self.make_request(url=url)
         resp_js = response.json()
         return resp_js[address][currency]
 
+    def current_prices(
+        self,
+        addresses: list[str],
+        chain: str = DEFAULT_CHAIN,
+        currency: str = "usd",
+        page_size: int = 100,
+    ) -> dict[str, float]:
+        """
+        Current prices of many tokens of one chain, `page_size` tokens per
+        request. Returns: dict of lowercase address -> price
+        """
+        addresses = list(dict.fromkeys(a.lower() for a in addresses))
+        platform = get_chain(chain).coingecko_platform
+        url = f"{self.api_url}/simple/token_price/{platform}"
+        prices = {}
+        for i in range(0, len(addresses), page_size):
+            params = {
+                "contract_addresses": ",".join(addresses[i : i + page_size]),
+                "vs_currencies": currency,
+            }
+            response = self.make_request(url=url, params=params)
+            prices.update(
+                {
+                    address: quote[currency]
+                    for address, quote in response.json().items()
+                    if currency in quote
+                }
+            )
+        return prices
+
     def market_chart(
         self,
         address: str,
-        chain: str = "ethereum",
+        chain: str = DEFAULT_CHAIN,
         interval: str = "daily",
         currency: str = "usd",
     ):
-        chain_id = CoinGecko.CHAIN_IDS[chain]
-        url = f"{self.api_url}/coins/{chain_id}/contract/{address}/market_chart"
+        platform = get_chain(chain).coingecko_platform
+        url = (
+            f"{self.api_url}/coins/{platform}/contract/{address}/market_chart"
+        )
         params = {
             "vs_currency": currency,
             "days": "max",
@@ -136,15 +315,54 @@ class CoinGecko(API):
         if not response.ok:
             response.raise_for_status()
 
-        res_js = response.json()
         # results in the response json come in lists of timestamp, field value
-        res_js["date"] = [ms_to_dt(t) for t, _ in res_js["prices"]]
-        res_js["prices"] = [x for _, x in res_js["prices"]]
-        res_js["market_caps"] = [x for _, x in res_js["market_caps"]]
-        res_js["total_volumes"] = [x for _, x in res_js["total_volumes"]]
+        return market_chart_to_df(response.json(), interval)
 
-        df = pd.DataFrame(res_js).set_index("date")
-        return df
+    def market_chart_range(
+        self,
+        address: str,
+        start: float,
+        end: float,
+        chain: str = DEFAULT_CHAIN,
+        currency: str = "usd",
+    ) -> dict:
+        """
+        Raw market chart response between the unix timestamps start and end.
+        Ranges of at most 90 days come back at hourly granularity.
+        """
+        platform = get_chain(chain).coingecko_platform
+        url = f"{self.api_url}/coins/{platform}/contract/{address}/market_chart/range"
+        params = {"vs_currency": currency, "from": int(start), "to": int(end)}
+        response = self.make_request(url=url, params=params)
+        return response.json()
+
+    def hourly_market_chart(
+        self,
+        address: str,
+        start_date: str = "2022-07-01",
+        chain: str = DEFAULT_CHAIN,
+        currency: str = "usd",
+    ) -> pd.DataFrame:
+        """
+        Hourly prices, market caps and volumes since start_date. The history
+        is fetched in 90 day pages since CoinGecko downsamples longer ranges
+        to daily candles.
+        """
+        start = datetime.datetime.strptime(start_date, "%Y-%m-%d").timestamp()
+        end = time.time()
+        page = CoinGecko.HOURLY_RANGE_DAYS * 24 * 60 * 60
+        res_js = {"prices": [], "market_caps": [], "total_volumes": []}
+        while start < end:
+            page_js = self.market_chart_range(
+                address, start, min(start + page, end), chain, currency
+            )
+            for k in res_js:
+                res_js[k].extend(page_js[k])
+            start += page
+
+        df = market_chart_to_df(res_js, "hourly")
+        # pages share their boundary timestamp
+        return df[~df.index.duplicated(keep="last")]
 
     def ohlc(self, cg_token_id: str, currency: str = "usd"):
         url = (
@@ -170,45 +388,158 @@ class CoinGecko(API):
         return os.environ.get("COINGECKO_API_KEY")
 
 
-def token_from_symbol_or_address(input_str: str) -> Token:
+def token_from_coingecko(address: str, chain: str = DEFAULT_CHAIN) -> Token:
+    token_info = CoinGecko().token_info(address, chain)
+    platform = get_chain(chain).coingecko_platform
+    return Token(
+        symbol=token_info["symbol"],
+        decimals=token_info["detail_platforms"][platform]["decimal_place"],
+        address=normalize_address(address),
+        coingecko_id=token_info["id"],
+        total_supply=float(token_info["market_data"]["total_supply"]),
+        chain=chain,
+    )
+
+
+def token_from_symbol_or_address(
+    input_str: str,
+    registry: Optional[TokenRegistry] = None,
+    chain: str = DEFAULT_CHAIN,
+) -> Token:
     """
     Creates a Token object from an input symbol or address.
-    This assumes that the token is an erc20 on ethereum.
+    This assumes that the token is an erc20 on `chain`.
+    Tokens that are not in the token registry are fetched from CoinGecko
+    and cached in the registry.
 
     input_str: str representing a token symbol or token address
     """
-    if "0x" in input_str and len(input_str) == 42:
-        if input_str in ADDRESS_MAP:
-            return ADDRESS_MAP[input_str]
+    registry = registry or default_registry()
+    token = registry.lookup(input_str, chain)
+    if token is not None:
+        return token
+
+    if is_address(input_str):
         try:
-            token_info = CoinGecko().token_info(input_str)
-            symbol = token_info["symbol"]
-            decimals = token_info["detail_platforms"]["ethereum"][
-                "decimal_place"
-            ]
-            total_supply = float(token_info["market_data"]["total_supply"])
-            name = token_info["name"]
-            return Token(
-                symbol=symbol,
-                decimals=decimals,
-                address=input_str,
-                coingecko_id=name,
-                total_supply=total_supply,
-            )
+            token = token_from_coingecko(input_str, chain)
         except Exception as e:
             raise ValueError(
                 f"Could not find token for {input_str}. Exception: {e}"
             )
+        registry.add([token])
+        return token
     else:
-        if input_str not in SYMBOL_MAP:
-            raise ValueError(
-                "Unsupported token symbol. "
-                + "Please manually add the token to `tokens.py` before rerunning the script"
+        raise ValueError(
+            "Unsupported token symbol. "
+            + "Please manually add the token to `tokens.py` before rerunning the script"
+        )
+
+
+def resolve_addresses(
+    addresses: list[str],
+    registry: Optional[TokenRegistry] = None,
+    chain: str = DEFAULT_CHAIN,
+) -> dict[str, Token]:
+    """
+    Resolves many token addresses at once. Addresses missing from the
+    registry are resolved with a constant number of bulk CoinGecko requests
+    (the chain's token list, the coin list and one market page per 250
+    tokens) instead of one request per address, then cached in the registry.
+
+    Returns: dict mapping the normalized input addresses to Tokens.
+    Addresses CoinGecko does not know are left out.
+    """
+    registry = registry or default_registry()
+    missing = registry.missing(addresses, chain)
+    if missing:
+        log.info(f"Resolving {len(missing)} token addresses from CoinGecko")
+        cg = CoinGecko()
+        platform = get_chain(chain).coingecko_platform
+        wanted = set(missing)
+        decimals = {
+            normalize_address(t["address"]): t["decimals"]
+            for t in cg.token_list(chain)
+            if normalize_address(t["address"]) in wanted
+        }
+        ids = {}
+        for coin in cg.coins_list():
+            address = coin.get("platforms", {}).get(platform)
+            if address and normalize_address(address) in decimals:
+                ids[normalize_address(address)] = (coin["id"], coin["symbol"])
+
+        supplies = {
+            m["id"]: m["total_supply"]
+            for m in cg.coins_markets([cg_id for cg_id, _ in ids.values()])
+        }
+        registry.add(
+            Token(
+                symbol=symbol,
+                address=address,
+                decimals=decimals[address],
+                coingecko_id=cg_id,
+                total_supply=supplies.get(cg_id),
+                chain=chain,
             )
-        return SYMBOL_MAP[input_str]
+            for address, (cg_id, symbol) in ids.items()
+        )
+
+    resolved = {}
+    for address in addresses:
+        token = registry.by_address(address, chain)
+        if token is not None:
+            resolved[normalize_address(address)] = token
+    return resolved
+
+
+def token_total_supply(
+    token: Token, registry: Optional[TokenRegistry] = None
+) -> float:
+    """
+    Total supply of the token, from the registry while it is fresh.
+    """
+    registry = registry or default_registry()
+    supply = registry.total_supply(token)
+    if supply is None:
+        supply = token_from_coingecko(token.address, token.chain).total_supply
+        registry.add([Token(*token)._replace(total_supply=supply)])
+    return supply
+
+
+def current_price(addr: str, chain: str = DEFAULT_CHAIN) -> float:
+    """
+    Current usd price of a token, read from the run's price snapshot when
+    one is active (see `snapshot.activate_snapshot`).
+    """
+    snapshot = active_snapshot()
+    if snapshot is not None:
+        price = snapshot.price(addr, chain)
+        if price is not None:
+            return price
+        log.warning(f"{chain}:{addr} is missing from the price snapshot")
+    return _fetch_current_price(addr, chain)
 
 
 # We cache these values so that subsequent calls do not send CoinGecko API requests
 @lru_cache
-def current_price(addr: str) -> float:
-    return CoinGecko().current_price(addr)
+def _fetch_current_price(addr: str, chain: str = DEFAULT_CHAIN) -> float:
+    return CoinGecko().current_price(addr, chain)
+
+
+def take_price_snapshot(tokens: Iterable[Token]) -> PriceSnapshot:
+    """
+    Current prices of the tokens, one bulk request per chain (and per 100
+    tokens). Tokens CoinGecko has no price for are left out.
+    """
+    by_chain = {}
+    for t in tokens:
+        by_chain.setdefault(t.chain, set()).add(t.address.lower())
+    taken_at = time.time()
+    cg = CoinGecko()
+    prices = {
+        f"{chain}:{address}": price
+        for chain, addresses in by_chain.items()
+        for address, price in cg.current_prices(
+            sorted(addresses), chain=chain
+        ).items()
+    }
+    return PriceSnapshot(taken_at=taken_at, prices=prices)
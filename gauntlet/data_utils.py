@@ -1,27 +1,123 @@
 import json
+import os
 import pickle
+import threading
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from itertools import permutations
 from itertools import product
+from itertools import repeat
 from pathlib import Path
+from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Tuple
+from typing import Union
 
 import numpy as np
 import pandas as pd
 
+from .chains import usd_quote_token
 from .coingecko import CoinGecko
 from .constants import DRAWDOWN_PKL_PATH
 from .constants import PRICE_IMPACT_JSON_PATH
+from .constants import PRICES_DIR
+from .constants import SYMBOL_MAP
+from .io_utils import CACHE_LOCK
+from .io_utils import write_atomic
 from .logger import get_logger
+from .price_calendar import PriceCalendar
 from .price_impact import price_impact_size
+from .streaming import RATIO_CHUNK_SIZE
+from .streaming import stream_drawdowns
 from .tokens import Token
-from .tokens import Tokens
+from .tokens import token_id
 
 log = get_logger(__name__)
 CG = CoinGecko()
+# Market charts of `market_chart_once`, one future per series so that
+# concurrent callers wait for the same request
+_MARKET_CHARTS: dict[Tuple[str, str, Optional[str]], Future] = {}
+_MARKET_CHARTS_LOCK = threading.Lock()
+# Pairs whose drawdowns a worker process computes per task
+PAIR_BLOCK_SIZE = 32
+# Ratio series at least this long have their drawdown samples spilled to
+# disk (see `streaming.stream_drawdowns`) instead of held in memory
+STREAMING_MIN_OBS = 1 << 20
+
+Window = Union[int, str, pd.Timedelta]
+HistPrices = Union[PriceCalendar, dict[Token, pd.DataFrame]]
+
+
+def price_cache_path(token: Token, interval: str = "daily") -> Path:
+    """
+    Price store location of a token: one directory per chain, one csv per
+    token address and interval.
+    """
+    address = token.address.lower()
+    if interval == "daily":
+        return PRICES_DIR / token.chain / f"{address}.csv"
+    return PRICES_DIR / token.chain / f"{address}_{interval}.csv"
+
+
+def drawdown_cache_path(interval: str = "daily") -> Path:
+    if interval == "daily":
+        return DRAWDOWN_PKL_PATH
+    return DRAWDOWN_PKL_PATH.with_name(
+        f"{DRAWDOWN_PKL_PATH.stem}_{interval}{DRAWDOWN_PKL_PATH.suffix}"
+    )
+
+
+def fetch_market_chart(
+    token: Token, interval: str = "daily", start_date="2022-07-01"
+) -> pd.DataFrame:
+    """
+    Historical prices of the token at the given interval (daily or hourly).
+    """
+    if interval == "hourly":
+        return CG.hourly_market_chart(
+            token.address, start_date=start_date, chain=token.chain
+        )
+    return CG.market_chart(token.address, chain=token.chain, interval=interval)
+
+
+def market_chart_once(
+    token: Token, interval: str = "daily", start_date="2022-07-01"
+) -> pd.DataFrame:
+    """
+    `fetch_market_chart` fetched at most once per process: every pair,
+    market and call of a run that needs the series of a token shares one
+    request, including concurrent callers (ex: the chain workers of
+    `evaluate_universes`), which wait for the first one. Failed fetches are
+    not kept, so the next call retries. The DataFrame is shared, callers
+    must not modify it.
+    """
+    # daily charts are fetched in full whatever the start date
+    key = (
+        token_id(token),
+        interval,
+        start_date if interval == "hourly" else None,
+    )
+    with _MARKET_CHARTS_LOCK:
+        future = _MARKET_CHARTS.get(key)
+        owner = future is None
+        if owner:
+            future = _MARKET_CHARTS[key] = Future()
+    if owner:
+        try:
+            future.set_result(fetch_market_chart(token, interval, start_date))
+        except Exception as e:
+            with _MARKET_CHARTS_LOCK:
+                del _MARKET_CHARTS[key]
+            future.set_exception(e)
+    return future.result()
 
 
 def get_prices(
-    tokens: List[Token], start_date="2022-07-01", update_cache=False
+    tokens: List[Token],
+    start_date="2022-07-01",
+    update_cache=False,
+    interval: str = "daily",
 ) -> dict[Token, pd.DataFrame]:
     """
     Queries the CoinGecko api for the historical price data of the
@@ -29,17 +125,16 @@ def get_prices(
     saves the resulting price DataFrames to csvs.
 
     Returns: a dict mapping Token objects to dataframes of its historical
-        daily prices, starting from the input start_date
+        daily (or hourly) prices, starting from the input start_date
     """
     prices = {}
     for t in tokens:
-        path = Path(__file__).parent.parent / f"prices/{t.symbol}.csv"
-        df = CG.market_chart(t.address)
+        df = market_chart_once(t, interval, start_date)
         df = df[start_date:]
         prices[t] = df
 
         if update_cache:
-            df.to_csv(path)
+            save_prices(t, df, interval)
 
     return prices
 
@@ -54,86 +149,318 @@ def calc_drawdown(window: pd.Series) -> float:
     return (max(window) - window[-1]) / max(window)
 
 
+def rolling_drawdowns(prices: pd.Series, window: Window) -> pd.Series:
+    """
+    Vectorized equivalent of `prices.rolling(window).apply(calc_drawdown)`
+    with the leading incomplete windows dropped. The rolling max runs in
+    pandas' compiled rolling code instead of calling back into python for
+    every window, so the cost stays linear in the number of observations.
+
+    prices: pd.Series, price (or price ratio) series
+    window: int number of observations per window, or a time offset
+        (ex: "4h", "1D", pd.Timedelta) for time based windows. Time based
+        windows include both endpoints, so a "1D" window on daily data
+        spans 2 observations like `calc_drawdown` over `rolling(2)`. They
+        require the index to be parseable as datetimes.
+    """
+    if isinstance(window, int):
+        roll_max = prices.rolling(window).max()
+        return ((roll_max - prices) / roll_max).iloc[window - 1 :]
+
+    offset = pd.Timedelta(window)
+    prices = prices.set_axis(pd.to_datetime(prices.index))
+    roll_max = prices.rolling(offset, closed="both").max()
+    dds = (roll_max - prices) / roll_max
+    return dds[dds.index >= dds.index[0] + offset]
+
+
+def horizon_window(horizon: Window, interval: str = "daily") -> Window:
+    """
+    Rolling window spec for a drawdown horizon. Integer horizons are in
+    days: on daily data they span `horizon + 1` observations (the
+    convention used for the cached drawdowns), on intraday data they become
+    a time based window. Other horizons are passed through as time offsets.
+    """
+    if not isinstance(horizon, int):
+        return horizon
+    if interval == "daily":
+        return horizon + 1
+    return pd.Timedelta(days=horizon)
+
+
+def pair_ratio(
+    t1: Token,
+    t2: Token,
+    hist_prices: Optional[HistPrices] = None,
+    start_date="2022-07-01",
+) -> pd.Series:
+    """
+    Price series of t1 denominated in t2, over the dates of the master
+    calendar (see `PriceCalendar`) both prices are valid.
+
+    hist_prices: PriceCalendar, or dict of Token -> historical prices, in
+        which case a calendar of the two tokens is built. Tokens missing
+        from it are fetched.
+    """
+    if isinstance(hist_prices, PriceCalendar):
+        if t1 in hist_prices and t2 in hist_prices:
+            return hist_prices.ratio(t1, t2, start_date)
+        hist_prices = None
+
+    pair = {t: (hist_prices or {}).get(t) for t in (t1, t2)}
+    for t, df in pair.items():
+        if df is None:
+            pair[t] = market_chart_once(t)
+    return PriceCalendar.from_prices(pair, start_date).ratio(t1, t2)
+
+
 def compute_pair_drawdown(
     t1: Token,
     t2: Token,
-    hist_prices: Optional[dict[Token, pd.DataFrame]] = None,
+    hist_prices: Optional[HistPrices] = None,
     percentile_drawdowns: list[float] = [90, 95, 99],
-    days: list[int] = [1, 7, 14, 30],
+    days: list[Window] = [1, 7, 14, 30],
     start_date="2022-07-01",
+    interval: str = "daily",
+    streaming_min_obs: int = STREAMING_MIN_OBS,
 ) -> dict[dict[int, dict[int, float]]]:
     """
     Computes various percentile drawdowns over a time horizon of some number
     of days, as specified by the input drawdowns, days lists.
 
-    df: pd.DataFrame, dataframe of prices of a given token
+    hist_prices: PriceCalendar or dict of historical prices, see
+        `pair_ratio`
     percentile_drawdowns: list[int], percentile of drawdowns to compute
-    days: list[int], time horizon to consider for the drawdowns (in days)
-    """
-    if hist_prices and t1 in hist_prices and t2 in hist_prices:
-        t1_prices = hist_prices[t1]["prices"][start_date:]
-        t2_prices = hist_prices[t2]["prices"][start_date:]
-    else:
-        t1_prices = CG.market_chart(t1)["prices"][start_date:]
-        t2_prices = CG.market_chart(t2)["prices"][start_date:]
-
-    n = min(len(t1_prices), len(t2_prices))
-    ratio = (t1_prices[-n:] / t2_prices[-n:]).dropna()
-
-    dds = {
-        d: {
-            p: np.percentile(ratio.rolling(d + 1).apply(calc_drawdown)[d:], p)
-            for p in percentile_drawdowns
-        }
-        for d in days
+    days: list[int], time horizon to consider for the drawdowns (in days).
+        Time offsets such as "4h" are also accepted, see `horizon_window`.
+    interval: str, granularity of hist_prices (daily or hourly)
+    streaming_min_obs: int, ratios with at least this many observations
+        go through `stream_drawdowns`, whose memory does not grow with the
+        history. Its horizons are counted in observations, which matches
+        the time based hourly windows on gap free histories.
+    """
+    ratio = pair_ratio(t1, t2, hist_prices, start_date)
+    if len(ratio) >= streaming_min_obs:
+        values = ratio.to_numpy()
+        chunks = (
+            values[i : i + RATIO_CHUNK_SIZE]
+            for i in range(0, len(values), RATIO_CHUNK_SIZE)
+        )
+        return stream_drawdowns(chunks, percentile_drawdowns, days, interval)
+
+    dds = {}
+    for d in days:
+        dd = rolling_drawdowns(ratio, horizon_window(d, interval))
+        dds[d] = dict(
+            zip(percentile_drawdowns, np.percentile(dd, percentile_drawdowns))
+        )
+    return dds
+
+
+# Price calendar of a pair drawdown worker process, see `_attach_calendar`
+_WORKER_CALENDAR: Optional[PriceCalendar] = None
+
+
+def _attach_calendar(calendar: PriceCalendar):
+    global _WORKER_CALENDAR
+    _WORKER_CALENDAR = calendar
+
+
+def _pair_drawdown_block(
+    pairs: list[Tuple[Token, Token]],
+    interval: str,
+    hist_prices: Optional[PriceCalendar] = None,
+) -> dict[Tuple[str, str], dict]:
+    hist_prices = hist_prices or _WORKER_CALENDAR
+    return {
+        (token_id(t1), token_id(t2)): compute_pair_drawdown(
+            t1, t2, hist_prices, interval=interval
+        )
+        for t1, t2 in pairs
     }
+
+
+def compute_pair_drawdowns(
+    pairs: Iterable[Tuple[Token, Token]],
+    hist_prices: PriceCalendar,
+    interval: str = "daily",
+    processes: int = 0,
+    block_size: int = PAIR_BLOCK_SIZE,
+) -> dict[Tuple[str, str], dict]:
+    """
+    `compute_pair_drawdown` of every (collateral, debt) pair, keyed by
+    `token_id` pairs. The pairs are split into blocks of `block_size`
+    pairs computed by a pool of `processes` worker processes. Each worker
+    receives the price calendar once when it starts, so tasks only carry
+    their pairs. With 0 processes, or a single block, the drawdowns are
+    computed in this process.
+    """
+    pairs = list(pairs)
+    if not processes or len(pairs) <= block_size:
+        return _pair_drawdown_block(pairs, interval, hist_prices)
+
+    blocks = [
+        pairs[i : i + block_size] for i in range(0, len(pairs), block_size)
+    ]
+    dds = {}
+    with ProcessPoolExecutor(
+        processes, initializer=_attach_calendar, initargs=(hist_prices,)
+    ) as pool:
+        for block in pool.map(_pair_drawdown_block, blocks, repeat(interval)):
+            dds.update(block)
     return dds
 
 
+def empirical_pct_decrease(ratio: pd.Series, window: Window = "1h") -> float:
+    """
+    Derives the sim's per step price decrease from the data: the mean
+    drawdown of the price ratio over one liquidation timestep `window`.
+    """
+    return float(rolling_drawdowns(ratio, window).mean())
+
+
+def get_pct_decreases(
+    tokens: List[Token],
+    window: Window = "1h",
+    interval: str = "hourly",
+    start_date="2022-07-01",
+) -> dict[Tuple[str, str], float]:
+    """
+    Empirical `pct_decrease` (see `empirical_pct_decrease`) for every
+    ordered pair of the input tokens, keyed by `token_id` pairs.
+    """
+    hist_prices = PriceCalendar.from_prices(
+        {t: market_chart_once(t, interval, start_date) for t in tokens},
+        start_date,
+    )
+    return {
+        (token_id(t1), token_id(t2)): empirical_pct_decrease(
+            pair_ratio(t1, t2, hist_prices, start_date), window
+        )
+        for (t1, t2) in product(tokens, repeat=2)
+        if t1 != t2
+    }
+
+
+def _migrate_key(key: str) -> str:
+    """
+    Caches written before chains were supported are keyed by the symbols of
+    the statically defined (ethereum) `Tokens`, map them to token ids.
+    """
+    token = SYMBOL_MAP.get(key)
+    return token_id(token) if token is not None else key
+
+
+def load_drawdown_cache(path: Path) -> dict[Tuple[str, str], dict]:
+    if not path.exists():
+        return {}
+    with open(path, "rb") as f:
+        dds = pickle.load(f)
+    return {
+        (_migrate_key(k1), _migrate_key(k2)): v for (k1, k2), v in dds.items()
+    }
+
+
+def load_swap_size_cache(path: Path) -> dict[str, dict[str, float]]:
+    if not path.exists():
+        return {}
+    with open(path, "r") as json_file:
+        sizes = json.load(json_file)
+    return {_migrate_key(k): v for k, v in sizes.items()}
+
+
+def save_drawdown_cache(dds: dict[Tuple[str, str], dict], path: Path):
+    write_atomic(path, lambda f: pickle.dump(dds, f), mode="wb")
+
+
+def save_swap_size_cache(sizes: dict[str, dict[str, float]], path: Path):
+    write_atomic(path, lambda f: json.dump(sizes, f, indent=4))
+
+
+def update_drawdown_cache(dds: dict[Tuple[str, str], dict], path: Path):
+    """
+    Merges `dds` into the drawdown cache at `path`. Concurrent updates of
+    the cache are serialized so that none of them is lost.
+    """
+    with CACHE_LOCK:
+        cached = load_drawdown_cache(path)
+        cached.update(dds)
+        save_drawdown_cache(cached, path)
+
+
+def update_swap_size_cache(
+    sizes: dict[str, dict[str, float]], path: Path = PRICE_IMPACT_JSON_PATH
+):
+    """
+    Merges the swap sizes of each token id into the swap size cache at
+    `path`, see `update_drawdown_cache`.
+    """
+    with CACHE_LOCK:
+        cached = load_swap_size_cache(path)
+        for tid, impacts in sizes.items():
+            cached.setdefault(tid, {}).update(impacts)
+        save_swap_size_cache(cached, path)
+
+
+def save_prices(token: Token, df: pd.DataFrame, interval: str = "daily"):
+    write_atomic(price_cache_path(token, interval), df.to_csv)
+
+
 def get_drawdowns(
-    tokens: List[Token], update_cache: bool = False, use_cache: bool = False
-) -> dict[Token, dict[int, dict[float, float]]]:
+    tokens: List[Token],
+    update_cache: bool = False,
+    use_cache: bool = False,
+    interval: str = "daily",
+    pairs: Optional[Iterable[Tuple[Token, Token]]] = None,
+    processes: int = 0,
+) -> dict[Tuple[str, str], dict[int, dict[float, float]]]:
     """
     tokens: list of tokens
     update_cache: bool, if true, this function will update the cached drawdown
         file with the new drawdown numbers.
+    interval: str, granularity of the price history (daily or hourly). Each
+        interval has its own cache file.
+    pairs: (collateral, debt) token pairs to compute, defaults to every
+        ordered pair of the input tokens
+    processes: int, number of worker processes the drawdowns are computed
+        over (see `compute_pair_drawdowns`). 0 computes them in this process.
 
     Computes historical drawdown numbers between all pairs of tokens within the
-    input tokens list.
+    input tokens list. Drawdowns are keyed by `token_id` pairs. Only the
+    pairs missing from the cache are computed (every pair if
+    `update_cache`), from the price series of their tokens, each fetched
+    once (see `market_chart_once`).
     """
     dd_dict = {}
+    cache_path = drawdown_cache_path(interval)
 
     # Load cache if use_cache is True
     if use_cache:
-        with open(DRAWDOWN_PKL_PATH, "rb") as f:
-            dd_dict = pickle.load(f)
+        dd_dict = load_drawdown_cache(cache_path)
 
-    # If update_cache or tokens are missing from cache, calculate drawdowns
-    if update_cache or any(
-        (t1.symbol, t2.symbol) not in dd_dict
-        for (t1, t2) in product(tokens, repeat=2)
+    if pairs is None:
+        pairs = permutations(dict.fromkeys(tokens), 2)
+    missing = [
+        (t1, t2)
+        for t1, t2 in dict.fromkeys(pairs)
         if t1 != t2
-    ):
-        hist_prices = {t: CG.market_chart(t.address) for t in tokens}
-        dd_dict.update(
-            {
-                (t1.symbol, t2.symbol): compute_pair_drawdown(
-                    t1, t2, hist_prices
-                )
-                for (t1, t2) in product(tokens, repeat=2)
-                if t1 != t2
-            }
-        )
-
-        if update_cache:
-            with open(DRAWDOWN_PKL_PATH, "rb") as f:
-                orig_dds = pickle.load(f)
-
-            orig_dds.update(dd_dict)
+        and (update_cache or (token_id(t1), token_id(t2)) not in dd_dict)
+    ]
+    if not missing:
+        return dd_dict
+
+    hist_prices = PriceCalendar.from_prices(
+        {
+            t: market_chart_once(t, interval)
+            for t in dict.fromkeys(t for pair in missing for t in pair)
+        }
+    )
+    dds = compute_pair_drawdowns(missing, hist_prices, interval, processes)
+    dd_dict.update(dds)
+    log.debug(f"Computed {len(dds)} {interval} pair drawdowns")
 
-            # Write the updated data directly back to the file
-            with open(DRAWDOWN_PKL_PATH, "wb") as f:
-                pickle.dump(dd_dict, f)
+    if update_cache:
+        update_drawdown_cache(dds, cache_path)
 
     return dd_dict
 
@@ -143,7 +470,7 @@ def get_price_impacts(
     impacts: list[float] = [0.005, 0.25],
     update_cache: bool = False,
     use_cache: bool = False,
-) -> dict[Token, dict[float, float]]:
+) -> dict[str, dict[str, float]]:
     """
     Computes the swap sizes necessary to incur the given price impacts
     from the input impacts list.
@@ -154,44 +481,39 @@ def get_price_impacts(
     update_cache: bool, whether or not to update the price impact cache file
     use_cache: bool, whether or not to just return the cache of impact sizes
 
-    Returns: dict mapping Tokens to a dict of
+    Returns: dict mapping token ids (see `token_id`) to a dict of
         price impact -> size of swap necessary to incur the given price impact
 
     Example return:
     {
-        tokenA: {0.005: 1000, 0.25: 100000}
-        tokenB: {0.005: 300, 0.25: 50000}
+        "ethereum:0xa...": {"0.005": 1000, "0.25": 100000}
+        "base:0xb...": {"0.005": 300, "0.25": 50000}
     }
-    This return indicates that swapping 1000 tokens of tokenA for USDC will
-    incur 0.5% slippage.
+    This return indicates that swapping 1000 tokens of tokenA for the
+    chain's USD stablecoin will incur 0.5% slippage.
     """
     impact_sizes = {}
 
     if use_cache:
-        with open(PRICE_IMPACT_JSON_PATH, "r") as json_file:
-            impact_sizes = json.load(json_file)
+        impact_sizes = load_swap_size_cache(PRICE_IMPACT_JSON_PATH)
 
     # If update_cache or tokens are missing, calculate impacts
-    if update_cache or any(tok.symbol not in impact_sizes for tok in tokens):
+    if update_cache or any(
+        token_id(tok) not in impact_sizes for tok in tokens
+    ):
         log.info("Computing price impacts. This may take 1-2 minutes.")
         for tok in tokens:
-            impact_sizes[tok.symbol] = {}
-            tgt = Tokens.USDT if tok == Tokens.USDC else Tokens.USDC
+            impact_sizes[token_id(tok)] = {}
+            tgt = usd_quote_token(tok)
 
             for i in impacts:
-                impact_sizes[tok.symbol][str(i)] = price_impact_size(
+                impact_sizes[token_id(tok)][str(i)] = price_impact_size(
                     tok, tgt, i
                 )
 
         log.info("Finished computing price impacts.")
 
         if update_cache:
-            # Write the updated data directly back to the file
-            with open(PRICE_IMPACT_JSON_PATH, "r") as json_file:
-                orig_impacts = json.load(json_file)
-
-            orig_impacts.update(impact_sizes)
-            with open(PRICE_IMPACT_JSON_PATH, "w") as json_file:
-                json.dump(orig_impacts, json_file, indent=4)
+            update_swap_size_cache(impact_sizes, PRICE_IMPACT_JSON_PATH)
 
     return impact_sizes
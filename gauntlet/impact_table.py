@@ -0,0 +1,135 @@
+from typing import NamedTuple
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from .tokens import Token
+from .tokens import token_id
+
+# Resolution and range of the tabulated price impacts
+IMPACT_STEP = 1e-4
+MAX_IMPACT = 0.5
+
+ArrayLike = Union[float, np.ndarray]
+
+
+class ImpactTable(NamedTuple):
+    """
+    Swap size (in tokens) that incurs each price impact of a uniform grid
+    of impacts (0, step, 2 * step, ...), so the size of any impact is an
+    O(1) lookup.
+    """
+
+    sizes: np.ndarray
+    step: float = IMPACT_STEP
+
+    @classmethod
+    def from_swap_sizes(
+        cls,
+        swap_sizes: dict[str, float],
+        step: float = IMPACT_STEP,
+        max_impact: float = MAX_IMPACT,
+    ) -> "ImpactTable":
+        """
+        Tabulates the cached swap sizes of a token (price impact -> swap
+        size, see `get_price_impacts`). Price impact is close to a power
+        law of the swap size, so sizes are interpolated linearly in log-log
+        space between the cached impacts. Below the smallest cached impact
+        the impact is linear in the size, and sizes are capped at the
+        largest cached one.
+        """
+        points = sorted((float(i), s) for i, s in swap_sizes.items())
+        impacts = np.array([i for i, _ in points])
+        sizes = np.array([s for _, s in points], dtype=np.float64)
+        grid = np.arange(0, max_impact + step / 2, step)
+
+        table = np.empty(len(grid))
+        small = grid < impacts[0]
+        table[small] = sizes[0] * grid[small] / impacts[0]
+        table[~small] = np.exp(
+            np.interp(np.log(grid[~small]), np.log(impacts), np.log(sizes))
+        )
+        return cls(sizes=table, step=step)
+
+    def size_at(self, impact: ArrayLike) -> ArrayLike:
+        """
+        Swap size incurring `impact`, linearly interpolated between the
+        two nearest grid points.
+        """
+        pos = np.clip(np.asarray(impact) / self.step, 0, len(self.sizes) - 1)
+        lo = np.minimum(pos.astype(int), len(self.sizes) - 2)
+        frac = pos - lo
+        size = self.sizes[lo] * (1 - frac) + self.sizes[lo + 1] * frac
+        return size if np.ndim(size) else float(size)
+
+
+def repay_from_sizes(
+    collateral_size: ArrayLike,
+    debt_size_usd: ArrayLike,
+    liq_bonus: ArrayLike,
+    collateral_price: ArrayLike,
+) -> ArrayLike:
+    """
+    Largest debt (usd) a liquidator repays when selling `collateral_size`
+    collateral tokens and buying `debt_size_usd` of debt tokens are the
+    largest swaps whose price impact stays within the liquidation bonus.
+    """
+    return np.minimum(
+        collateral_size * collateral_price / (1 + liq_bonus), debt_size_usd
+    )
+
+
+class MarketLiquidity(NamedTuple):
+    """
+    Impact tables of a market's collateral and debt tokens, from which the
+    sim derives a repay amount at each step instead of using a fixed one
+    (see `repay_amount`).
+    """
+
+    collateral: ImpactTable
+    debt: ImpactTable
+    debt_price: float
+
+    def sizes(self, liq_bonus: ArrayLike) -> Tuple[ArrayLike, ArrayLike]:
+        """
+        (collateral tokens, debt usd) a liquidator can swap before slippage
+        eats the liquidation bonus.
+        """
+        return (
+            self.collateral.size_at(liq_bonus),
+            self.debt.size_at(liq_bonus) * self.debt_price,
+        )
+
+    def repay_amount(
+        self, liq_bonus: ArrayLike, collateral_price: ArrayLike
+    ) -> ArrayLike:
+        """
+        Largest debt (usd) a liquidator repays before slippage eats the
+        liquidation bonus: buying the repaid debt tokens and selling the
+        claimed collateral (repay * (1 + liq_bonus) usd) must each move
+        the price by at most liq_bonus. The collateral leg is valued at
+        the current, drawn down, `collateral_price`, so the repay amount
+        shrinks as the crash deepens.
+        """
+        return repay_from_sizes(
+            *self.sizes(liq_bonus), liq_bonus, collateral_price
+        )
+
+
+def market_liquidity(
+    collateral_token: Token,
+    debt_token: Token,
+    price_impacts: dict[str, dict[str, float]],
+    debt_price: float,
+) -> MarketLiquidity:
+    """
+    `MarketLiquidity` from the cached swap sizes of `get_price_impacts`.
+    """
+    return MarketLiquidity(
+        collateral=ImpactTable.from_swap_sizes(
+            price_impacts[token_id(collateral_token)]
+        ),
+        debt=ImpactTable.from_swap_sizes(price_impacts[token_id(debt_token)]),
+        debt_price=debt_price,
+    )
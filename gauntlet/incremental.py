@@ -0,0 +1,198 @@
+import hashlib
+import json
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+from typing import Union
+
+import numpy as np
+
+from .constants import RECOMMENDATIONS_JSON_PATH
+from .io_utils import write_atomic
+from .logger import get_logger
+from .runner import evaluate_universes
+from .runner import find_optimal_lltv
+from .runner import LLTVS
+from .runner import log_result
+from .runner import Market
+from .runner import market_inputs
+from .runner import MarketParams
+from .runner import resolve_markets
+from .runner import Result
+from .tokens import token_id
+
+log = get_logger(__name__)
+
+# Largest relative change of a market input that keeps the last
+# recommendation. Per input tolerances (keyed as in `normalized_inputs`)
+# can be given as a dict.
+DEFAULT_RTOL = 0.02
+
+Tolerance = Union[float, dict[str, float]]
+
+
+@dataclass
+class Recommendation:
+    """
+    Last LLTV recommendation of a market with the inputs it was derived
+    from. `fingerprint` identifies the sim settings, which must match
+    exactly for the recommendation to be reused.
+    """
+
+    lltv: Optional[float]
+    liq_incentive: Optional[float]
+    params: dict[str, float]
+    fingerprint: str
+    computed_at: float
+
+    @property
+    def result(self) -> Result:
+        return self.lltv, self.liq_incentive
+
+
+def sim_fingerprint(lltvs: np.ndarray = LLTVS, **sim_kwargs) -> str:
+    """
+    Hash of the settings passed to `find_optimal_lltv` (everything but the
+    market params).
+    """
+    settings = dict(sorted(sim_kwargs.items()), lltvs=np.round(lltvs, 6))
+    blob = json.dumps({k: np.asarray(v).tolist() for k, v in settings.items()})
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def market_key(collateral_token, debt_token) -> str:
+    return f"{token_id(collateral_token)}/{token_id(debt_token)}"
+
+
+def normalized_inputs(params: dict[str, float]) -> dict[str, float]:
+    """
+    Inputs the optimal LLTV depends on. The sim is scale free (see
+    `lltv_table`): only the repay amount / position size ratio and the
+    drawdown matter, so price moves that scale both USD amounts do not.
+    """
+    return {
+        "repay_ratio": params["repay_amount_usd"]
+        / params["initial_collateral_usd"],
+        "max_drawdown": params["max_drawdown"],
+    }
+
+
+def inputs_changed(
+    prev: dict[str, float], params: MarketParams, rtol: Tolerance
+) -> bool:
+    """
+    True if any normalized input of the market moved by more than its
+    relative tolerance since `prev` was recorded.
+    """
+    old_inputs = normalized_inputs(prev)
+    for name, new in normalized_inputs(asdict(params)).items():
+        tol = rtol.get(name, DEFAULT_RTOL) if isinstance(rtol, dict) else rtol
+        old = old_inputs[name]
+        if abs(new - old) > tol * abs(old):
+            return True
+    return False
+
+
+def load_recommendations(
+    path: Path = RECOMMENDATIONS_JSON_PATH,
+) -> dict[str, Recommendation]:
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return {k: Recommendation(**v) for k, v in json.load(f).items()}
+
+
+def save_recommendations(
+    recommendations: dict[str, Recommendation],
+    path: Path = RECOMMENDATIONS_JSON_PATH,
+):
+    records = {k: asdict(v) for k, v in recommendations.items()}
+    write_atomic(path, lambda f: json.dump(records, f, indent=4))
+
+
+def evaluate_markets_incremental(
+    markets: list[Market],
+    recommendations: dict[str, Recommendation],
+    rtol: Tolerance = DEFAULT_RTOL,
+    force: bool = False,
+    interval: str = "daily",
+    update_cache: bool = False,
+    use_cache: bool = True,
+    **sim_kwargs,
+) -> dict[Market, Result]:
+    """
+    `evaluate_markets` that only reruns the LLTV search of the markets of
+    one chain whose inputs changed. The inputs of every market are derived
+    from the cached swap sizes and drawdowns and the current prices, then
+    compared to the inputs of the last recommendation: markets whose sim
+    settings are unchanged and whose inputs all moved less than `rtol`
+    keep their recommendation. `recommendations` is updated in place.
+
+    force: bool, recompute every market
+    """
+    fingerprint = sim_fingerprint(**sim_kwargs)
+    pairs = resolve_markets(markets)
+    params = market_inputs(pairs, interval, update_cache, use_cache)
+
+    results = {}
+    n_reused = 0
+    for mkt in markets:
+        key = market_key(*pairs[mkt])
+        prev = recommendations.get(key)
+        if (
+            not force
+            and prev is not None
+            and prev.fingerprint == fingerprint
+            and not inputs_changed(prev.params, params[mkt], rtol)
+        ):
+            results[mkt] = prev.result
+            n_reused += 1
+            continue
+
+        lltv, li = find_optimal_lltv(params[mkt], **sim_kwargs)
+        recommendations[key] = Recommendation(
+            lltv=None if lltv is None else float(lltv),
+            liq_incentive=None if li is None else float(li),
+            params=asdict(params[mkt]),
+            fingerprint=fingerprint,
+            computed_at=time.time(),
+        )
+        results[mkt] = recommendations[key].result
+        log_result(mkt, results[mkt])
+
+    log.info(
+        f"Reused {n_reused} / {len(markets)} recommendations,"
+        + f" recomputed {len(markets) - n_reused}"
+    )
+    return results
+
+
+def update_recommendations(
+    markets: Iterable[Market],
+    rtol: Tolerance = DEFAULT_RTOL,
+    path: Path = RECOMMENDATIONS_JSON_PATH,
+    max_workers: Optional[int] = None,
+    **kwargs,
+) -> dict[Market, Result]:
+    """
+    Incremental counterpart of `evaluate_universes`: loads the persisted
+    recommendations, recomputes the markets whose inputs crossed `rtol`
+    and persists the updated recommendations.
+
+    kwargs: passed to `evaluate_markets_incremental`
+    """
+    recommendations = load_recommendations(path)
+    # Each chain worker only writes the keys of its own markets
+    results = evaluate_universes(
+        markets,
+        max_workers,
+        evaluate=evaluate_markets_incremental,
+        recommendations=recommendations,
+        rtol=rtol,
+        **kwargs,
+    )
+    save_recommendations(recommendations, path)
+    return results
@@ -0,0 +1,26 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable
+
+# Serializes the read-modify-write of the shared cache files when markets
+# of several chains are evaluated concurrently
+CACHE_LOCK = threading.Lock()
+
+
+def write_atomic(path: Path, write: Callable, mode: str = "w"):
+    """
+    Writes a file through `write(f)` into a temporary file that replaces
+    `path` once complete, so readers never see a partially written cache.
+    Each write has its own temporary file, which is removed if it fails.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name)
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
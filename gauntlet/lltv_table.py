@@ -0,0 +1,332 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from .bounds import last_solvent_index
+from .constants import LLTV_TABLE_PATH
+from .io_utils import write_atomic
+from .logger import get_logger
+from .runner import find_optimal_lltv
+from .runner import liquidation_bonuses
+from .runner import LLTVS
+from .runner import MarketParams
+from .runner import Result
+
+log = get_logger(__name__)
+
+# Bump whenever a change of the sim changes its results, tables built by
+# older versions are then ignored
+LLTV_TABLE_VERSION = 1
+
+# Default grid: repay amount / initial collateral and max drawdown
+REPAY_RATIOS = np.geomspace(1e-4, 1, 241)
+MAX_DRAWDOWNS = np.round(np.arange(0.02, 0.951, 0.01), 2)
+PCT_DECREASES = (0.005,)
+# Position size the grid is simulated at. The sim is scale invariant up to
+# its absolute tolerances, which are negligible at whale position sizes.
+REFERENCE_COLLATERAL_USD = 1e8
+
+
+@dataclass
+class LLTVTable:
+    """
+    Optimal LLTV over a grid of the dimensionless sim inputs.
+
+    `simulate_insolvency` is invariant to the scale of the position and of
+    the prices, so with fixed liquidation incentive parameters (m, beta,
+    min_liq_bonus) and LLTV candidates, the optimal LLTV only depends on
+    the repay amount / initial collateral ratio, the max drawdown and
+    pct_decrease. The table stores the index (in `lltvs`, -1 if none is
+    solvent) of the optimal LLTV at every grid point, one (repay ratio,
+    max drawdown) grid per tabulated pct_decrease.
+
+    The optimal LLTV increases with the repay ratio and decreases with the
+    max drawdown, so the optimal LLTV of an input inside a grid cell lies
+    between the values of two opposite corners of the cell. `lookup`
+    returns the lower, conservative, corner when the two are close enough.
+    """
+
+    repay_ratios: np.ndarray
+    max_drawdowns: np.ndarray
+    pct_decreases: np.ndarray
+    # (n_pct_decreases, n_repay_ratios, n_max_drawdowns) LLTV indices
+    lltv_index: np.ndarray
+    lltvs: np.ndarray
+    m: float
+    beta: float
+    min_liq_bonus: float
+    version: int = LLTV_TABLE_VERSION
+
+    def matches(
+        self,
+        m: float,
+        beta: float,
+        min_liq_bonus: float,
+        lltvs: np.ndarray,
+    ) -> bool:
+        return (
+            self.version == LLTV_TABLE_VERSION
+            and np.isclose([m, beta, min_liq_bonus], self.settings).all()
+            and len(lltvs) == len(self.lltvs)
+            and np.allclose(lltvs, self.lltvs)
+        )
+
+    @property
+    def settings(self) -> list[float]:
+        return [self.m, self.beta, self.min_liq_bonus]
+
+    def bracket(
+        self, params: MarketParams, pct_decrease: float = 0.005
+    ) -> Optional[Tuple[int, int]]:
+        """
+        (lowest, highest) index the optimal LLTV of the market can have,
+        from the corners of the grid cell of its inputs (-1 if no LLTV is
+        solvent). None if the inputs are outside of the table's domain.
+        """
+        k = np.flatnonzero(np.isclose(self.pct_decreases, pct_decrease))
+        ratio = params.repay_amount_usd / params.initial_collateral_usd
+        dd = params.max_drawdown
+        if (
+            not len(k)
+            or not self.repay_ratios[0] <= ratio <= self.repay_ratios[-1]
+            or not self.max_drawdowns[0] <= dd <= self.max_drawdowns[-1]
+        ):
+            return None
+
+        grid = self.lltv_index[k[0]]
+        i = _cell(self.repay_ratios, ratio)
+        j = _cell(self.max_drawdowns, dd)
+        # smallest repay ratio and largest drawdown of the cell, then the
+        # opposite corner
+        return int(grid[i, j + 1]), int(grid[i + 1, j])
+
+    def lookup(
+        self,
+        params: MarketParams,
+        pct_decrease: float = 0.005,
+        max_error: float = 0.0,
+    ) -> Optional[Result]:
+        """
+        Optimal (LLTV, liquidation incentive) of the market from the table,
+        or None if the inputs are outside of the table's domain or the
+        LLTV range of their grid cell (see `bracket`) is wider than
+        `max_error`.
+        """
+        bracket = self.bracket(params, pct_decrease)
+        if bracket is None:
+            return None
+        lo, hi = bracket
+        if lo < 0:
+            return (None, None) if hi < 0 else None
+        if self.lltvs[hi] - self.lltvs[lo] > max_error + 1e-9:
+            return None
+        return self.result(lo)
+
+    def result(self, index: Optional[int]) -> Result:
+        if index is None or index < 0:
+            return None, None
+        lltv = self.lltvs[index]
+        bonus = liquidation_bonuses(
+            [lltv], self.m, self.beta, self.min_liq_bonus
+        )[0]
+        return lltv, bonus
+
+    def save(self, path: Path = LLTV_TABLE_PATH):
+        meta = {
+            "version": self.version,
+            "m": self.m,
+            "beta": self.beta,
+            "min_liq_bonus": self.min_liq_bonus,
+        }
+
+        def write(f):
+            np.savez_compressed(
+                f,
+                repay_ratios=self.repay_ratios,
+                max_drawdowns=self.max_drawdowns,
+                pct_decreases=self.pct_decreases,
+                lltv_index=self.lltv_index,
+                lltvs=self.lltvs,
+                meta=np.array(json.dumps(meta)),
+            )
+
+        write_atomic(path, write, mode="wb")
+
+    @classmethod
+    def load(cls, path: Path = LLTV_TABLE_PATH) -> "LLTVTable":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(
+                repay_ratios=data["repay_ratios"],
+                max_drawdowns=data["max_drawdowns"],
+                pct_decreases=data["pct_decreases"],
+                lltv_index=data["lltv_index"],
+                lltvs=data["lltvs"],
+                **meta,
+            )
+
+
+def _cell(grid: np.ndarray, x: float) -> int:
+    """
+    Index of the grid cell [grid[i], grid[i + 1]] containing x.
+    """
+    return int(min(np.searchsorted(grid, x, side="right") - 1, len(grid) - 2))
+
+
+def _table_row(
+    repay_ratio: float,
+    pct_decrease: float,
+    max_drawdowns: np.ndarray,
+    liq_bonuses: np.ndarray,
+    lltvs: np.ndarray,
+) -> np.ndarray:
+    row = np.empty(len(max_drawdowns), dtype=np.int16)
+    for j, dd in enumerate(max_drawdowns):
+        last = last_solvent_index(
+            initial_collateral_usd=REFERENCE_COLLATERAL_USD,
+            collateral_price=1.0,
+            debt_price=1.0,
+            lltvs=lltvs,
+            repay_amount_usd=repay_ratio * REFERENCE_COLLATERAL_USD,
+            liq_bonuses=liq_bonuses,
+            max_drawdown=dd,
+            pct_decrease=pct_decrease,
+        )
+        row[j] = -1 if last is None else last
+    return row
+
+
+def build_lltv_table(
+    repay_ratios: np.ndarray = REPAY_RATIOS,
+    max_drawdowns: np.ndarray = MAX_DRAWDOWNS,
+    pct_decreases: Iterable[float] = PCT_DECREASES,
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    lltvs: np.ndarray = LLTVS,
+    processes: Optional[int] = None,
+) -> LLTVTable:
+    """
+    Runs the LLTV search at every grid point, one task per repay ratio and
+    pct_decrease spread over `processes` worker processes.
+    """
+    pct_decreases = np.asarray(pct_decreases, dtype=np.float64)
+    liq_bonuses = liquidation_bonuses(lltvs, m, beta, min_liq_bonus)
+    index = np.empty(
+        (len(pct_decreases), len(repay_ratios), len(max_drawdowns)),
+        dtype=np.int16,
+    )
+    with ProcessPoolExecutor(processes) as pool:
+        futures = {
+            (k, i): pool.submit(
+                _table_row, ratio, pct, max_drawdowns, liq_bonuses, lltvs
+            )
+            for k, pct in enumerate(pct_decreases)
+            for i, ratio in enumerate(repay_ratios)
+        }
+        for (k, i), future in futures.items():
+            index[k, i] = future.result()
+
+    # The corner bounds of `lookup` rely on monotonicity
+    n_violations = (np.diff(index, axis=1) < 0).sum() + (
+        np.diff(index, axis=2) > 0
+    ).sum()
+    if n_violations:
+        log.warning(f"LLTV table is not monotone at {n_violations} points")
+
+    return LLTVTable(
+        repay_ratios=np.asarray(repay_ratios, dtype=np.float64),
+        max_drawdowns=np.asarray(max_drawdowns, dtype=np.float64),
+        pct_decreases=pct_decreases,
+        lltv_index=index,
+        lltvs=np.asarray(lltvs, dtype=np.float64),
+        m=m,
+        beta=beta,
+        min_liq_bonus=min_liq_bonus,
+    )
+
+
+@lru_cache(maxsize=None)
+def default_table() -> Optional[LLTVTable]:
+    if not LLTV_TABLE_PATH.exists():
+        return None
+    table = LLTVTable.load(LLTV_TABLE_PATH)
+    if table.version != LLTV_TABLE_VERSION:
+        log.warning(
+            f"Ignoring LLTV table version {table.version}, "
+            + f"expected version {LLTV_TABLE_VERSION}"
+        )
+        return None
+    return table
+
+
+def optimal_lltv(
+    params: MarketParams,
+    pct_decrease: float = 0.005,
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    lltvs: np.ndarray = LLTVS,
+    max_error: float = 0.0,
+    table: Optional[LLTVTable] = None,
+    **kwargs,
+) -> Result:
+    """
+    `find_optimal_lltv` answered from the LLTV table when it covers the
+    inputs. When the LLTV range of the inputs' grid cell is within
+    `max_error`, its conservative end is returned without simulating.
+    Otherwise only the LLTVs of that range are simulated. Inputs outside
+    of the table's domain run the full LLTV search.
+
+    table: LLTVTable, defaults to the table shipped in data/
+    kwargs: passed to `find_optimal_lltv`. The table assumes a fixed repay
+        amount, so markets simulated with a `liquidity` are not looked up.
+    """
+    table = table or default_table()
+    if (
+        table is not None
+        and kwargs.get("liquidity") is None
+        and table.matches(m, beta, min_liq_bonus, lltvs)
+    ):
+        bracket = table.bracket(params, pct_decrease)
+        if bracket is not None:
+            result = table.lookup(params, pct_decrease, max_error)
+            if result is not None:
+                log.debug("LLTV answered from the lookup table")
+                return result
+            # LLTVs below the bracket are solvent, sweep the bracket only
+            lo, hi = max(bracket[0], 0), bracket[1]
+            last = last_solvent_index(
+                initial_collateral_usd=params.initial_collateral_usd,
+                collateral_price=params.collateral_price,
+                debt_price=params.debt_price,
+                lltvs=lltvs[lo : hi + 1],
+                repay_amount_usd=params.repay_amount_usd,
+                liq_bonuses=liquidation_bonuses(
+                    lltvs[lo : hi + 1], m, beta, min_liq_bonus
+                ),
+                max_drawdown=params.max_drawdown,
+                pct_decrease=pct_decrease,
+                use_bounds=kwargs.get("use_bounds", True),
+                adaptive=kwargs.get("adaptive", False),
+            )
+            if last is not None:
+                return table.result(lo + last)
+            if bracket[0] < 0:
+                return None, None
+    return find_optimal_lltv(
+        params,
+        pct_decrease=pct_decrease,
+        m=m,
+        beta=beta,
+        min_liq_bonus=min_liq_bonus,
+        lltvs=lltvs,
+        **kwargs,
+    )
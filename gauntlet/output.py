@@ -0,0 +1,97 @@
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Any
+from typing import Iterator
+from typing import Optional
+from typing import TextIO
+
+import numpy as np
+
+from .runner import Market
+from .runner import MarketParams
+from .runner import Result
+
+
+class NdjsonWriter:
+    """
+    Writes records as newline delimited json, one line per record, flushed
+    as soon as it is written so a consumer reading the stream processes
+    each record as it arrives. Records written from several threads (ex:
+    the chain workers of `evaluate_universes`) never interleave.
+    """
+
+    def __init__(self, stream: TextIO):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self.n_records = 0
+
+    def write(self, record: dict[str, Any]):
+        line = json.dumps(record, default=_to_json)
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+            self.n_records += 1
+
+
+@contextmanager
+def open_ndjson(path: str) -> Iterator[NdjsonWriter]:
+    """
+    NdjsonWriter of a file, or of stdout if `path` is "-". Logs go to
+    stderr, so stdout only carries records.
+    """
+    if path == "-":
+        yield NdjsonWriter(sys.stdout)
+        return
+    with open(path, "w") as f:
+        yield NdjsonWriter(f)
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not json serializable")
+
+
+def market_record(
+    market: Optional[Market],
+    params: MarketParams,
+    result: Result,
+    curve: Optional[np.ndarray] = None,
+    timings: Optional[dict[str, float]] = None,
+    **sim_kwargs,
+) -> dict[str, Any]:
+    """
+    Output record of one market: its sim inputs and settings, the optimal
+    LLTV and liquidation incentive, the insolvency curve (`CURVE_DTYPE`
+    records of `insolvency_curve`) and the seconds spent on each stage.
+    """
+    lltv, li = result
+    record = {
+        "chain": market.chain if market else None,
+        "collateral": market.collateral if market else None,
+        "borrow": market.borrow if market else None,
+        "inputs": dict(
+            asdict(params),
+            **{
+                k: v
+                for k, v in sim_kwargs.items()
+                if k in ("pct_decrease", "m", "beta", "min_liq_bonus")
+            },
+        ),
+        "lltv": None if lltv is None else round(float(lltv), 6),
+        "liquidation_incentive": None if li is None else float(li),
+        "curve": None,
+        "timings": timings or {},
+    }
+    if curve is not None:
+        record["curve"] = {
+            "lltv": np.round(curve["lltv"].astype(np.float64), 6),
+            "liq_bonus": np.round(curve["liq_bonus"].astype(np.float64), 6),
+            "insolvency_usd": curve["insolvency_usd"].astype(np.float64),
+        }
+    return record
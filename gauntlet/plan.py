@@ -0,0 +1,427 @@
+import datetime
+import math
+import time
+from collections import defaultdict
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from .chains import get_chain
+from .chains import usd_quote_token
+from .coingecko import API
+from .coingecko import CoinGecko
+from .constants import PRICE_IMPACT_JSON_PATH
+from .data_utils import drawdown_cache_path
+from .data_utils import load_drawdown_cache
+from .data_utils import load_swap_size_cache
+from .data_utils import price_cache_path
+from .logger import get_logger
+from .price_impact import CowSwap
+from .price_impact import MAX_ITERS
+from .registry import default_registry
+from .registry import is_address
+from .registry import normalize_address
+from .registry import TokenRegistry
+from .runner import liquidation_bonuses
+from .runner import LLTVS
+from .runner import Market
+from .runner import market_params
+from .runner import MarketParams
+from .snapshot import PriceSnapshot
+from .tokens import Token
+from .tokens import token_id
+from .universe import default_universe
+from .universe import Universe
+
+log = get_logger(__name__)
+
+# Swap sizes `load_market_data` computes for every token
+IMPACTS = ("0.005", "0.25")
+# Start date of the price histories `get_drawdowns` fetches
+HISTORY_START_DATE = "2022-07-01"
+# Tokens priced per bulk current price request (see `current_prices`)
+PRICES_PAGE_SIZE = 100
+
+
+class PairPlan(NamedTuple):
+    """
+    Sim cost of one market. `params` are derived from the caches, the price
+    snapshot and the price store, None if any of them is missing. Steps are
+    None without cached swap sizes and drawdowns (see `pair_plan`).
+    """
+
+    market: Market
+    params: Optional[MarketParams] = None
+    # LLTVs whose sim does not exit early (lltv * (1 + liq_bonus) reaches
+    # 1 - max_drawdown)
+    n_lltvs: Optional[int] = None
+    # loop bound of `simulate_insolvency`: ceil(C0 / R + 1) + 10
+    steps_per_lltv: Optional[int] = None
+    # whether the steps were estimated at the current prices
+    priced: bool = False
+
+    @property
+    def max_steps(self) -> Optional[int]:
+        if self.n_lltvs is None:
+            return None
+        return self.n_lltvs * self.steps_per_lltv
+
+
+@dataclass
+class RunPlan:
+    """
+    Network requests and sim steps a run would take, estimated from the
+    caches without sending any request.
+
+    Request counts are exact except for the CowSwap quotes of the swap size
+    binary searches (see `price_impact_size`), which stop between 1 and
+    MAX_ITERS quotes: `requests` counts the fewest, `max_requests` the
+    most. Sim steps are upper bounds since LLTV searches stop at the first
+    insolvent LLTV and `classify_lltvs` skips the LLTVs it can decide.
+    """
+
+    # API name -> requests per minute
+    rates: dict[str, float] = field(default_factory=dict)
+    # (API name, request kind) -> number of requests
+    requests: dict[Tuple[str, str], int] = field(
+        default_factory=lambda: defaultdict(int)
+    )
+    max_requests: dict[Tuple[str, str], int] = field(
+        default_factory=lambda: defaultdict(int)
+    )
+    pairs: list[PairPlan] = field(default_factory=list)
+    # "chain:symbol" of the tokens neither in the registry nor an address,
+    # the run fails on these
+    unknown_tokens: list[str] = field(default_factory=list)
+
+    def add(self, api: API, kind: str, n: int, max_n: Optional[int] = None):
+        name = type(api).__name__
+        self.rates[name] = api.requests_per_minute
+        self.requests[(name, kind)] += n
+        self.max_requests[(name, kind)] += n if max_n is None else max_n
+
+    def api_requests(self, most: bool = False) -> dict[str, int]:
+        counts = self.max_requests if most else self.requests
+        totals = {name: 0 for name in self.rates}
+        for (name, _), n in counts.items():
+            totals[name] += n
+        return totals
+
+    def wait_sec(self, most: bool = False) -> dict[str, float]:
+        """
+        Seconds every API's rate limiter sleeps through to send its
+        requests. The limiter lets `requests_per_minute` requests through
+        and then sleeps a full period (see `API.calculate_wait_time`).
+        """
+        return {
+            name: API.PERIOD_LENGTH * ((n - 1) // self.rates[name])
+            for name, n in self.api_requests(most).items()
+            if n > 0
+        }
+
+    def min_wall_sec(self, most: bool = False) -> float:
+        """
+        Lower bound of the wall time of the run's requests: the APIs are
+        queried concurrently by the chain workers, so the slowest rate
+        limit bounds the run. Request latencies and the sims come on top.
+        """
+        return max(self.wait_sec(most).values(), default=0.0)
+
+    def to_dict(self) -> dict:
+        apis = {}
+        wait_sec, max_wait_sec = self.wait_sec(), self.wait_sec(most=True)
+        max_requests = self.api_requests(most=True)
+        for name, n in self.api_requests().items():
+            apis[name] = {
+                "requests_per_minute": self.rates[name],
+                "requests": n,
+                "max_requests": max_requests[name],
+                "requests_by_kind": {
+                    kind: self.requests[(api, kind)]
+                    for api, kind in self.requests
+                    if api == name
+                },
+                "wait_sec": wait_sec.get(name, 0.0),
+                "max_wait_sec": max_wait_sec.get(name, 0.0),
+            }
+        return {
+            "apis": apis,
+            "min_wall_sec": self.min_wall_sec(),
+            "min_wall_sec_max_quotes": self.min_wall_sec(most=True),
+            "unknown_tokens": self.unknown_tokens,
+            "markets": [
+                {
+                    **asdict(p.market),
+                    "params": asdict(p.params) if p.params else None,
+                    "n_lltvs": p.n_lltvs,
+                    "steps_per_lltv": p.steps_per_lltv,
+                    "max_sim_steps": p.max_steps,
+                    "priced": p.priced,
+                }
+                for p in self.pairs
+            ],
+        }
+
+    def log(self):
+        max_requests = self.api_requests(most=True)
+        max_wait_sec = self.wait_sec(most=True)
+        for name, n in self.api_requests().items():
+            kinds = ", ".join(
+                f"{kind}: {self.requests[(api, kind)]}"
+                for api, kind in self.requests
+                if api == name and self.requests[(api, kind)]
+            )
+            log.info(
+                f"{name} | {self.rates[name]:g} requests/min | {n}"
+                + (
+                    f" - {max_requests[name]}"
+                    if max_requests[name] > n
+                    else ""
+                )
+                + f" requests ({kinds or 'none'})"
+                + f" | rate limited for >= {self.wait_sec().get(name, 0):.0f}s"
+                + f" (<= {max_wait_sec.get(name, 0):.0f}s)"
+            )
+        log.info(
+            f"Minimum wall time under the rate limits: "
+            + f"{self.min_wall_sec():.0f}s"
+            + f" (up to {self.min_wall_sec(most=True):.0f}s)"
+        )
+        known = [p for p in self.pairs if p.max_steps is not None]
+        for p in known:
+            log.info(
+                f"{p.market.chain} | {p.market.collateral} / "
+                + f"{p.market.borrow} | {p.n_lltvs} LLTVs x <= "
+                + f"{p.steps_per_lltv} steps"
+                + ("" if p.priced else " (unpriced)")
+            )
+        log.info(
+            f"{len(self.pairs)} markets | <= "
+            + f"{sum(p.max_steps for p in known)} sim steps"
+            + f" | {len(self.pairs) - len(known)} without cached inputs"
+        )
+        for name in self.unknown_tokens:
+            log.warning(f"Unknown token {name}: not in the token registry")
+
+
+def _offline_token(symbol_or_address: str, chain: str) -> Token:
+    """
+    Stand in for a token address missing from the registry. Only its chain
+    and address are known until CoinGecko resolves it.
+    """
+    return Token(
+        symbol=symbol_or_address,
+        address=normalize_address(symbol_or_address),
+        decimals=None,
+        coingecko_id=None,
+        chain=chain,
+    )
+
+
+def _stored_price(token: Token, interval: str) -> Optional[float]:
+    """
+    Last price of the token in the price store, if it was saved.
+    """
+    for path in dict.fromkeys(
+        [price_cache_path(token, interval), price_cache_path(token)]
+    ):
+        if path.exists():
+            prices = pd.read_csv(path, index_col=0)["prices"].dropna()
+            if len(prices):
+                return float(prices.iloc[-1])
+    return None
+
+
+def hourly_pages(start_date: str = HISTORY_START_DATE) -> int:
+    """
+    Requests of one `CoinGecko.hourly_market_chart` call from start_date.
+    """
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").timestamp()
+    page = CoinGecko.HOURLY_RANGE_DAYS * 24 * 60 * 60
+    return max(math.ceil((time.time() - start) / page), 0)
+
+
+def pair_plan(
+    market: Market,
+    collateral: Token,
+    debt: Token,
+    swap_sizes: dict[str, dict[str, float]],
+    drawdowns: dict[Tuple[str, str], dict],
+    prices: dict[Token, Optional[float]],
+    bonuses: np.ndarray,
+    lltvs: np.ndarray = LLTVS,
+    universe: Optional[Universe] = None,
+) -> PairPlan:
+    """
+    Sim inputs of the market (see `market_params`) from cached values only,
+    and the sim steps they imply. Without the prices of both tokens, both
+    are priced alike, high enough that the minimum whale position does
+    not bind: C0 / R is then the ratio of the cached swap sizes, exact for
+    pairs of similarly priced tokens. The sim inputs of such markets are
+    not reported.
+    """
+    universe = universe or default_universe()
+    cid, did = token_id(collateral), token_id(debt)
+    if (
+        cid not in swap_sizes
+        or did not in swap_sizes
+        or (cid, did) not in drawdowns
+        or not swap_sizes[cid]["0.25"]
+    ):
+        return PairPlan(market)
+
+    priced = bool(prices.get(collateral) and prices.get(debt))
+    if not priced:
+        min_position_usd = max(
+            universe.blue_chip.min_whale_position_usd,
+            universe.default.min_whale_position_usd,
+        )
+        price = min_position_usd / swap_sizes[cid]["0.25"]
+        prices = {collateral: price, debt: price}
+    # both prices are given, so this does not query CoinGecko
+    params = market_params(collateral, debt, swap_sizes, drawdowns, prices)
+    live = ~(lltvs * (1 + bonuses) < (1 - params.max_drawdown))
+    steps = math.ceil(
+        params.initial_collateral_usd / params.repay_amount_usd + 1
+    )
+    return PairPlan(
+        market,
+        params if priced else None,
+        int(live.sum()),
+        steps + 10,
+        priced,
+    )
+
+
+def plan_run(
+    markets: Iterable[Market],
+    interval: str = "daily",
+    update_cache: bool = False,
+    use_cache: bool = True,
+    snapshot: Optional[PriceSnapshot] = None,
+    take_snapshot: bool = False,
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    lltvs: np.ndarray = LLTVS,
+    registry: Optional[TokenRegistry] = None,
+) -> RunPlan:
+    """
+    Plans the requests of `evaluate_universes` over the markets from the
+    token registry, the swap size and drawdown caches and the price
+    snapshot, without any network call:
+
+    - one CoinGecko token info per token address missing from the registry
+    - the bulk current prices of a new price snapshot (`take_snapshot`),
+      per chain and 100 tokens
+    - for chains with tokens missing from the swap size cache (every token
+      if `update_cache`), for every token and impact, one CoinGecko spot
+      price and 1 to MAX_ITERS CowSwap quotes, plus one CoinGecko price per
+      token and stablecoin the quotes are valued with, unless the snapshot
+      has it
+    - the price history of every token of the pairs missing from the
+      drawdown cache: one request, or one per 90 days of hourly history
+    - the bulk current prices of the tokens missing from the snapshot, per
+      chain and 100 tokens
+
+    Sim steps are estimated from the cached swap sizes and drawdowns and
+    the prices of the snapshot, or else the last prices of the price store.
+    """
+    registry = registry or default_registry()
+    cg, cow = CoinGecko(), CowSwap()
+    markets = list(markets)
+    plan = RunPlan()
+    plan.add(cg, "token_info", 0)
+    plan.add(cow, "quote", 0)
+
+    tokens = {}
+    by_chain = defaultdict(dict)
+    for mkt in markets:
+        get_chain(mkt.chain)
+        for symbol_or_address in (mkt.collateral, mkt.borrow):
+            key = (mkt.chain, symbol_or_address)
+            if key in tokens:
+                continue
+            token = registry.lookup(symbol_or_address, mkt.chain)
+            if token is None and is_address(symbol_or_address):
+                plan.add(cg, "token_info", 1)
+                token = _offline_token(symbol_or_address, mkt.chain)
+            elif token is None:
+                plan.unknown_tokens.append(f"{mkt.chain}:{symbol_or_address}")
+            tokens[key] = token
+        pair = (
+            tokens[(mkt.chain, mkt.collateral)],
+            tokens[(mkt.chain, mkt.borrow)],
+        )
+        if None not in pair:
+            by_chain[mkt.chain][mkt] = pair
+
+    snapshot_ids = set(snapshot.prices) if snapshot else set()
+    if take_snapshot:
+        for pairs in by_chain.values():
+            ids = {token_id(t) for pair in pairs.values() for t in pair}
+            plan.add(
+                cg, "price_snapshot", math.ceil(len(ids) / PRICES_PAGE_SIZE)
+            )
+            snapshot_ids.update(ids)
+
+    swap_sizes = load_swap_size_cache(PRICE_IMPACT_JSON_PATH)
+    drawdowns = load_drawdown_cache(drawdown_cache_path(interval))
+    pages = 1 if interval == "daily" else hourly_pages()
+    bonuses = liquidation_bonuses(lltvs, m, beta, min_liq_bonus)
+    # current prices are fetched once per process (see `current_price`)
+    quote_priced = set()
+    for pairs in by_chain.values():
+        universe = list(
+            dict.fromkeys(t for pair in pairs.values() for t in pair)
+        )
+        ids = [token_id(t) for t in universe]
+        cached_sizes = swap_sizes if use_cache else {}
+        if update_cache or any(tid not in cached_sizes for tid in ids):
+            n_searches = len(universe) * len(IMPACTS)
+            plan.add(cg, "swap_size_spot_price", n_searches)
+            plan.add(cow, "quote", n_searches, n_searches * MAX_ITERS)
+            quote_priced.update(
+                token_id(t)
+                for tok in universe
+                for t in (tok, usd_quote_token(tok))
+            )
+
+        cached_dds = drawdowns if use_cache else {}
+        missing = [
+            (c, d)
+            for c, d in dict.fromkeys(pairs.values())
+            if c != d
+            and (update_cache or (token_id(c), token_id(d)) not in cached_dds)
+        ]
+        charts = dict.fromkeys(t for pair in missing for t in pair)
+        plan.add(cg, "market_chart", len(charts) * pages)
+
+        unpriced = [tid for tid in ids if tid not in snapshot_ids]
+        plan.add(
+            cg,
+            "current_prices",
+            math.ceil(len(unpriced) / PRICES_PAGE_SIZE),
+        )
+
+        prices = {
+            t: (snapshot.price(t.address, t.chain) if snapshot else None)
+            or _stored_price(t, interval)
+            for t in universe
+        }
+        plan.pairs.extend(
+            pair_plan(mkt, c, d, swap_sizes, drawdowns, prices, bonuses, lltvs)
+            for mkt, (c, d) in pairs.items()
+        )
+    plan.add(cg, "current_price", len(quote_priced - snapshot_ids))
+    plan.pairs.extend(
+        PairPlan(mkt) for mkt in markets if mkt not in by_chain[mkt.chain]
+    )
+    return plan
@@ -0,0 +1,134 @@
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+
+from .bounds import price_path
+from .constants import TOL
+from .impact_table import MarketLiquidity
+from .impact_table import repay_from_sizes
+from .logger import get_logger
+
+log = get_logger(__name__)
+
+
+class PortfolioResult(NamedTuple):
+    # insolvent debt of every position
+    insolvency_usd: np.ndarray
+    # collateral claimed by liquidators from every position
+    claimed_usd: np.ndarray
+    n_steps: int
+
+    @property
+    def total_insolvency_usd(self) -> float:
+        return float(self.insolvency_usd.sum())
+
+
+def simulate_portfolio_insolvency(
+    *,
+    collateral_usd: np.ndarray,
+    ltvs: np.ndarray,
+    collateral_price: float,
+    lltv: float,
+    repay_amount_usd: float,
+    liq_bonus: float,
+    max_drawdown: float,
+    pct_decrease: float,
+    liquidity: Optional[MarketLiquidity] = None,
+) -> PortfolioResult:
+    """
+    Multi position counterpart of `simulate_insolvency`: every borrower of
+    a market is liquidated against the same DEX liquidity.
+
+    Positions start with `collateral_usd` of collateral and `ltvs` *
+    `collateral_usd` of debt. At each step the collateral price drops by
+    `pct_decrease` (down to the max drawdown), then the liquidatable
+    positions share the `repay_amount_usd` the market can absorb per step,
+    pro rata to their debt. A liquidated position repays its share (at
+    most its debt) and loses the share * (1 + liq_bonus) of collateral
+    (at most its collateral). A position whose collateral is exhausted
+    leaves its remaining debt as insolvent debt.
+
+    The step is vectorized over positions, so its cost grows with the
+    number of steps rather than the number of borrowers. A single position
+    with ltv = lltv gives the insolvency of `simulate_insolvency`.
+
+    liquidity: MarketLiquidity, if given the per step repay amount is
+        derived from the market's impact tables at the current collateral
+        price, as in `simulate_insolvency`
+
+    Returns: PortfolioResult
+    """
+    collateral_usd = np.asarray(collateral_usd, dtype=np.float64)
+    ltvs = np.broadcast_to(
+        np.asarray(ltvs, dtype=np.float64), collateral_usd.shape
+    )
+    n = len(collateral_usd)
+    insolvency = np.zeros(n)
+    claimed = np.zeros(n)
+    # state of the positions still open, compacted as positions close
+    ids = np.arange(n)
+    tokens = collateral_usd / collateral_price
+    debt = collateral_usd * ltvs
+    pos_claimed = np.zeros(n)
+
+    prices = price_path(collateral_price, max_drawdown, pct_decrease)
+    if not len(prices):
+        prices = np.array([collateral_price])
+    if liquidity is not None:
+        collateral_size, debt_size_usd = liquidity.sizes(liq_bonus)
+        repay_amounts = repay_from_sizes(
+            collateral_size, debt_size_usd, liq_bonus, prices
+        )
+        repay_amount_usd = repay_amounts[-1]
+    else:
+        repay_amounts = np.full(len(prices), repay_amount_usd)
+    # every step liquidates repay_amount_usd of debt until the collateral
+    # runs out, on top of the steps needed to reach the max drawdown
+    max_iters = int(np.ceil(collateral_usd.sum() / repay_amount_usd))
+    max_iters += len(prices)
+
+    step = 0
+    while step < max_iters + 10 and len(ids):
+        price = prices[min(step, len(prices) - 1)]
+        repay = repay_amounts[min(step, len(prices) - 1)]
+        collateral = tokens * price
+        liquidatable = debt >= lltv * collateral
+        if not liquidatable.any():
+            if step >= len(prices) - 1:
+                # the price stopped moving, so nothing moves anymore
+                break
+            # skip to the step before the first position can be liquidated
+            threshold = (debt / (lltv * tokens)).max()
+            first = int(np.searchsorted(-prices, -threshold))
+            step = max(step + 1, first - 1)
+            continue
+
+        # positions that are not liquidatable get a 0 share
+        liquidatable_debt = np.where(liquidatable, debt, 0.0)
+        share = liquidatable_debt * (repay / liquidatable_debt.sum())
+        claim = np.minimum(
+            np.minimum(debt, share) * (1 + liq_bonus), collateral
+        )
+        tokens -= claim / price
+        debt -= claim / (1 + liq_bonus)
+        pos_claimed += claim
+
+        no_collateral = liquidatable & (collateral - claim < TOL)
+        closed = no_collateral | (liquidatable & (debt < TOL))
+        if closed.any():
+            insolvency[ids[no_collateral]] = debt[no_collateral]
+            claimed[ids[closed]] = pos_claimed[closed]
+            keep = ~closed
+            ids, tokens, debt = ids[keep], tokens[keep], debt[keep]
+            pos_claimed = pos_claimed[keep]
+        step += 1
+
+    claimed[ids] = pos_claimed
+    log.debug(
+        "Portfolio of %d positions: %.2f insolvent debt after %d steps",
+        n,
+        insolvency.sum(),
+        step,
+    )
+    return PortfolioResult(insolvency, claimed, step)
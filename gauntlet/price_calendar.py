@@ -0,0 +1,131 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .tokens import Token
+
+# Default forward fill policy: a missing observation is filled with the last
+# observed price for at most this many consecutive calendar dates, longer
+# gaps are left invalid
+MAX_FILL = 3
+
+
+class PriceCalendar:
+    """
+    Historical prices of a token universe aligned on one master calendar.
+
+    The calendar is the sorted union of the dates of every token. Each
+    token is a column of one (n_dates, n_tokens) array, forward filled over
+    gaps of at most `max_fill` dates, with a validity mask marking the
+    dates its price is known (observed or filled). Columns are stored
+    contiguously, so the prices of a token are a view of the shared array,
+    and the ratio of a pair only divides the two columns over the dates
+    both are valid instead of joining two DataFrames.
+
+    Build it once per refresh and pass it wherever a dict of historical
+    prices is accepted (see `data_utils.pair_ratio`).
+    """
+
+    def __init__(
+        self,
+        dates: np.ndarray,
+        tokens: list[Token],
+        prices: np.ndarray,
+        valid: np.ndarray,
+    ):
+        self.dates = dates
+        self.tokens = tokens
+        self.prices = prices
+        self.valid = valid
+        self._column = {t: i for i, t in enumerate(tokens)}
+
+    @classmethod
+    def from_prices(
+        cls,
+        hist_prices: dict[Token, pd.DataFrame],
+        start_date: Optional[str] = None,
+        max_fill: int = MAX_FILL,
+    ) -> "PriceCalendar":
+        """
+        hist_prices: dict of Token -> DataFrame with a `prices` column,
+            indexed by date strings (see `data_utils.get_prices`)
+        start_date: str, dates before this date are dropped
+        max_fill: int, longest run of missing dates filled with the last
+            observed price. 0 disables the forward fill.
+        """
+        series = {}
+        for t, df in hist_prices.items():
+            s = df["prices"]
+            if start_date is not None:
+                s = s[s.index.astype(str) >= start_date]
+            s = s[~s.index.duplicated(keep="last")]
+            series[t] = (s.index.to_numpy(dtype=str), s.to_numpy(np.float64))
+
+        dates = np.unique(
+            np.concatenate([d for d, _ in series.values()] or [[]])
+        ).astype(str)
+        n = len(dates)
+        prices = np.full((n, len(series)), np.nan, order="F")
+        valid = np.zeros((n, len(series)), dtype=bool, order="F")
+
+        steps = np.arange(n)
+        for i, (token_dates, values) in enumerate(series.values()):
+            observed = np.zeros(n, dtype=bool)
+            pos = np.searchsorted(dates, token_dates)
+            observed[pos] = np.isfinite(values) & (values > 0)
+            column = np.full(n, np.nan)
+            column[pos] = values
+
+            # position of the last observation at or before every date
+            last = np.maximum.accumulate(np.where(observed, steps, -1))
+            ok = (last >= 0) & (steps - last <= max_fill)
+            prices[ok, i] = column[last[ok]]
+            valid[:, i] = ok
+
+        return cls(dates, list(series), prices, valid)
+
+    def __contains__(self, token: Token) -> bool:
+        return token in self._column
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def column(self, token: Token) -> np.ndarray:
+        """
+        Forward filled prices of the token over the calendar (NaN where not
+        valid), a view of the shared array.
+        """
+        return self.prices[:, self._column[token]]
+
+    def mask(self, token: Token) -> np.ndarray:
+        return self.valid[:, self._column[token]]
+
+    def ratio(
+        self, t1: Token, t2: Token, start_date: Optional[str] = None
+    ) -> pd.Series:
+        """
+        Price series of t1 denominated in t2 over the dates (from
+        `start_date`) both prices are valid. When those dates are
+        contiguous, the usual case since gaps are forward filled, the two
+        columns are sliced without copying.
+        """
+        start = 0
+        if start_date is not None:
+            start = int(np.searchsorted(self.dates, start_date))
+        both = self.mask(t1)[start:] & self.mask(t2)[start:]
+        idx = np.flatnonzero(both) + start
+        if not len(idx):
+            return pd.Series(
+                [], index=pd.Index([], name="date"), name="prices"
+            )
+        if idx[-1] - idx[0] + 1 == len(idx):
+            rows = slice(idx[0], idx[-1] + 1)
+        else:
+            rows = idx
+        values = self.column(t1)[rows] / self.column(t2)[rows]
+        return pd.Series(
+            values,
+            index=pd.Index(self.dates[rows], name="date"),
+            name="prices",
+        )
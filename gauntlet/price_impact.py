@@ -1,7 +1,9 @@
+import os
 import time
+from typing import Optional
 
-import requests
-
+from .chains import get_chain
+from .coingecko import API
 from .coingecko import CoinGecko
 from .coingecko import current_price
 from .logger import get_logger
@@ -11,6 +13,47 @@ log = get_logger(__name__)
 MAX_ITERS = 20
 
 
+class CowSwap(API):
+    URL = "https://api.cow.fi"
+
+    @property
+    def requests_per_minute(self) -> float:
+        return 60
+
+    def quote_url(self, chain: str) -> str:
+        network = get_chain(chain).cowswap_network
+        if network is None:
+            raise ValueError(f"CowSwap is not deployed on {chain}")
+        return f"{self.URL}/{network}/api/v1/quote"
+
+
+class OneInch(API):
+    URL = "https://api.1inch.dev/swap/v5.2"
+
+    @property
+    def requests_per_minute(self) -> float:
+        return 60
+
+    def get_header(self) -> dict[str, str]:
+        return {"Authorization": os.environ["ONEINCH_API_KEY"]}
+
+    def quote(self, token_in: Token, token_out: Token, amount: int) -> int:
+        """
+        Raw amount of token_out received for selling `amount` raw units of
+        token_in, on the chain of token_in.
+        """
+        chain_id = get_chain(token_in.chain).chain_id
+        response = self.make_request(
+            url=f"{self.URL}/{chain_id}/quote",
+            params={
+                "src": token_in.address,
+                "dst": token_out.address,
+                "amount": str(amount),
+            },
+        )
+        return int(response.json()["toAmount"])
+
+
 def cowswap_query(
     token_in: Token,
     token_out: Token,
@@ -27,7 +70,6 @@ def cowswap_query(
     quality: str (optimal or fast)
     Returns: str, the JSON output of the CowSwap api query.
     """
-    url = "https://api.cow.fi/mainnet/api/v1/quote"
     params = {
         "sellToken": token_in.address,
         "buyToken": token_out.address,
@@ -42,7 +84,10 @@ def cowswap_query(
         "onchainOrder": False,
         "validTo": int(time.time() + 60 * 60),
     }
-    response = requests.post(url, json=params)
+    cow = CowSwap()
+    response = cow.make_request(
+        method="post", url=cow.quote_url(token_in.chain), json=params
+    )
     return response.json()
 
 
@@ -63,12 +108,12 @@ def cowswap_price_impact(
     amount_in_usd = (
         float(response["quote"]["sellAmount"])
         / (10**token_in.decimals)
-        * current_price(token_in.address)
+        * current_price(token_in.address, token_in.chain)
     )
     amount_out_usd = (
         float(response["quote"]["buyAmount"])
         / (10**token_out.decimals)
-        * current_price(token_out.address)
+        * current_price(token_out.address, token_out.chain)
     )
     price_impact = 1 - float(amount_out_usd / amount_in_usd)
     return price_impact
@@ -80,6 +125,7 @@ def price_impact_size(
     target_price_impact: float,
     rtol=5e-2,
     max_sz_usd=1_000_000_000,
+    spot_in: Optional[float] = None,
 ) -> float:
     """
     Computes the number of token_in necessary to get the target_price_impact
@@ -91,12 +137,13 @@ def price_impact_size(
     rtol: float, relative tolerance
     max_sz_usd: float, upper bound for the amount of token_in necessary
         to generate the given target_price_impact
+    spot_in: float, current usd price of token_in. Fetched if not given.
 
     Returns: float, number of tokens necessary to get the desired
         target_price_impact.
     """
-    cg = CoinGecko()
-    spot_in = cg.current_price(token_in.address)
+    if spot_in is None:
+        spot_in = CoinGecko().current_price(token_in.address, token_in.chain)
     min_sz = 0
     max_sz = max_sz_usd / spot_in
     iters = 0
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from .constants import QUOTE_CURVE_JSON_PATH
+from .io_utils import write_atomic
+from .logger import get_logger
+from .tokens import Token
+from .tokens import token_id
+
+log = get_logger(__name__)
+
+# Quotes older than this are refetched
+QUOTE_CURVE_TTL_SEC = 60 * 60
+N_QUOTE_POINTS = 16
+# Seconds to wait between two quotes to avoid spamming the quote API
+QUOTE_SLEEP_SEC = 1.5
+# Serializes the load / update / save of the curve cache between the
+# threads of a batch
+_CURVES_LOCK = threading.Lock()
+
+# (amount of src in raw units, src token, dst token) -> raw dst amount. The
+# tokens carry the chain the quote is requested on.
+QuoteFn = Callable[[int, Token, Token], int]
+
+
+@dataclass
+class QuoteCurve:
+    """
+    Quotes for selling increasing amounts of `src` for `dst`. Sizes are in
+    whole `src` tokens and amounts out in whole `dst` tokens. The first
+    size is the reference trade the price ratios are measured against.
+    """
+
+    src: str
+    dst: str
+    sizes: list[float]
+    amounts_out: list[float]
+    fetched_at: float
+
+    def price_ratios(self) -> np.ndarray:
+        """
+        Execution price of each quote relative to the reference trade.
+        """
+        prices = np.asarray(self.amounts_out) / np.asarray(self.sizes)
+        return prices / prices[0]
+
+    def size_at_price_ratio(self, target: float) -> float:
+        """
+        Largest trade size whose price ratio stays above `target`. Price
+        impact (1 - price ratio) is close to a power law of the trade size,
+        so it is interpolated linearly in log-log space between the two
+        quotes that bracket the target.
+        """
+        ratios = self.price_ratios()
+        below = np.nonzero(ratios <= target)[0]
+        if not len(below):
+            return self.sizes[-1]
+        i = below[0]
+        if i == 0:
+            return self.sizes[0]
+
+        x0, x1 = np.log(self.sizes[i - 1]), np.log(self.sizes[i])
+        y0, y1, y = 1 - ratios[i - 1], 1 - ratios[i], 1 - target
+        if y0 > 0:
+            # impact curve is convex in linear space, interpolate log impact
+            y0, y1, y = np.log(y0), np.log(y1), np.log(y)
+        frac = (y - y0) / (y1 - y0)
+        return float(np.exp(x0 + frac * (x1 - x0)))
+
+    def is_fresh(self, ttl_sec: float = QUOTE_CURVE_TTL_SEC) -> bool:
+        return time.time() - self.fetched_at < ttl_sec
+
+
+def fetch_quote_curve(
+    src: Token,
+    dst: Token,
+    quote_fn: QuoteFn,
+    max_size: float,
+    min_size: float = 1.0,
+    n_points: int = N_QUOTE_POINTS,
+    sleep_sec: float = QUOTE_SLEEP_SEC,
+) -> QuoteCurve:
+    """
+    Samples the src -> dst quote curve once at `n_points` log spaced trade
+    sizes between `min_size` and `max_size` (in whole src tokens).
+    """
+    sizes = np.geomspace(min_size, max_size, n_points)
+    amounts_out = []
+    for i, size in enumerate(sizes):
+        if i:
+            time.sleep(sleep_sec)
+        raw_out = quote_fn(int(size * 10**src.decimals), src, dst)
+        amounts_out.append(raw_out / 10**dst.decimals)
+        log.debug(
+            f"{src.symbol} -> {dst.symbol} | size: {size:.2f} | out: {amounts_out[-1]:.4f}"
+        )
+    return QuoteCurve(
+        src=src.address,
+        dst=dst.address,
+        sizes=sizes.tolist(),
+        amounts_out=amounts_out,
+        fetched_at=time.time(),
+    )
+
+
+def _load_curves(path: Path) -> dict[str, dict]:
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_curves(curves: dict[str, dict], path: Path):
+    write_atomic(path, lambda f: json.dump(curves, f, indent=4))
+
+
+def get_quote_curve(
+    src: Token,
+    dst: Token,
+    quote_fn: QuoteFn,
+    max_size: float,
+    ttl_sec: float = QUOTE_CURVE_TTL_SEC,
+    path: Path = QUOTE_CURVE_JSON_PATH,
+) -> QuoteCurve:
+    """
+    Cached `fetch_quote_curve`. Curves are stored per chain qualified
+    (src, dst) pair and reused until they are older than `ttl_sec` or were
+    sampled up to a smaller `max_size` than requested.
+    """
+    key = f"{token_id(src)}/{token_id(dst)}"
+    with _CURVES_LOCK:
+        curves = _load_curves(path)
+    if key in curves:
+        curve = QuoteCurve(**curves[key])
+        if curve.is_fresh(ttl_sec) and curve.sizes[-1] >= max_size:
+            return curve
+
+    log.info(f"Fetching {src.symbol} -> {dst.symbol} quote curve")
+    curve = fetch_quote_curve(src, dst, quote_fn, max_size)
+    with _CURVES_LOCK:
+        curves = _load_curves(path)
+        curves[key] = asdict(curve)
+        _save_curves(curves, path)
+    return curve
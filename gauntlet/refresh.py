@@ -0,0 +1,231 @@
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+from itertools import groupby
+from itertools import permutations
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Iterable
+from typing import NamedTuple
+from typing import Optional
+
+from .chains import usd_quote_token
+from .coingecko import api_stats
+from .coingecko import CoinGecko
+from .constants import PRICE_IMPACT_JSON_PATH
+from .data_utils import compute_pair_drawdowns
+from .data_utils import drawdown_cache_path
+from .data_utils import fetch_market_chart
+from .data_utils import load_drawdown_cache
+from .data_utils import load_swap_size_cache
+from .data_utils import save_prices
+from .data_utils import update_drawdown_cache
+from .data_utils import update_swap_size_cache
+from .logger import get_logger
+from .price_calendar import PriceCalendar
+from .price_impact import price_impact_size
+from .registry import default_registry
+from .registry import TokenRegistry
+from .tokens import Token
+from .tokens import token_id
+
+log = get_logger(__name__)
+
+START_DATE = "2022-07-01"
+
+
+class Fetch(NamedTuple):
+    """
+    One planned network fetch. `key` identifies what is fetched, ex:
+    ("market_chart", token id, interval).
+    """
+
+    key: Hashable
+    call: Callable[[], Any]
+
+
+@dataclass
+class RefreshReport:
+    wall_sec: float = 0.0
+    fetches: int = 0
+    failures: dict[Hashable, str] = field(default_factory=dict)
+    # API name -> requests, retries and bytes sent during the refresh
+    apis: dict[str, dict[str, int]] = field(default_factory=dict)
+
+    def log(self):
+        requests = sum(s["requests"] for s in self.apis.values())
+        n_bytes = sum(s["bytes"] for s in self.apis.values())
+        log.info(
+            f"Refreshed {self.fetches - len(self.failures)} / {self.fetches}"
+            + f" fetches in {self.wall_sec:.1f}s | {requests} requests"
+            + f" ({requests / max(self.wall_sec, 1e-9):.2f} req/s)"
+            + f" | {n_bytes / 1e6:.2f} MB"
+        )
+        for name, s in self.apis.items():
+            log.info(
+                f"{name} | {s['requests']} requests | {s['retries']} retries"
+                + f" | {s['bytes'] / 1e6:.2f} MB"
+            )
+        for key, err in self.failures.items():
+            log.warning(f"Failed to fetch {key}: {err}")
+
+
+def cached_tokens(
+    registry: Optional[TokenRegistry] = None,
+) -> list[Token]:
+    """
+    Tokens present in the swap size or drawdown caches. Token ids missing
+    from the registry are skipped.
+    """
+    registry = registry or default_registry()
+    ids = set(load_swap_size_cache(PRICE_IMPACT_JSON_PATH))
+    for interval in ("daily", "hourly"):
+        for pair in load_drawdown_cache(drawdown_cache_path(interval)):
+            ids.update(pair)
+
+    tokens = []
+    for tid in sorted(ids):
+        chain, _, address = tid.partition(":")
+        token = registry.by_address(address, chain) if address else None
+        if token is None:
+            log.warning(f"Skipping {tid}: not in the token registry")
+            continue
+        tokens.append(token)
+    return tokens
+
+
+def run_fetches(
+    fetches: list[Fetch], max_workers: int, report: RefreshReport
+) -> dict[Hashable, Any]:
+    """
+    Runs the fetches on a thread pool. Requests to the same API share its
+    rate limiter (see `coingecko.rate_limiter`) and are retried by
+    `API.make_request`, so the pool can be sized for the slowest API
+    without exceeding the others' limits. Failed fetches are recorded in
+    the report and left out of the results.
+    """
+    results = {}
+    report.fetches += len(fetches)
+    with ThreadPoolExecutor(max_workers) as pool:
+        futures = {pool.submit(f.call): f.key for f in fetches}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                report.failures[key] = repr(e)
+    return results
+
+
+def refresh_caches(
+    tokens: Iterable[Token],
+    intervals: Iterable[str] = ("daily",),
+    impacts: Iterable[float] = (0.005, 0.25),
+    max_workers: int = 8,
+    start_date: str = START_DATE,
+    processes: int = 0,
+) -> RefreshReport:
+    """
+    Refetches every data artifact of the token universe and rewrites the
+    caches:
+    - current prices, one bulk request per chain, used as the spot prices
+      of the price impact searches
+    - market charts of every token at every interval, saved to the price
+      store, from which the drawdowns of every ordered pair of tokens of
+      the same chain are recomputed over `processes` worker processes (see
+      `compute_pair_drawdowns`)
+    - the swap size of every token at every price impact (CowSwap quotes)
+
+    Fetches run concurrently (see `run_fetches`). The caches are merged
+    with the refreshed entries and replaced atomically; entries whose
+    fetches failed keep their cached values.
+    """
+    tokens = list(dict.fromkeys(tokens))
+    stats_before = api_stats()
+    start = time.time()
+    report = RefreshReport()
+
+    by_chain = {
+        chain: list(chain_tokens)
+        for chain, chain_tokens in groupby(
+            sorted(tokens, key=lambda t: t.chain), key=lambda t: t.chain
+        )
+    }
+    cg = CoinGecko()
+    fetches = [
+        Fetch(
+            ("prices", chain),
+            lambda c=chain, ts=chain_tokens: cg.current_prices(
+                [t.address for t in ts], chain=c
+            ),
+        )
+        for chain, chain_tokens in by_chain.items()
+    ] + [
+        Fetch(
+            ("market_chart", token_id(t), interval),
+            lambda t=t, i=interval: fetch_market_chart(t, i, start_date),
+        )
+        for t in tokens
+        for interval in intervals
+    ]
+    results = run_fetches(fetches, max_workers, report)
+
+    spot = {}
+    for chain, chain_tokens in by_chain.items():
+        quotes = results.get(("prices", chain), {})
+        spot.update({t: quotes.get(t.address.lower()) for t in chain_tokens})
+    fetches = [
+        Fetch(
+            ("swap_size", token_id(t), impact),
+            lambda t=t, i=impact: price_impact_size(
+                t, usd_quote_token(t), i, spot_in=spot[t]
+            ),
+        )
+        for t in tokens
+        for impact in impacts
+    ]
+    results.update(run_fetches(fetches, max_workers, report))
+
+    for interval in intervals:
+        hist_prices = {}
+        for t in tokens:
+            df = results.get(("market_chart", token_id(t), interval))
+            if df is not None:
+                hist_prices[t] = df[start_date:]
+                save_prices(t, hist_prices[t], interval)
+
+        calendar = PriceCalendar.from_prices(hist_prices, start_date)
+        pairs = [
+            (t1, t2)
+            for chain_tokens in by_chain.values()
+            for t1, t2 in permutations(chain_tokens, 2)
+            if t1 in hist_prices and t2 in hist_prices
+        ]
+        dds = compute_pair_drawdowns(pairs, calendar, interval, processes)
+        path = drawdown_cache_path(interval)
+        update_drawdown_cache(dds, path)
+        log.info(f"Saved {len(dds)} {interval} pair drawdowns to {path}")
+
+    sizes = {}
+    n_sizes = 0
+    for key, size in results.items():
+        if key[0] == "swap_size":
+            _, tid, impact = key
+            sizes.setdefault(tid, {})[str(impact)] = size
+            n_sizes += 1
+    update_swap_size_cache(sizes, PRICE_IMPACT_JSON_PATH)
+    log.info(f"Saved {n_sizes} swap sizes to {PRICE_IMPACT_JSON_PATH}")
+
+    report.wall_sec = time.time() - start
+    stats_after = api_stats()
+    report.apis = {
+        name: {
+            k: v - stats_before.get(name, {}).get(k, 0)
+            for k, v in stats.items()
+        }
+        for name, stats in stats_after.items()
+    }
+    return report
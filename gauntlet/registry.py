@@ -0,0 +1,210 @@
+import sqlite3
+import time
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+
+from .chains import CHAINS
+from .chains import DEFAULT_CHAIN
+from .constants import TOKEN_DB_PATH
+from .tokens import Token
+from .tokens import Tokens
+
+# Dynamically discovered tokens (and total supplies) are refetched after this
+TOKEN_TTL_SEC = 7 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chain_tokens (
+    chain TEXT NOT NULL,
+    address TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    decimals INTEGER NOT NULL,
+    coingecko_id TEXT NOT NULL,
+    total_supply REAL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (chain, address)
+)
+"""
+
+
+def normalize_address(address: str) -> str:
+    return address.lower()
+
+
+def is_address(input_str: str) -> bool:
+    return input_str.startswith("0x") and len(input_str) == 42
+
+
+class TokenRegistry:
+    """
+    Token lookups by address, symbol or coingecko id in O(1). Every index
+    is keyed by chain as well, so the same symbol or coingecko id can map to
+    a different token contract on each chain.
+
+    The tokens defined in `Tokens` are always known. Tokens discovered at
+    runtime (ex: from CoinGecko) are persisted to a local sqlite store with
+    the time they were fetched, and are forgotten once older than `ttl_sec`
+    so their decimals and supply get refreshed. Addresses are indexed in
+    lowercase, so checksummed inputs resolve to the same token.
+    """
+
+    __slots__ = (
+        "path",
+        "ttl_sec",
+        "_by_address",
+        "_by_symbol",
+        "_by_id",
+        "_supply",
+    )
+
+    def __init__(
+        self, path: Optional[Path] = TOKEN_DB_PATH, ttl_sec=TOKEN_TTL_SEC
+    ):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self._by_address: dict[tuple[str, str], Token] = {}
+        self._by_symbol: dict[tuple[str, str], Token] = {}
+        self._by_id: dict[tuple[str, str], Token] = {}
+        # (chain, address) -> (total supply, fetched at)
+        self._supply: dict[tuple[str, str], tuple[float, float]] = {}
+
+        for t in Tokens:
+            self._index(t)
+        for chain in CHAINS.values():
+            for t in (chain.usd_quote, chain.usd_quote_alt):
+                if not isinstance(t, Tokens):
+                    self._index(t)
+        self._load()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute(_SCHEMA)
+        return conn
+
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            return
+        cutoff = time.time() - self.ttl_sec
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT chain, address, symbol, decimals, coingecko_id,"
+                + " total_supply, fetched_at FROM chain_tokens"
+                + " WHERE fetched_at >= ?",
+                (cutoff,),
+            ).fetchall()
+
+        for chain, address, symbol, decimals, cg_id, supply, ts in rows:
+            if supply is not None:
+                self._supply[(chain, address)] = (supply, ts)
+            if (chain, address) in self._by_address:
+                # statically defined token, only the supply is cached
+                continue
+            self._index(
+                Token(
+                    symbol=symbol,
+                    address=address,
+                    decimals=decimals,
+                    coingecko_id=cg_id,
+                    total_supply=supply,
+                    chain=chain,
+                )
+            )
+
+    def _index(self, token: Token):
+        chain = token.chain
+        self._by_address[(chain, normalize_address(token.address))] = token
+        # statically defined tokens win symbol and id collisions
+        for index, key in (
+            (self._by_symbol, (chain, token.symbol.lower())),
+            (self._by_id, (chain, token.coingecko_id)),
+        ):
+            if not isinstance(index.get(key), Tokens):
+                index[key] = token
+
+    def __len__(self) -> int:
+        return len(self._by_address)
+
+    def by_address(
+        self, address: str, chain: str = DEFAULT_CHAIN
+    ) -> Optional[Token]:
+        return self._by_address.get((chain, normalize_address(address)))
+
+    def by_symbol(
+        self, symbol: str, chain: str = DEFAULT_CHAIN
+    ) -> Optional[Token]:
+        return self._by_symbol.get((chain, symbol.lower()))
+
+    def by_coingecko_id(
+        self, coingecko_id: str, chain: str = DEFAULT_CHAIN
+    ) -> Optional[Token]:
+        return self._by_id.get((chain, coingecko_id))
+
+    def lookup(
+        self, symbol_or_address: str, chain: str = DEFAULT_CHAIN
+    ) -> Optional[Token]:
+        if is_address(symbol_or_address):
+            return self.by_address(symbol_or_address, chain)
+        return self.by_symbol(symbol_or_address, chain)
+
+    def missing(
+        self, addresses: Iterable[str], chain: str = DEFAULT_CHAIN
+    ) -> list[str]:
+        """
+        Normalized, deduplicated addresses that are not in the registry.
+        """
+        normalized = dict.fromkeys(normalize_address(a) for a in addresses)
+        return [a for a in normalized if (chain, a) not in self._by_address]
+
+    def total_supply(self, token: Token) -> Optional[float]:
+        """
+        Total supply of the token if it is known and not stale.
+        """
+        if token.total_supply is not None:
+            return token.total_supply
+        cached = self._supply.get(
+            (token.chain, normalize_address(token.address))
+        )
+        if cached is None or time.time() - cached[1] > self.ttl_sec:
+            return None
+        return cached[0]
+
+    def add(self, tokens: Iterable[Token]):
+        """
+        Indexes and persists dynamically discovered tokens. Statically
+        defined tokens only have their total supply cached.
+        """
+        now = time.time()
+        rows = []
+        for t in tokens:
+            key = (t.chain, normalize_address(t.address))
+            if t.total_supply is not None:
+                self._supply[key] = (t.total_supply, now)
+            if not isinstance(self._by_address.get(key), Tokens):
+                self._index(t._replace(address=key[1]))
+            rows.append(
+                (
+                    *key,
+                    t.symbol,
+                    t.decimals,
+                    t.coingecko_id,
+                    t.total_supply,
+                    now,
+                )
+            )
+
+        if self.path is None or not rows:
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chain_tokens"
+                + " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+@lru_cache
+def default_registry() -> TokenRegistry:
+    return TokenRegistry()
@@ -0,0 +1,168 @@
+import json
+import threading
+from pathlib import Path
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .io_utils import write_atomic
+
+# Insolvency of one market at one LLTV
+CURVE_DTYPE = np.dtype(
+    [
+        ("market", "u4"),
+        ("lltv", "f4"),
+        ("liq_bonus", "f4"),
+        ("insolvency_usd", "f4"),
+    ]
+)
+
+META_FILE = "meta.json"
+
+
+def _dtype_from_descr(descr: list) -> np.dtype:
+    return np.dtype([tuple(field) for field in descr])
+
+
+class ResultStore:
+    """
+    Append only store of sweep results backed by numpy structured arrays.
+
+    Records are buffered in memory and written to disk in chunks of
+    `chunk_size` rows, one .npy file per chunk. Reads memory map the
+    chunks, so a result set larger than RAM can be scanned chunk by chunk
+    and single columns can be loaded without the others. A float32 /
+    uint32 record such as `CURVE_DTYPE` takes 16 bytes per row.
+
+    The store directory holds the chunks and a meta.json file with the
+    dtype, the chunk list and free form `attrs` (ex: the markets the
+    `market` column indexes). The meta file is rewritten atomically after
+    each chunk, so an interrupted writer leaves a readable store. Appends
+    are thread safe.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        dtype: np.dtype = CURVE_DTYPE,
+        chunk_size: int = 1 << 20,
+        attrs: Optional[dict] = None,
+    ):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        meta_path = self.path / META_FILE
+        if meta_path.exists():
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            self.dtype = _dtype_from_descr(meta["dtype"])
+            self.attrs = meta["attrs"]
+            self._chunks = meta["chunks"]
+            if attrs:
+                self.attrs.update(attrs)
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.dtype = np.dtype(dtype)
+            self.attrs = attrs or {}
+            self._chunks = []
+        self._buffer: list[np.ndarray] = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(n for _, n in self._chunks) + self._buffered
+
+    def label_id(self, label: str) -> int:
+        """
+        Integer id of `label` (ex: a market key) for compact id columns.
+        Labels are kept in `attrs["labels"]`.
+        """
+        with self._lock:
+            labels = self.attrs.setdefault("labels", [])
+            if label not in labels:
+                labels.append(label)
+            return labels.index(label)
+
+    def append(self, records: np.ndarray):
+        records = np.asarray(records).astype(self.dtype, copy=False)
+        with self._lock:
+            self._buffer.append(records)
+            self._buffered += len(records)
+            while self._buffered >= self.chunk_size:
+                buffered = np.concatenate(self._buffer)
+                self._write_chunk(buffered[: self.chunk_size])
+                rest = buffered[self.chunk_size :]
+                self._buffer = [rest] if len(rest) else []
+                self._buffered = len(rest)
+
+    def flush(self):
+        with self._lock:
+            if self._buffered:
+                self._write_chunk(np.concatenate(self._buffer))
+                self._buffer = []
+                self._buffered = 0
+            else:
+                self._write_meta()
+
+    def _write_chunk(self, records: np.ndarray):
+        name = f"chunk-{len(self._chunks):05d}.npy"
+        write_atomic(
+            self.path / name, lambda f: np.save(f, records), mode="wb"
+        )
+        self._chunks.append((name, len(records)))
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "dtype": self.dtype.descr,
+            "chunks": self._chunks,
+            "attrs": self.attrs,
+        }
+        write_atomic(
+            self.path / META_FILE,
+            lambda f: json.dump(meta, f, indent=4),
+        )
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def iter_chunks(self) -> Iterator[np.ndarray]:
+        """
+        Read only memory maps of the flushed chunks.
+        """
+        for name, _ in self._chunks:
+            yield np.load(self.path / name, mmap_mode="r")
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        One column of every flushed record, loaded into memory.
+        """
+        chunks = [np.asarray(chunk[name]) for chunk in self.iter_chunks()]
+        if not chunks:
+            return np.array([], dtype=self.dtype[name])
+        return np.concatenate(chunks)
+
+    def select(self, where: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Flushed records matching `where`, a function mapping a chunk to a
+        boolean mask. Only the matching rows are loaded into memory.
+        """
+        chunks = [chunk[where(chunk)] for chunk in self.iter_chunks()]
+        if not chunks:
+            return np.array([], dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    def to_frame(
+        self, where: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    ) -> pd.DataFrame:
+        """
+        DataFrame of the records matching `where` (all by default), for
+        plotting. `labels` ids are left as integers.
+        """
+        records = self.select(where or (lambda c: np.ones(len(c), bool)))
+        return pd.DataFrame.from_records(records)
@@ -0,0 +1,585 @@
+import time
+from collections import defaultdict
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import fields
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from .chains import DEFAULT_CHAIN
+from .chains import get_chain
+from .bounds import classify_lltvs
+from .bounds import last_solvent_index
+from .bounds import Verdict
+from .coingecko import CoinGecko
+from .coingecko import current_price
+from .coingecko import token_from_symbol_or_address
+from .data_utils import get_drawdowns
+from .data_utils import get_price_impacts
+from .impact_table import MarketLiquidity
+from .logger import get_logger
+from .results import CURVE_DTYPE
+from .results import ResultStore
+from .shared import market_arrays
+from .shared import SharedArrays
+from .shared import Spec
+from .snapshot import active_snapshot
+from .sim import compute_liquidation_incentive
+from .sim import get_init_collateral_usd
+from .sim import heuristic_drawdown
+from .sim import simulate_insolvency
+from .sim import simulate_insolvency_adaptive
+from .tokens import Token
+from .tokens import token_id
+from .universe import default_universe
+from .universe import Universe
+
+log = get_logger(__name__)
+
+# (LLTV, liquidation incentive) of a market, (None, None) if none is solvent
+Result = Tuple[Optional[float], Optional[float]]
+
+LLTVS = np.arange(0.01, 1.0, 0.01)
+
+
+@dataclass(frozen=True)
+class Market:
+    """
+    A collateral / borrow market to evaluate. Tokens are given as symbols or
+    addresses on `chain`.
+    """
+
+    collateral: str
+    borrow: str
+    chain: str = DEFAULT_CHAIN
+
+
+@dataclass(frozen=True)
+class MarketParams:
+    """
+    Market dependent inputs of `simulate_insolvency`.
+    """
+
+    initial_collateral_usd: float
+    collateral_price: float
+    debt_price: float
+    repay_amount_usd: float
+    max_drawdown: float
+
+
+# Callback of `evaluate_markets` with the market, its sim inputs, its
+# result, its insolvency curve (`CURVE_DTYPE` records) and the timings
+OnResult = Callable[
+    [Market, MarketParams, Result, Optional[np.ndarray], dict[str, float]],
+    None,
+]
+
+
+def market_params(
+    collateral_token: Token,
+    debt_token: Token,
+    price_impacts: dict[str, dict[str, float]],
+    drawdowns: dict[Tuple[str, str], dict],
+    prices: Optional[dict[Token, float]] = None,
+) -> MarketParams:
+    """
+    Derives the sim inputs of a market from the swap size and drawdown
+    caches (see `get_price_impacts` and `get_drawdowns`). Current prices
+    are fetched for the tokens missing from `prices`.
+    """
+    prices = {
+        t: (prices or {}).get(t) or current_price(t.address, t.chain)
+        for t in (collateral_token, debt_token)
+    }
+    repay_amount_usd = min(
+        price_impacts[token_id(collateral_token)]["0.005"]
+        * prices[collateral_token],
+        price_impacts[token_id(debt_token)]["0.005"] * prices[debt_token],
+    )
+    return MarketParams(
+        initial_collateral_usd=get_init_collateral_usd(
+            collateral_token,
+            debt_token,
+            price_impacts,
+            collateral_price=prices[collateral_token],
+        ),
+        collateral_price=prices[collateral_token],
+        debt_price=prices[debt_token],
+        repay_amount_usd=repay_amount_usd,
+        max_drawdown=heuristic_drawdown(
+            collateral_token, debt_token, drawdowns
+        ),
+    )
+
+
+def liquidation_bonuses(
+    lltvs: np.ndarray, m: float, beta: float, min_liq_bonus: float
+) -> np.ndarray:
+    return np.array(
+        [
+            max(compute_liquidation_incentive(m, beta, ltv), min_liq_bonus)
+            for ltv in lltvs
+        ]
+    )
+
+
+def find_optimal_lltv(
+    params: MarketParams,
+    pct_decrease: float = 0.005,
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    lltvs: np.ndarray = LLTVS,
+    use_bounds: bool = True,
+    liquidity: Optional[MarketLiquidity] = None,
+    adaptive: bool = False,
+) -> Result:
+    """
+    Largest LLTV (and its liquidation incentive) that results in 0
+    insolvent debt. Returns (None, None) if every LLTV is insolvent.
+
+    use_bounds: bool, skip the simulation of the LLTVs that the analytic
+        bounds of `classify_lltvs` already decide
+    liquidity: MarketLiquidity, if given the repay amount of each step is
+        derived from the market's impact tables rather than fixed to
+        params.repay_amount_usd (see `simulate_insolvency`)
+    adaptive: bool, simulate with the variable step size stepper of
+        `simulate_insolvency_adaptive` instead of the bounds and the fixed
+        step sim. Results only differ by float rounding, and the stepper is
+        much faster at small pct_decrease.
+    """
+    liq_bonuses = liquidation_bonuses(lltvs, m, beta, min_liq_bonus)
+    # Note: for the purpose of this tool, we are just interested in the largest
+    # LLTV that results in 0 insolvent debt.
+    last = last_solvent_index(
+        initial_collateral_usd=params.initial_collateral_usd,
+        collateral_price=params.collateral_price,
+        debt_price=params.debt_price,
+        lltvs=lltvs,
+        repay_amount_usd=params.repay_amount_usd,
+        liq_bonuses=liq_bonuses,
+        max_drawdown=params.max_drawdown,
+        pct_decrease=pct_decrease,
+        use_bounds=use_bounds,
+        liquidity=liquidity,
+        adaptive=adaptive,
+    )
+    if last is None:
+        return None, None
+    return lltvs[last], liq_bonuses[last]
+
+
+def insolvency_curve(
+    params: MarketParams,
+    market_id: int = 0,
+    pct_decrease: float = 0.005,
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    lltvs: np.ndarray = LLTVS,
+    use_bounds: bool = True,
+    adaptive: bool = False,
+) -> np.ndarray:
+    """
+    Insolvent debt of a market at every LLTV, as `CURVE_DTYPE` records to
+    append to a `ResultStore`. Unlike `find_optimal_lltv` the sweep does
+    not stop at the first insolvent LLTV. LLTVs that `classify_lltvs`
+    proves solvent are recorded as 0 without being simulated.
+
+    adaptive: bool, simulate with `simulate_insolvency_adaptive`, without
+        the bounds (see `last_solvent_index`)
+    """
+    liq_bonuses = liquidation_bonuses(lltvs, m, beta, min_liq_bonus)
+    if use_bounds and not adaptive:
+        verdicts = classify_lltvs(
+            initial_collateral_usd=params.initial_collateral_usd,
+            collateral_price=params.collateral_price,
+            lltvs=lltvs,
+            repay_amount_usd=params.repay_amount_usd,
+            liq_bonuses=liq_bonuses,
+            max_drawdown=params.max_drawdown,
+            pct_decrease=pct_decrease,
+        )
+    else:
+        verdicts = np.full(len(lltvs), Verdict.UNKNOWN, dtype=np.int8)
+
+    curve = np.zeros(len(lltvs), dtype=CURVE_DTYPE)
+    curve["market"] = market_id
+    curve["lltv"] = lltvs
+    curve["liq_bonus"] = liq_bonuses
+    for i in np.flatnonzero(verdicts != Verdict.SOLVENT):
+        sim_inputs = dict(
+            lltv=lltvs[i],
+            liq_bonus=liq_bonuses[i],
+            pct_decrease=pct_decrease,
+            **asdict(params),
+        )
+        if adaptive:
+            run = simulate_insolvency_adaptive(**sim_inputs)
+            curve["insolvency_usd"][i] = run.insolvency
+        else:
+            curve["insolvency_usd"][i] = simulate_insolvency(**sim_inputs)
+    return curve
+
+
+def resolve_markets(
+    markets: list[Market],
+) -> dict[Market, Tuple[Token, Token]]:
+    """
+    (collateral, borrow) Tokens of every market. Each distinct symbol or
+    address is resolved once.
+    """
+    tokens = {}
+    for mkt in markets:
+        for symbol_or_address in (mkt.collateral, mkt.borrow):
+            key = (mkt.chain, symbol_or_address)
+            if key not in tokens:
+                tokens[key] = token_from_symbol_or_address(
+                    symbol_or_address, chain=mkt.chain
+                )
+    return {
+        mkt: (
+            tokens[(mkt.chain, mkt.collateral)],
+            tokens[(mkt.chain, mkt.borrow)],
+        )
+        for mkt in markets
+    }
+
+
+def load_market_data(
+    pairs: dict[Market, Tuple[Token, Token]],
+    interval: str = "daily",
+    update_cache: bool = False,
+    use_cache: bool = True,
+    processes: int = 0,
+) -> Tuple[list[Token], dict, dict, dict[Token, float]]:
+    """
+    Inputs shared by the markets of one chain. Swap sizes are computed once
+    for the union of the markets' tokens rather than once per market,
+    drawdowns only for the markets' pairs missing from the cache (over
+    `processes` worker processes, see `get_drawdowns`), and current prices
+    are fetched in bulk (or read from the run's price snapshot, see
+    `snapshot.activate_snapshot`).
+
+    Returns: (token universe, swap sizes, drawdowns, current prices)
+    """
+    universe = list(dict.fromkeys(t for pair in pairs.values() for t in pair))
+    if not universe:
+        return universe, {}, {}, {}
+    price_impacts = get_price_impacts(
+        universe,
+        impacts=[0.005, 0.25],
+        update_cache=update_cache,
+        use_cache=use_cache,
+    )
+    drawdowns = get_drawdowns(
+        universe,
+        update_cache=update_cache,
+        use_cache=use_cache,
+        interval=interval,
+        pairs=pairs.values(),
+        processes=processes,
+    )
+    snapshot = active_snapshot()
+    prices = {
+        t: snapshot.price(t.address, t.chain) if snapshot else None
+        for t in universe
+    }
+    missing = [t for t, p in prices.items() if p is None]
+    if missing:
+        quotes = CoinGecko().current_prices(
+            [t.address for t in missing], chain=universe[0].chain
+        )
+        prices.update({t: quotes.get(t.address.lower()) for t in missing})
+    return universe, price_impacts, drawdowns, prices
+
+
+def market_inputs(
+    pairs: dict[Market, Tuple[Token, Token]],
+    interval: str = "daily",
+    update_cache: bool = False,
+    use_cache: bool = True,
+) -> dict[Market, MarketParams]:
+    """
+    Sim inputs of every market of one chain (see `load_market_data`),
+    derived for every pair of the universe at once by `pair_param_arrays`.
+    Current prices missing from the bulk quote are fetched one by one.
+    """
+    universe, price_impacts, drawdowns, prices = load_market_data(
+        pairs, interval, update_cache, use_cache
+    )
+    prices = {
+        t: p or current_price(t.address, t.chain) for t, p in prices.items()
+    }
+    missing = [
+        (token_id(c), token_id(d))
+        for c, d in pairs.values()
+        if (token_id(c), token_id(d)) not in drawdowns
+    ]
+    if missing:
+        raise KeyError(f"No drawdowns for {missing}")
+    arrays = market_arrays(universe, price_impacts, drawdowns, prices)
+    arrays.update(pair_param_arrays(arrays))
+    index = {t: k for k, t in enumerate(universe)}
+    return {
+        mkt: params_from_arrays(arrays, index[c], index[d])
+        for mkt, (c, d) in pairs.items()
+    }
+
+
+def pair_param_arrays(
+    arrays: dict[str, np.ndarray], universe: Optional[Universe] = None
+) -> dict[str, np.ndarray]:
+    """
+    `market_params` of every ordered (collateral, debt) pair of a token
+    universe from its `market_arrays`: one (n_tokens, n_tokens) array per
+    `MarketParams` field, with the tier guardrails applied to all pairs at
+    once (see `Universe`).
+    """
+    universe = universe or default_universe()
+    price = arrays["price"]
+    sizes = arrays["swap_sizes"]
+    small = int(np.flatnonzero(arrays["impacts"] == 0.005)[0])
+    large = int(np.flatnonzero(arrays["impacts"] == 0.25)[0])
+    horizon = int(np.flatnonzero(arrays["horizons"] == 30)[0])
+    pct = int(np.flatnonzero(arrays["percentiles"] == 99)[0])
+    blue_chips = arrays["blue_chip"][:, None] & arrays["blue_chip"][None, :]
+    repay_usd = sizes[:, small] * price
+    shape = blue_chips.shape
+    return {
+        "initial_collateral_usd": universe.init_collateral_usd(
+            (sizes[:, large] * price)[:, None], blue_chips
+        ),
+        "collateral_price": np.broadcast_to(price[:, None], shape).copy(),
+        "debt_price": np.broadcast_to(price[None, :], shape).copy(),
+        "repay_amount_usd": np.minimum(repay_usd[:, None], repay_usd[None, :]),
+        "max_drawdown": universe.max_drawdown(
+            arrays["drawdowns"][:, :, horizon, pct], blue_chips
+        ),
+    }
+
+
+def params_from_arrays(data: SharedArrays, i: int, j: int) -> MarketParams:
+    """
+    `MarketParams` of the collateral token `i` and debt token `j` of the
+    universe, read from the arrays of `pair_param_arrays`. Raises if an
+    input is missing (NaN) rather than simulating it.
+    """
+    params = {f.name: float(data[f.name][i, j]) for f in fields(MarketParams)}
+    missing = [name for name, x in params.items() if not np.isfinite(x)]
+    if missing:
+        raise ValueError(f"Non finite sim inputs {missing} of pair ({i}, {j})")
+    return MarketParams(**params)
+
+
+# Market arrays of the parent process, attached once per worker process
+_WORKER_DATA: Optional[SharedArrays] = None
+
+
+def _attach_worker(spec: Spec):
+    global _WORKER_DATA
+    _WORKER_DATA = SharedArrays.attach(spec)
+
+
+def _evaluate_pair(i: int, j: int, sim_kwargs: dict) -> Result:
+    return find_optimal_lltv(
+        params_from_arrays(_WORKER_DATA, i, j), **sim_kwargs
+    )
+
+
+def _evaluate_pair_curve(
+    i: int, j: int, sim_kwargs: dict
+) -> Tuple[MarketParams, Result, np.ndarray, dict[str, float]]:
+    params = params_from_arrays(_WORKER_DATA, i, j)
+    return (params,) + _evaluate_with_curve(params, sim_kwargs)
+
+
+def _evaluate_with_curve(
+    params: MarketParams, sim_kwargs: dict
+) -> Tuple[Result, np.ndarray, dict[str, float]]:
+    """
+    Optimal LLTV and insolvency curve of a market, with the seconds spent
+    on each.
+    """
+    start = time.perf_counter()
+    result = find_optimal_lltv(params, **sim_kwargs)
+    searched = time.perf_counter()
+    curve = insolvency_curve(params, **sim_kwargs)
+    timings = {
+        "search_sec": searched - start,
+        "curve_sec": time.perf_counter() - searched,
+    }
+    return result, curve, timings
+
+
+def log_result(mkt: Market, result: Result):
+    lltv, li = result
+    if lltv is None:
+        log.warning(f"Did not observe an optimal LLTV for {mkt}")
+    else:
+        log.info(
+            f"{mkt.chain} | Collateral: {mkt.collateral}"
+            + f" | Debt: {mkt.borrow} | LI: {li:.3f} | LLTV: {lltv:.3f}"
+        )
+
+
+def evaluate_markets(
+    markets: list[Market],
+    interval: str = "daily",
+    update_cache: bool = False,
+    use_cache: bool = True,
+    processes: int = 0,
+    store: Optional[ResultStore] = None,
+    on_result: Optional[OnResult] = None,
+    **sim_kwargs,
+) -> dict[Market, Result]:
+    """
+    Optimal (LLTV, liquidation incentive) of every market of one chain.
+
+    processes: int, number of worker processes to spread the markets over
+        (see `evaluate_markets_parallel`), 0 evaluates them in this process
+    store: ResultStore, if given the insolvency of every market at every
+        LLTV (see `insolvency_curve`) is appended to it. Markets are
+        identified by their `store.label_id`.
+    on_result: called with (market, params, result, insolvency curve,
+        timings) as soon as each market is evaluated, ex: to stream the
+        results (see `output.NdjsonWriter`)
+    sim_kwargs: passed to `find_optimal_lltv`
+    """
+    if processes and store is not None:
+        raise ValueError("Insolvency curves are not recorded by processes")
+    if processes:
+        return evaluate_markets_parallel(
+            markets,
+            processes,
+            interval,
+            update_cache,
+            use_cache,
+            on_result=on_result,
+            **sim_kwargs,
+        )
+    start = time.perf_counter()
+    params = market_inputs(
+        resolve_markets(markets), interval, update_cache, use_cache
+    )
+    inputs_sec = time.perf_counter() - start
+    results = {}
+    for mkt in markets:
+        curve = None
+        if store is None and on_result is None:
+            results[mkt] = find_optimal_lltv(params[mkt], **sim_kwargs)
+        else:
+            results[mkt], curve, timings = _evaluate_with_curve(
+                params[mkt], sim_kwargs
+            )
+        log_result(mkt, results[mkt])
+        if store is not None:
+            curve["market"] = store.label_id(
+                f"{mkt.chain}:{mkt.collateral}/{mkt.borrow}"
+            )
+            store.append(curve)
+        if on_result is not None:
+            # inputs are loaded once for all the markets
+            timings["inputs_sec"] = inputs_sec
+            on_result(mkt, params[mkt], results[mkt], curve, timings)
+    return results
+
+
+def evaluate_markets_parallel(
+    markets: list[Market],
+    processes: int,
+    interval: str = "daily",
+    update_cache: bool = False,
+    use_cache: bool = True,
+    on_result: Optional[OnResult] = None,
+    **sim_kwargs,
+) -> dict[Market, Result]:
+    """
+    `evaluate_markets` over a pool of worker processes. The inputs of the
+    whole universe are written once to shared memory (see `SharedArrays`)
+    that every worker attaches to when it starts, so tasks only carry the
+    indices of the market's tokens. With `on_result`, workers also compute
+    the insolvency curves and results are reported in completion order.
+    """
+    start = time.perf_counter()
+    pairs = resolve_markets(markets)
+    universe, price_impacts, drawdowns, prices = load_market_data(
+        pairs, interval, update_cache, use_cache, processes
+    )
+    # unpriced tokens would be NaN in the shared arrays
+    prices = {
+        t: p or current_price(t.address, t.chain) for t, p in prices.items()
+    }
+    index = {t: k for k, t in enumerate(universe)}
+    arrays = market_arrays(universe, price_impacts, drawdowns, prices)
+    arrays.update(pair_param_arrays(arrays))
+    inputs_sec = time.perf_counter() - start
+
+    results = {}
+    with SharedArrays.create(arrays) as data:
+        with ProcessPoolExecutor(
+            processes, initializer=_attach_worker, initargs=(data.spec,)
+        ) as pool:
+            if on_result is None:
+                futures = {
+                    mkt: pool.submit(
+                        _evaluate_pair, index[c], index[d], sim_kwargs
+                    )
+                    for mkt, (c, d) in pairs.items()
+                }
+                for mkt in markets:
+                    results[mkt] = futures[mkt].result()
+                    log_result(mkt, results[mkt])
+                return results
+
+            futures = {
+                pool.submit(
+                    _evaluate_pair_curve, index[c], index[d], sim_kwargs
+                ): mkt
+                for mkt, (c, d) in pairs.items()
+            }
+            for future in as_completed(futures):
+                mkt = futures[future]
+                params, results[mkt], curve, timings = future.result()
+                log_result(mkt, results[mkt])
+                timings["inputs_sec"] = inputs_sec
+                on_result(mkt, params, results[mkt], curve, timings)
+    return {mkt: results[mkt] for mkt in markets}
+
+
+def evaluate_universes(
+    markets: Iterable[Market],
+    max_workers: Optional[int] = None,
+    evaluate: Callable[..., dict[Market, Result]] = evaluate_markets,
+    **kwargs,
+) -> dict[Market, Result]:
+    """
+    Evaluates the market universe of every chain in parallel, one worker
+    per chain. API clients of every worker share one rate limiter per
+    upstream API (see `coingecko.rate_limiter`), so running chains in
+    parallel does not multiply the request rate.
+
+    evaluate: function evaluating the markets of one chain
+    kwargs: passed to `evaluate`
+    """
+    by_chain = defaultdict(list)
+    for mkt in markets:
+        get_chain(mkt.chain)
+        by_chain[mkt.chain].append(mkt)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers or len(by_chain) or 1) as pool:
+        futures = [
+            pool.submit(evaluate, chain_markets, **kwargs)
+            for chain_markets in by_chain.values()
+        ]
+        for future in futures:
+            results.update(future.result())
+    return results
@@ -0,0 +1,132 @@
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+import yfinance as yf
+
+from .constants import RWA_PRICES_DIR
+from .data_utils import rolling_drawdowns
+from .io_utils import write_atomic
+from .logger import get_logger
+from .tokens import Token
+
+log = get_logger(__name__)
+
+# Yahoo finance bar size of the RWA price history. Intraday bars ("1h") are
+# only served for the last 730 days.
+RWA_INTERVAL = "1d"
+# Time it takes to fully liquidate a position
+NB_FULL_LIQUIDATION_DAYS = 30
+# Timestep for one liquidation
+NB_LIQUIDATION_DAYS = 3
+# Cached histories younger than this are used without hitting Yahoo finance
+MAX_CACHE_AGE_SEC = 12 * 60 * 60
+
+
+@dataclass(frozen=True)
+class RWAMarketData:
+    """
+    Simulation inputs derived from the price history of an RWA ticker.
+
+    - last_close: float, latest close price, used as the collateral price
+    - max_drawdown: float, `quantile` of the drawdowns over the time it takes
+        to fully liquidate a position
+    - pct_decrease: float, mean drawdown over one liquidation timestep
+    """
+
+    ticker: str
+    last_close: float
+    max_drawdown: float
+    pct_decrease: float
+
+
+def rwa_ticker(token: Token) -> str:
+    """
+    Yahoo finance ticker of a `b` prefixed RWA token (ex: bIB01 -> IB01.L).
+    """
+    return token.symbol[1:] + ".L"
+
+
+def rwa_window(days: int, interval: str = RWA_INTERVAL):
+    # Daily bars keep the original window of `days` observations, intraday
+    # bars use a time based window of the same length.
+    return days if interval == "1d" else pd.Timedelta(days=days)
+
+
+def _fetch_history(ticker: str, interval: str, start=None) -> pd.DataFrame:
+    if start is not None:
+        kwargs = {"start": start}
+    else:
+        kwargs = {"period": "max" if interval == "1d" else "730d"}
+    df = yf.Ticker(ticker).history(interval=interval, **kwargs)
+    if len(df):
+        df.index = df.index.tz_convert("UTC")
+    return df
+
+
+def load_rwa_history(
+    ticker: str,
+    interval: str = RWA_INTERVAL,
+    refresh: bool = True,
+    max_age_sec: float = MAX_CACHE_AGE_SEC,
+    cache_dir: Path = RWA_PRICES_DIR,
+) -> pd.DataFrame:
+    """
+    Price history of an RWA ticker, backed by a csv cache per ticker and bar
+    size. A stale cache is refreshed incrementally: only the bars since the
+    last cached bar are requested and appended.
+
+    ticker: str, yahoo finance ticker
+    interval: str, yahoo finance bar size
+    refresh: bool, if false the cache is returned as is when it exists
+    max_age_sec: float, caches modified more recently than this are not
+        refreshed
+    """
+    path = cache_dir / f"{ticker}_{interval}.csv"
+    cached = None
+    if path.exists():
+        cached = pd.read_csv(path, index_col=0)
+        cached.index = pd.to_datetime(cached.index, utc=True)
+        fresh = time.time() - path.stat().st_mtime < max_age_sec
+        if not refresh or fresh:
+            return cached
+
+    if cached is not None and len(cached):
+        # The last cached bar may have been partial, so it is fetched again
+        new = _fetch_history(ticker, interval, start=cached.index[-1])
+        log.debug(f"Fetched {len(new)} new {interval} bars for {ticker}")
+        df = pd.concat([cached, new])
+        df = df[~df.index.duplicated(keep="last")]
+    else:
+        df = _fetch_history(ticker, interval)
+
+    df.sort_index(inplace=True)
+    df.dropna(inplace=True)
+
+    write_atomic(path, df.to_csv)
+    return df
+
+
+@lru_cache
+def rwa_market_data(
+    ticker: str, interval: str = RWA_INTERVAL, quantile: float = 0.99
+) -> RWAMarketData:
+    """
+    Loads the history of the ticker once per process and derives the
+    drawdown inputs shared by the LLTV and supply cap solvers.
+    """
+    close = load_rwa_history(ticker, interval)["Close"]
+    full_liquidation_dds = rolling_drawdowns(
+        close, rwa_window(NB_FULL_LIQUIDATION_DAYS, interval)
+    )
+    liquidation_dds = rolling_drawdowns(
+        close, rwa_window(NB_LIQUIDATION_DAYS, interval)
+    )
+    return RWAMarketData(
+        ticker=ticker,
+        last_close=float(close.iloc[-1]),
+        max_drawdown=float(full_liquidation_dds.quantile(quantile)),
+        pct_decrease=float(liquidation_dds.mean()),
+    )
@@ -0,0 +1,194 @@
+from dataclasses import asdict
+from typing import Hashable
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from .constants import TOL
+from .logger import get_logger
+from .runner import LLTVS
+from .runner import MarketParams
+
+log = get_logger(__name__)
+
+# Inputs whose sensitivities are reported by default
+SENSITIVITY_INPUTS = ("max_drawdown", "repay_amount_usd", "pct_decrease")
+# Relative nudge of an input for its central difference
+REL_STEP = 0.01
+# Width of the LLTV bracket the bisection stops at
+LLTV_TOL = 1e-6
+
+
+def simulate_insolvency_batch(
+    *,
+    initial_collateral_usd: np.ndarray,
+    collateral_price: np.ndarray,
+    debt_price: np.ndarray,
+    lltv: np.ndarray,
+    repay_amount_usd: np.ndarray,
+    liq_bonus: np.ndarray,
+    max_drawdown: np.ndarray,
+    pct_decrease: np.ndarray,
+) -> np.ndarray:
+    """
+    `simulate_insolvency` of many scenarios at once. Every input is an
+    array (or a scalar) broadcast to the number of scenarios, and each
+    scenario runs the same float operations as the scalar sim, so the
+    insolvencies are identical. Scenarios are dropped from the state
+    arrays as they finish.
+
+    Returns: insolvent debt of every scenario
+    """
+    inputs = np.broadcast_arrays(
+        *(
+            np.asarray(x, dtype=np.float64)
+            for x in (
+                initial_collateral_usd,
+                collateral_price,
+                debt_price,
+                lltv,
+                repay_amount_usd,
+                liq_bonus,
+                max_drawdown,
+                pct_decrease,
+            )
+        )
+    )
+    c0, price, debt_price, lltv, repay, bonus, dd, pct = (
+        np.ravel(x) for x in inputs
+    )
+    insolvency = np.zeros(len(c0))
+
+    # same early exit as the sim: the drawdown never reaches insolvency
+    live = np.flatnonzero(~(lltv * (1 + bonus) < (1 - dd)))
+    tokens = c0[live] / price[live]
+    debt_tokens = (c0[live] * lltv[live]) / debt_price[live]
+    min_price = price[live] * (1 - dd[live])
+    max_iters = np.ceil((c0[live] / repay[live]) + 1)
+    decrement = price[live] * pct[live]
+    price, debt_price = price[live], debt_price[live]
+    lltv, repay, bonus = lltv[live], repay[live], bonus[live]
+
+    i = 0
+    while len(live):
+        price = np.maximum(min_price, price - decrement)
+        collateral = tokens * price
+        debt = debt_price * debt_tokens
+
+        liquidate = debt / collateral >= lltv
+        claimed = np.where(
+            liquidate,
+            np.minimum(np.minimum(debt, repay) * (1 + bonus), collateral),
+            0.0,
+        )
+        tokens = tokens - claimed / price
+        debt_tokens = debt_tokens - claimed / (debt_price * (1 + bonus))
+        collateral = collateral - claimed
+        debt = debt - claimed / (1 + bonus)
+
+        exhausted = collateral < TOL
+        insolvency[live[exhausted]] = debt[exhausted]
+        i += 1
+        done = exhausted | (debt < TOL) | (i >= max_iters + 10)
+        if done.any():
+            keep = ~done
+            live = live[keep]
+            tokens, debt_tokens = tokens[keep], debt_tokens[keep]
+            price, min_price = price[keep], min_price[keep]
+            decrement, debt_price = decrement[keep], debt_price[keep]
+            lltv, repay, bonus = lltv[keep], repay[keep], bonus[keep]
+            max_iters = max_iters[keep]
+    return insolvency
+
+
+def critical_lltvs(
+    scenarios: dict[str, np.ndarray],
+    m: float = 0.15,
+    beta: float = 0.3,
+    min_liq_bonus: float = 0.005,
+    lo: float = LLTVS[0],
+    hi: float = LLTVS[-1],
+    tol: float = LLTV_TOL,
+) -> np.ndarray:
+    """
+    Continuous insolvency boundary of every scenario: the LLTV (with its
+    liquidation incentive) in [lo, hi] at which the scenario turns
+    insolvent, found by bisecting all scenarios together, one
+    `simulate_insolvency_batch` per halving. Like the LLTV table, this
+    assumes that insolvency is monotone in the LLTV.
+
+    scenarios: `MarketParams` fields and `pct_decrease`, as arrays
+    Returns: the largest solvent LLTV of every scenario within `tol`, hi
+        if hi is solvent and NaN if lo is insolvent
+    """
+
+    def insolvent(lltv: np.ndarray) -> np.ndarray:
+        bonus = np.maximum(
+            np.minimum(m, 1 / (beta * lltv + (1 - beta)) - 1), min_liq_bonus
+        )
+        return (
+            simulate_insolvency_batch(lltv=lltv, liq_bonus=bonus, **scenarios)
+            > 0
+        )
+
+    n = np.broadcast(*scenarios.values()).size
+    lo_, hi_ = np.full(n, float(lo)), np.full(n, float(hi))
+    lo_insolvent = insolvent(lo_)
+    hi_solvent = ~insolvent(hi_)
+    for _ in range(int(np.ceil(np.log2((hi - lo) / tol)))):
+        mid = (lo_ + hi_) / 2
+        ins = insolvent(mid)
+        hi_ = np.where(ins, mid, hi_)
+        lo_ = np.where(ins, lo_, mid)
+
+    boundary = np.where(hi_solvent, float(hi), lo_)
+    boundary[lo_insolvent] = np.nan
+    return boundary
+
+
+def lltv_sensitivities(
+    markets: dict[Hashable, MarketParams],
+    pct_decrease: float = 0.005,
+    inputs: Iterable[str] = SENSITIVITY_INPUTS,
+    rel_step: float = REL_STEP,
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Insolvency boundary of every market (see `critical_lltvs`) and its
+    derivative with respect to each of the `inputs`, by central
+    differences with a relative step of `rel_step`.
+
+    The base and nudged scenarios of every market go through one batched
+    bisection, so a full report costs about one extra vectorized sweep
+    instead of two LLTV searches per input and market.
+
+    inputs: `MarketParams` fields or "pct_decrease"
+    kwargs: passed to `critical_lltvs`
+    Returns: DataFrame indexed by market with a `critical_lltv` column and
+        one `d_<input>` column per input (LLTV change per unit of input)
+    """
+    inputs = list(inputs)
+    base = pd.DataFrame(
+        [dict(asdict(p), pct_decrease=pct_decrease) for p in markets.values()]
+    )
+    # block 0: base scenarios, then one (+, -) pair of blocks per input
+    blocks = [base]
+    for name in inputs:
+        for sign in (1, -1):
+            nudged = base.copy()
+            nudged[name] = base[name] * (1 + sign * rel_step)
+            blocks.append(nudged)
+    scenarios = pd.concat(blocks, ignore_index=True)
+    boundary = critical_lltvs(
+        {c: scenarios[c].to_numpy() for c in scenarios}, **kwargs
+    ).reshape(len(blocks), len(base))
+
+    report = pd.DataFrame(
+        {"critical_lltv": boundary[0]}, index=pd.Index(list(markets))
+    )
+    for k, name in enumerate(inputs):
+        up, down = boundary[1 + 2 * k], boundary[2 + 2 * k]
+        step = 2 * rel_step * base[name].to_numpy()
+        report[f"d_{name}"] = (up - down) / step
+    return report
@@ -0,0 +1,133 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple
+
+import numpy as np
+
+from .tokens import Token
+from .tokens import token_id
+from .universe import default_universe
+
+# Offsets of the arrays in the shared block are aligned to cache lines
+_ALIGN = 64
+
+# name -> (byte offset, shape, dtype)
+Layout = dict[str, Tuple[int, Tuple[int, ...], str]]
+# What a worker needs to attach: (shared memory block name, layout)
+Spec = Tuple[str, Layout]
+
+
+class SharedArrays:
+    """
+    Named numpy arrays packed into a single shared memory block.
+
+    The process that `create`s the block owns it and unlinks it on `close`.
+    Other processes `attach` to it from its `spec`, a small picklable
+    tuple, and get read only views of the arrays without copying or
+    unpickling them, so memory use does not grow with the number of
+    workers.
+    """
+
+    def __init__(self, shm: SharedMemory, layout: Layout, owner: bool):
+        self._shm = shm
+        self._layout = layout
+        self._owner = owner
+        self._arrays = {}
+        for name, (offset, shape, dtype) in layout.items():
+            arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            arr.flags.writeable = False
+            self._arrays[name] = arr
+
+    @classmethod
+    def create(cls, arrays: dict[str, np.ndarray]) -> "SharedArrays":
+        layout = {}
+        size = 0
+        for name, arr in arrays.items():
+            size = -(-size // _ALIGN) * _ALIGN
+            layout[name] = (size, arr.shape, arr.dtype.str)
+            size += arr.nbytes
+
+        shm = SharedMemory(create=True, size=max(size, 1))
+        for name, arr in arrays.items():
+            offset, shape, dtype = layout[name]
+            view = np.ndarray(
+                shape, dtype=dtype, buffer=shm.buf, offset=offset
+            )
+            view[...] = arr
+        return cls(shm, layout, owner=True)
+
+    @classmethod
+    def attach(cls, spec: Spec) -> "SharedArrays":
+        name, layout = spec
+        # Worker processes share the resource tracker of the owner, which
+        # unregisters the block when it unlinks it
+        return cls(SharedMemory(name=name), layout, owner=False)
+
+    @property
+    def spec(self) -> Spec:
+        return self._shm.name, self._layout
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._arrays[name]
+
+    def close(self):
+        # views must be released before the buffer can be closed
+        self._arrays = {}
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def market_arrays(
+    tokens: list[Token],
+    price_impacts: dict[str, dict[str, float]],
+    drawdowns: dict[Tuple[str, str], dict],
+    prices: dict[Token, float],
+) -> dict[str, np.ndarray]:
+    """
+    Array form of the market inputs of a token universe, indexed by the
+    position of the tokens in `tokens`:
+
+    - price: (n_tokens,) current prices
+    - blue_chip: (n_tokens,) whether each token is in a blue chip tier
+        (see `Universe`)
+    - impacts, swap_sizes: (n_impacts,) price impacts and the
+        (n_tokens, n_impacts) swap sizes that incur them
+    - horizons, percentiles, drawdowns: the (n_tokens, n_tokens,
+        n_horizons, n_percentiles) pairwise drawdown tensor, NaN for
+        pairs without drawdowns
+    """
+    ids = [token_id(t) for t in tokens]
+    impacts = sorted({float(i) for t in ids for i in price_impacts[t]})
+    swap_sizes = np.array(
+        [[price_impacts[t].get(str(i), np.nan) for i in impacts] for t in ids]
+    )
+
+    pair_dds = [dds for dds in drawdowns.values() if dds]
+    horizons = sorted(pair_dds[0]) if pair_dds else []
+    percentiles = sorted(pair_dds[0][horizons[0]]) if pair_dds else []
+    dd_tensor = np.full(
+        (len(ids), len(ids), len(horizons), len(percentiles)), np.nan
+    )
+    for i, t1 in enumerate(ids):
+        for j, t2 in enumerate(ids):
+            dds = drawdowns.get((t1, t2))
+            if dds is None:
+                continue
+            for h, horizon in enumerate(horizons):
+                dd_tensor[i, j, h] = [dds[horizon][p] for p in percentiles]
+
+    return {
+        "price": np.array([prices[t] for t in tokens], dtype=np.float64),
+        "blue_chip": default_universe().is_blue_chip(ids),
+        "impacts": np.array(impacts),
+        "swap_sizes": swap_sizes,
+        "horizons": np.array(horizons),
+        "percentiles": np.array(percentiles, dtype=np.float64),
+        "drawdowns": dd_tensor,
+    }
@@ -1,46 +1,75 @@
+import logging
+from typing import NamedTuple
+from typing import Optional
 from typing import Tuple
 
 import numpy as np
 
 from .coingecko import current_price
-from .constants import BLUE_CHIPS
-from .constants import DEFAULT_DRAWDOWN
-from .constants import LARGE_CAP_DRAWDOWN
-from .constants import LARGE_CAP_MIN_WHALE_POS
-from .constants import LARGE_CAPS
-from .constants import SMALL_CAP_MIN_WHALE_POS
-from .constants import SMALL_CAPS
 from .constants import TOL
+from .impact_table import ArrayLike
+from .impact_table import MarketLiquidity
+from .impact_table import repay_from_sizes
 from .logger import get_logger
 from .tokens import Token
-
+from .tokens import token_id
+from .trace import SimTrace
+from .universe import default_universe
 
 log = get_logger(__name__)
 
+# Relative rounding error of one float operation
+EPS = float(np.finfo(np.float64).eps)
+# Smallest and largest number of steps of a batched liquidation run
+MIN_RUN_STEPS = 16
+MAX_RUN_STEPS = 1 << 16
+
+
+def init_collateral_usd_from_impact(
+    impact_size_usd: float, blue_chips: bool
+) -> float:
+    """
+    Clamps the usd size of a 25% price impact swap of the collateral to the
+    minimum whale position of the market's tier (see `Universe`).
+
+    blue_chips: bool, whether both assets of the market are blue chips
+    """
+    return float(
+        default_universe().init_collateral_usd(impact_size_usd, blue_chips)
+    )
+
 
 def get_init_collateral_usd(
     collat_token: Token,
     borrow_token: Token,
     price_impacts: dict[str, dict[str, float]],
+    collateral_price: Optional[float] = None,
 ) -> float:
     """
     The sim initializes one collateral position that maxes out its
     borrow power. The size of this collateral position is effectively
     a function of 25% price impact with some clamping to ensure
     reasonable sizes.
+    The current price of the collateral is fetched unless it is given.
     """
-    if collat_token in BLUE_CHIPS and borrow_token in BLUE_CHIPS:
-        return max(
-            LARGE_CAP_MIN_WHALE_POS,
-            price_impacts[collat_token.symbol]["0.25"]
-            * current_price(collat_token.address),
-        )
-    else:
-        return max(
-            SMALL_CAP_MIN_WHALE_POS,
-            price_impacts[collat_token.symbol]["0.25"]
-            * current_price(collat_token.address),
+    if collateral_price is None:
+        collateral_price = current_price(
+            collat_token.address, collat_token.chain
         )
+    return init_collateral_usd_from_impact(
+        price_impacts[token_id(collat_token)]["0.25"] * collateral_price,
+        default_universe().blue_chip_market(collat_token, borrow_token),
+    )
+
+
+def drawdown_from_history(hist_dd: float, blue_chips: bool) -> float:
+    """
+    Max drawdown of the sim given the 30 day 99th percentile historical
+    drawdown of the market's price ratio (see `Universe.max_drawdown`).
+
+    blue_chips: bool, whether both assets of the market are blue chips
+    """
+    return float(default_universe().max_drawdown(hist_dd, blue_chips))
 
 
 def heuristic_drawdown(
@@ -54,20 +83,13 @@ def heuristic_drawdown(
     drawdowns: dict, dict of the collateral/borrow Token pair mapped to
         the time horizon max drawdowns of their price ratio.
     """
-    # drawdown is a dict: symbol pair -> dict of time duration -> {percentile -> value}
+    # drawdown is a dict: token id pair -> dict of time duration -> {percentile -> value}
     # 30 day 99th percentile drawdown in ratio change of t1/t2
-    hist_dd = drawdowns[(t1.symbol, t2.symbol)][30][99]
+    hist_dd = drawdowns[(token_id(t1), token_id(t2))][30][99]
     log.debug(f"Historical drawdown: {hist_dd:.3f}")
-    # Handle super low drawdown cases for LSTs, stablecoin depeg
-    if hist_dd < 0.1:
-        return max(hist_dd, 0.02)
-
-    if t1 in BLUE_CHIPS and t2 in BLUE_CHIPS:
-        dd = LARGE_CAP_DRAWDOWN
-    else:
-        dd = DEFAULT_DRAWDOWN
-
-    return max(dd, hist_dd)
+    return drawdown_from_history(
+        hist_dd, default_universe().blue_chip_market(t1, t2)
+    )
 
 
 def compute_liquidation_incentive(m: float, beta: float, lltv: float) -> float:
@@ -92,6 +114,8 @@ def simulate_insolvency(
     liq_bonus: float,
     max_drawdown: float,
     pct_decrease: float,
+    trace: Optional[SimTrace] = None,
+    liquidity: Optional[MarketLiquidity] = None,
 ) -> float:
     """
     To simulate the potential insolvencies, we do the following
@@ -119,18 +143,47 @@ def simulate_insolvency(
     - max_drawdown: float, largest collateral value decrease allowed during the simulation
     - pct_decrease: float, proportion to scale the collateral value by at each timestep
         pct_decrease \in [0, 1] so the collateral value always decreases.
+    - trace: SimTrace, optional buffer that records the state at every step
+        of the run. Untraced runs do not pay for any per step bookkeeping.
+    - liquidity: MarketLiquidity, optional impact tables of the market. If
+        given, the amount repaid at each step is the largest one whose
+        slippage stays within the liquidation bonus at the current collateral
+        price (see `MarketLiquidity.repay_amount`) instead of
+        repay_amount_usd.
     """
+    if trace is not None:
+        trace.reset(
+            initial_collateral_usd=initial_collateral_usd,
+            collateral_price=collateral_price,
+            debt_price=debt_price,
+            lltv=lltv,
+            repay_amount_usd=repay_amount_usd,
+            liq_bonus=liq_bonus,
+            max_drawdown=max_drawdown,
+            pct_decrease=pct_decrease,
+            liquidity=liquidity,
+        )
+
     # ltv * (1 + liq_bonus) represents the value at which insolvencies can start to happen.
     # If the maximum drawdown doesnt reach this point, we will not observe any insolvent debt
     # so skip the computation.
     if lltv * (1 + liq_bonus) < (1 - max_drawdown):
+        if trace is not None:
+            trace.finish(0)
         return 0
 
     collateral_tokens = initial_collateral_usd / collateral_price
     debt_tokens = (initial_collateral_usd * lltv) / debt_price
     min_collateral_price = collateral_price * (1 - max_drawdown)
+    if liquidity is not None:
+        collateral_size, debt_size_usd = liquidity.sizes(liq_bonus)
+        # the repay amount is smallest at the bottom of the crash
+        repay_amount_usd = repay_from_sizes(
+            collateral_size, debt_size_usd, liq_bonus, min_collateral_price
+        )
     max_iters = int(np.ceil((initial_collateral_usd / repay_amount_usd) + 1))
     decrement = collateral_price * pct_decrease
+    debug = log.isEnabledFor(logging.DEBUG)
     for i in range(max_iters + 10):
         """
         To be precise, what we really do in the methodology is decrease the
@@ -147,13 +200,24 @@ def simulate_insolvency(
         )
         net_collateral_usd = collateral_tokens * collateral_price
         net_debt_usd = debt_price * debt_tokens
+        if liquidity is not None:
+            repay_amount_usd = repay_from_sizes(
+                collateral_size, debt_size_usd, liq_bonus, collateral_price
+            )
 
-        if i % 100 == 0:
+        if debug and i % 100 == 0:
             log.debug(
-                f"{i:4d} | LTV: {net_debt_usd/net_collateral_usd:.3f}"
-                + f" | debt: {net_debt_usd:.2f} | collat: {net_collateral_usd:.2f} | LLTV: {lltv:.2f}"
+                "%4d | LTV: %.3f | debt: %.2f | collat: %.2f | LLTV: %.2f",
+                i,
+                net_debt_usd / net_collateral_usd,
+                net_debt_usd,
+                net_collateral_usd,
+                lltv,
             )
 
+        repaid_usd = 0.0
+        collateral_claimed_usd = 0.0
+
         if net_debt_usd / net_collateral_usd >= lltv:
             # Figure out the most collateral a liquidator can claim
             # then back out the necessary debt they must repay to claim that
@@ -167,28 +231,266 @@ def simulate_insolvency(
                 debt_price * (1 + liq_bonus)
             )
 
+            repaid_usd = collateral_claimed_usd / (1 + liq_bonus)
             net_collateral_usd -= collateral_claimed_usd
-            net_debt_usd -= collateral_claimed_usd / (1 + liq_bonus)
+            net_debt_usd -= repaid_usd
             assert (
                 abs(net_collateral_usd - collateral_price * collateral_tokens)
                 < TOL
             )
             assert abs(net_debt_usd - debt_tokens * debt_price) < TOL
 
+        if trace is not None:
+            trace.record(
+                i,
+                collateral_price,
+                net_collateral_usd,
+                net_debt_usd,
+                repaid_usd,
+                collateral_claimed_usd,
+                force=net_collateral_usd < TOL or net_debt_usd < TOL,
+            )
+
         # 0 collateral remaining. Stop simulation
         if net_collateral_usd < TOL:
             insolvency = net_debt_usd
-            log.info(
-                f"Initial collateral: {initial_collateral_usd/1e6:.2f}mil | Repay usd: {repay_amount_usd:.2f} | Max drawdown: {max_drawdown:.2f}"
-            )
+            if debug:
+                log.debug(
+                    "Insolvent | Initial collateral: %.2fmil | Repay usd: %.2f"
+                    + " | Max drawdown: %.2f | Insolvency: %.2f",
+                    initial_collateral_usd / 1e6,
+                    repay_amount_usd,
+                    max_drawdown,
+                    insolvency,
+                )
+            if trace is not None:
+                trace.finish(insolvency)
             return insolvency
 
         # 0 debt remaining. Stop simulation
         if net_debt_usd < TOL:
             insolvency = 0
+            if trace is not None:
+                trace.finish(insolvency)
             return insolvency
 
     assert (
         net_debt_usd / net_collateral_usd
     ) < lltv, f"Simulation finished with ltv > lltv: {net_debt_usd/net_collateral_usd:.3f}"
+    if trace is not None:
+        trace.finish(0)
     return 0
+
+
+class AdaptiveRun(NamedTuple):
+    """
+    insolvency: insolvent debt (usd) of the run
+    n_steps: number of steps taken by the adaptive stepper
+    n_fixed_steps: number of steps of the equivalent `simulate_insolvency`
+        run
+    error_usd: estimate of the largest difference with the insolvency of
+        `simulate_insolvency`, due to float rounding
+    """
+
+    insolvency: float
+    n_steps: int
+    n_fixed_steps: int
+    error_usd: float
+
+
+def simulate_insolvency_adaptive(
+    *,
+    initial_collateral_usd: float,
+    collateral_price: float,
+    debt_price: float,
+    lltv: float,
+    repay_amount_usd: float,
+    liq_bonus: float,
+    max_drawdown: float,
+    pct_decrease: float,
+    liquidity: Optional[MarketLiquidity] = None,
+) -> AdaptiveRun:
+    """
+    `simulate_insolvency` with variable size steps. The fixed step sim is
+    the reference: same inputs, same price grid (one `pct_decrease` drop
+    per step, floored at the max drawdown, at most max_iters + 10 steps),
+    so the same insolvency up to float rounding. Each step of the stepper
+    covers as many steps of the grid as its state allows:
+
+    - While the position is healthy only the price moves, so the stepper
+      jumps straight to the first grid step at which the position is
+      liquidatable (debt / (tokens * price) >= lltv), found in closed form
+      and checked against the grid, or at which the price reaches the max
+      drawdown floor.
+    - Runs of consecutive liquidations that each repay the full repay
+      amount are simulated as one batch of cumulative sums. The batch
+      grows while whole batches are accepted and is cut at the first step
+      that is not liquidatable, repays less or exhausts the position.
+    - Those boundary steps are simulated one grid step at a time, like the
+      fixed step sim.
+    - Once the price sits on the floor, the outcome follows from the
+      equity E = C - D * (1 + b), which liquidations leave unchanged (see
+      `classify_lltvs`): a liquidatable position with E < 0 is liquidated
+      until its collateral runs out, leaving -E / (1 + b) of insolvent
+      debt.
+
+    Prices are computed as collateral_price - k * decrement instead of by
+    repeated subtraction and batched liquidations are summed, so the state
+    drifts from the fixed step state by a few float roundings per grid
+    step. `AdaptiveRun.error_usd` bounds the effect of this drift on the
+    insolvency, plus a full step of price move whenever the position
+    reaches the LLTV or the floor at a step too close to call.
+    """
+    if lltv * (1 + liq_bonus) < (1 - max_drawdown):
+        return AdaptiveRun(0, 0, 0, 0.0)
+
+    collateral_tokens = initial_collateral_usd / collateral_price
+    debt_tokens = (initial_collateral_usd * lltv) / debt_price
+    min_collateral_price = collateral_price * (1 - max_drawdown)
+    if liquidity is not None:
+        collateral_size, debt_size_usd = liquidity.sizes(liq_bonus)
+        repay_amount_usd = repay_from_sizes(
+            collateral_size, debt_size_usd, liq_bonus, min_collateral_price
+        )
+    max_steps = int(np.ceil((initial_collateral_usd / repay_amount_usd) + 1))
+    max_steps += 10
+    decrement = collateral_price * pct_decrease
+    # usd moves of the position from steps too close to call
+    step_error_usd = 0.0
+
+    # first grid step on the floor, the price is constant from there on
+    floor_step = 0
+    if decrement > 0:
+        to_floor = (collateral_price - min_collateral_price) / decrement
+        floor_step = int(np.ceil(to_floor))
+        if abs(to_floor - round(to_floor)) <= to_floor * 4 * EPS:
+            step_error_usd += collateral_tokens * decrement
+
+    def prices(k: np.ndarray) -> np.ndarray:
+        return np.maximum(
+            min_collateral_price,
+            collateral_price - np.minimum(k, floor_step) * decrement,
+        )
+
+    def price(k: int) -> float:
+        return max(
+            min_collateral_price,
+            collateral_price - min(k, floor_step) * decrement,
+        )
+
+    def repay(price: ArrayLike) -> ArrayLike:
+        if liquidity is None:
+            return repay_amount_usd
+        return repay_from_sizes(
+            collateral_size, debt_size_usd, liq_bonus, price
+        )
+
+    def ltv(k: int) -> float:
+        return debt_price * debt_tokens / (collateral_tokens * price(k))
+
+    def error_usd(n: int) -> float:
+        return step_error_usd + initial_collateral_usd * n * EPS
+
+    i = 0
+    n_steps = 0
+    last_liquidation = -1
+    run_steps = MIN_RUN_STEPS
+    while i < max_steps:
+        n_steps += 1
+        if i < floor_step:
+            # first liquidatable step before the floor
+            threshold = debt_price * debt_tokens / (collateral_tokens * lltv)
+            k = int(np.ceil((collateral_price - threshold) / decrement))
+            k = min(max(k, i + 1), floor_step)
+            while k > i + 1 and ltv(k - 1) >= lltv:
+                k -= 1
+            while k < floor_step and ltv(k) < lltv:
+                k += 1
+            if ltv(k) < lltv:
+                # healthy down to the floor
+                i = min(floor_step, max_steps)
+                continue
+            if k > max_steps:
+                i = max_steps
+                break
+            if abs(ltv(k) - lltv) <= lltv * (k + 4) * EPS:
+                step_error_usd += collateral_tokens * decrement
+            i = k - 1
+        else:
+            if ltv(i) < lltv:
+                # healthy on the floor, nothing happens anymore
+                break
+            floor_price = price(i)
+            collateral_usd = collateral_tokens * floor_price
+            equity = collateral_usd - (
+                debt_price * debt_tokens * (1 + liq_bonus)
+            )
+            n_left = int(
+                np.ceil(
+                    collateral_usd / (repay(floor_price) * (1 + liq_bonus))
+                )
+            )
+            if equity < 0 and i + n_left <= max_steps:
+                return AdaptiveRun(
+                    -equity / (1 + liq_bonus),
+                    n_steps,
+                    i + n_left,
+                    error_usd(i + n_left),
+                )
+
+        # Step i + 1 is liquidatable. If step i liquidated as well, batch
+        # the run of liquidations repaying the full repay amount up to the
+        # first step that does not
+        if i == last_liquidation:
+            k = np.arange(i + 1, min(i + run_steps, max_steps) + 1)
+            p = prices(k)
+            claimed_usd = np.broadcast_to(repay(p) * (1 + liq_bonus), p.shape)
+            tokens = collateral_tokens - np.cumsum(claimed_usd / p)
+            debts = debt_tokens - np.cumsum(
+                claimed_usd / (debt_price * (1 + liq_bonus))
+            )
+            tokens_before = np.concatenate(([collateral_tokens], tokens[:-1]))
+            debts_before = np.concatenate(([debt_tokens], debts[:-1]))
+            full = (
+                (debt_price * debts_before / (tokens_before * p) >= lltv)
+                & (debt_price * debts_before >= claimed_usd / (1 + liq_bonus))
+                & (tokens * p >= TOL)
+                & (debt_price * debts >= TOL)
+            )
+            n_run = len(k) if full.all() else int(np.argmin(full))
+            # grow the batch while whole batches are accepted
+            if n_run == len(k):
+                run_steps = min(2 * run_steps, MAX_RUN_STEPS)
+            else:
+                run_steps = max(MIN_RUN_STEPS, n_run)
+            if n_run:
+                collateral_tokens = tokens[n_run - 1]
+                debt_tokens = debts[n_run - 1]
+                i += n_run
+                last_liquidation = i
+                continue
+        # one step of `simulate_insolvency`
+        i += 1
+        collateral_price_i = price(i)
+        net_collateral_usd = collateral_tokens * collateral_price_i
+        net_debt_usd = debt_price * debt_tokens
+        if net_debt_usd / net_collateral_usd >= lltv:
+            collateral_claimed_usd = min(
+                min(net_debt_usd, repay(collateral_price_i)) * (1 + liq_bonus),
+                net_collateral_usd,
+            )
+            collateral_tokens -= collateral_claimed_usd / collateral_price_i
+            debt_tokens -= collateral_claimed_usd / (
+                debt_price * (1 + liq_bonus)
+            )
+            net_collateral_usd -= collateral_claimed_usd
+            net_debt_usd -= collateral_claimed_usd / (1 + liq_bonus)
+            last_liquidation = i
+
+        if net_collateral_usd < TOL:
+            return AdaptiveRun(net_debt_usd, n_steps, i, error_usd(i))
+        if net_debt_usd < TOL:
+            return AdaptiveRun(0, n_steps, i, error_usd(i))
+
+    assert ltv(i) < lltv, f"Simulation finished with ltv > lltv: {ltv(i):.3f}"
+    return AdaptiveRun(0, n_steps, i, error_usd(i))
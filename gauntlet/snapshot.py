@@ -0,0 +1,75 @@
+import json
+import os
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from .constants import PRICE_SNAPSHOT_DIR
+from .io_utils import write_atomic
+from .logger import get_logger
+
+log = get_logger(__name__)
+
+# Path of the price snapshot of the current run. Set through the
+# environment so worker processes inherit it.
+SNAPSHOT_ENV = "GAUNTLET_PRICE_SNAPSHOT"
+
+
+@dataclass(frozen=True)
+class PriceSnapshot:
+    """
+    Current usd prices of a set of tokens, taken once at the start of a run
+    (see `coingecko.take_price_snapshot`) so every thread and process of
+    the run prices the markets consistently.
+    """
+
+    taken_at: float
+    # token id -> usd price
+    prices: dict[str, float]
+
+    def price(self, address: str, chain: str) -> Optional[float]:
+        return self.prices.get(f"{chain}:{address.lower()}")
+
+    def default_path(self) -> Path:
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(self.taken_at))
+        return PRICE_SNAPSHOT_DIR / f"prices_{stamp}.json"
+
+    def save(self, path: Optional[Path] = None) -> Path:
+        """
+        Writes the snapshot atomically, to a file named after the time it
+        was taken unless `path` is given.
+        """
+        path = Path(path) if path else self.default_path()
+        write_atomic(path, lambda f: json.dump(asdict(self), f, indent=4))
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "PriceSnapshot":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+
+@lru_cache
+def _load_snapshot(path: str) -> PriceSnapshot:
+    snapshot = PriceSnapshot.load(Path(path))
+    log.debug(
+        f"Using the prices of {len(snapshot.prices)} tokens from {path}"
+        + f" ({time.ctime(snapshot.taken_at)})"
+    )
+    return snapshot
+
+
+def activate_snapshot(path: Path):
+    """
+    Makes the snapshot at `path` the price source of this process and of
+    the worker processes it starts afterwards.
+    """
+    os.environ[SNAPSHOT_ENV] = str(Path(path).resolve())
+
+
+def active_snapshot() -> Optional[PriceSnapshot]:
+    path = os.environ.get(SNAPSHOT_ENV)
+    return _load_snapshot(path) if path else None
@@ -0,0 +1,280 @@
+import tempfile
+from pathlib import Path
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+Chunk = Tuple[np.ndarray, np.ndarray]
+Window = Union[int, str, pd.Timedelta]
+
+# Observations per day of the price intervals
+OBS_PER_DAY = {"daily": 1, "hourly": 24}
+# Ratios fed to the streaming drawdowns at a time
+RATIO_CHUNK_SIZE = 1 << 16
+
+
+def horizon_steps(horizon: Window, interval: str = "daily") -> int:
+    """
+    Observations between the first and last price of a drawdown window of
+    `horizon` (in days, or a time offset such as "4h") on a gap free series
+    of the interval. Windows span `steps + 1` observations, like the
+    windows of `data_utils.horizon_window` on gap free series.
+    """
+    if isinstance(horizon, int):
+        return horizon * OBS_PER_DAY[interval]
+    return int(
+        pd.Timedelta(horizon) / pd.Timedelta(days=1) * OBS_PER_DAY[interval]
+    )
+
+
+def iter_price_chunks(
+    path: Path,
+    chunksize: int = 10_000,
+    start_date: Optional[str] = None,
+) -> Iterator[Chunk]:
+    """
+    Reads a price csv written by `get_prices` in chunks.
+
+    path: Path, csv file with a `date` and a `prices` column, sorted by date
+    chunksize: int, number of rows to read at a time
+    start_date: str, rows before this date are skipped
+
+    Yields: (dates, prices) numpy arrays of at most `chunksize` rows
+    """
+    reader = pd.read_csv(path, usecols=["date", "prices"], chunksize=chunksize)
+    for df in reader:
+        dates = df["date"].to_numpy(dtype=str)
+        prices = df["prices"].to_numpy(dtype=np.float64)
+        if start_date is not None:
+            keep = dates >= start_date
+            dates, prices = dates[keep], prices[keep]
+        if len(dates):
+            yield dates, prices
+
+
+def iter_ratio_chunks(
+    numerator: Iterable[Chunk], denominator: Iterable[Chunk]
+) -> Iterator[np.ndarray]:
+    """
+    Streams the price ratio of two date sorted chunk streams. Dates present
+    in only one of the streams are dropped, as are non finite ratios. Only
+    the unmatched tail of the most recent chunk is buffered.
+    """
+    num_it, den_it = iter(numerator), iter(denominator)
+    empty_dates, empty_prices = np.array([], dtype=str), np.array([])
+    nd, npx = empty_dates, empty_prices
+    dd, dpx = empty_dates, empty_prices
+
+    while True:
+        if not len(nd):
+            chunk = next(num_it, None)
+            if chunk is None:
+                return
+            nd, npx = chunk
+        if not len(dd):
+            chunk = next(den_it, None)
+            if chunk is None:
+                return
+            dd, dpx = chunk
+
+        cutoff = min(nd[-1], dd[-1])
+        n_cut = np.searchsorted(nd, cutoff, side="right")
+        d_cut = np.searchsorted(dd, cutoff, side="right")
+        _, n_idx, d_idx = np.intersect1d(
+            nd[:n_cut], dd[:d_cut], assume_unique=True, return_indices=True
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = npx[n_idx] / dpx[d_idx]
+        ratio = ratio[np.isfinite(ratio)]
+        if len(ratio):
+            yield ratio
+
+        nd, npx = nd[n_cut:], npx[n_cut:]
+        dd, dpx = dd[d_cut:], dpx[d_cut:]
+
+
+def _window_max(x: np.ndarray, w: int) -> np.ndarray:
+    """
+    Max over every length `w` window of `x` (len(x) - w + 1 outputs) in
+    O(n log w) by repeatedly doubling the window.
+    """
+    m = x
+    p = 1
+    while 2 * p <= w:
+        m = np.maximum(m[:-p], m[p:])
+        p *= 2
+    if p == w:
+        return m
+    return np.maximum(m[: len(x) - w + 1], m[w - p :])
+
+
+class SpilledPercentiles:
+    """
+    Exact percentiles over a stream of samples that does not fit in memory.
+    Samples are buffered up to `run_size`, then sorted and written to disk
+    as one run. Percentiles are selected across the memory mapped runs with
+    a value bisection, so queries never load the samples back into memory.
+    """
+
+    def __init__(self, spill_dir: Path, name: str, run_size: int = 1 << 20):
+        self.spill_dir = Path(spill_dir)
+        self.name = name
+        self.run_size = run_size
+        self.count = 0
+        self._buffer: list[np.ndarray] = []
+        self._buffered = 0
+        self._runs: list[Path] = []
+
+    def extend(self, samples: np.ndarray):
+        if not len(samples):
+            return
+        self._buffer.append(samples)
+        self._buffered += len(samples)
+        self.count += len(samples)
+        if self._buffered >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        run = np.sort(np.concatenate(self._buffer))
+        path = self.spill_dir / f"{self.name}-{len(self._runs)}.npy"
+        np.save(path, run)
+        self._runs.append(path)
+        self._buffer = []
+        self._buffered = 0
+
+    def _kth(self, runs: list[np.ndarray], k: int) -> float:
+        lo = np.nextafter(min(r[0] for r in runs), -np.inf)
+        hi = max(r[-1] for r in runs)
+        # Invariant: fewer than k + 1 samples are <= lo, at least k + 1
+        # samples are <= hi. The answer is the smallest sample above lo.
+        while True:
+            mid = lo + (hi - lo) / 2
+            if mid <= lo or mid >= hi:
+                break
+            below = sum(int(np.searchsorted(r, mid, "right")) for r in runs)
+            if below > k:
+                hi = mid
+            else:
+                lo = mid
+
+        candidates = []
+        for r in runs:
+            i = np.searchsorted(r, lo, "right")
+            if i < len(r):
+                candidates.append(r[i])
+        return float(min(candidates))
+
+    def percentile(self, q: float) -> float:
+        """
+        Same value as `np.percentile(samples, q)` (linear interpolation).
+        """
+        if self.count == 0:
+            raise ValueError(f"No samples recorded for {self.name}")
+        if self._buffer:
+            self._spill()
+
+        runs = [np.load(p, mmap_mode="r") for p in self._runs]
+        pos = q / 100 * (self.count - 1)
+        k = int(np.floor(pos))
+        frac = pos - k
+        lower = self._kth(runs, k)
+        if frac == 0:
+            return lower
+        upper = self._kth(runs, k + 1)
+        return lower + (upper - lower) * frac
+
+
+class StreamingDrawdown:
+    """
+    Incremental version of the rolling `calc_drawdown` over a price ratio.
+    For each horizon of `n` steps (see `horizon_steps`) it only keeps the
+    trailing `n` ratios between chunks, and every window of `n + 1` ratios
+    produces one drawdown sample (largest value vs the final value).
+    Horizons are counted in observations, so on series with gaps they span
+    fewer hours than the time based windows of `rolling_drawdowns`.
+    """
+
+    def __init__(
+        self,
+        days: list[Window],
+        spill_dir: Path,
+        run_size: int = 1 << 20,
+        interval: str = "daily",
+    ):
+        self.days = days
+        self._steps = {d: horizon_steps(d, interval) for d in days}
+        self._tails = {d: np.array([]) for d in days}
+        self._samples = {
+            d: SpilledPercentiles(spill_dir, f"dd{k}", run_size)
+            for k, d in enumerate(days)
+        }
+
+    def update(self, ratio: np.ndarray):
+        for d in self.days:
+            n = self._steps[d]
+            x = np.concatenate([self._tails[d], ratio])
+            if len(x) > n:
+                window_max = _window_max(x, n + 1)
+                self._samples[d].extend((window_max - x[n:]) / window_max)
+            self._tails[d] = x[-n:] if n else x[:0]
+
+    def percentiles(
+        self, percentile_drawdowns: list[float]
+    ) -> dict[Window, dict[float, float]]:
+        return {
+            d: {
+                p: self._samples[d].percentile(p) for p in percentile_drawdowns
+            }
+            for d in self.days
+        }
+
+
+def stream_drawdowns(
+    ratios: Iterable[np.ndarray],
+    percentile_drawdowns: list[float] = [90, 95, 99],
+    days: list[Window] = [1, 7, 14, 30],
+    interval: str = "daily",
+) -> dict[Window, dict[float, float]]:
+    """
+    Percentile drawdowns of every horizon over a price ratio consumed in
+    chunks, with the drawdown samples spilled to a temporary directory.
+
+    Returns: dict of time horizon -> {percentile -> drawdown}
+    """
+    with tempfile.TemporaryDirectory(prefix="drawdowns-") as spill_dir:
+        engine = StreamingDrawdown(days, Path(spill_dir), interval=interval)
+        for ratio in ratios:
+            engine.update(ratio)
+        return engine.percentiles(percentile_drawdowns)
+
+
+def compute_pair_drawdown_streaming(
+    numerator_path: Path,
+    denominator_path: Path,
+    percentile_drawdowns: list[float] = [90, 95, 99],
+    days: list[Window] = [1, 7, 14, 30],
+    start_date="2022-07-01",
+    chunksize: int = 10_000,
+    interval: str = "daily",
+) -> dict[Window, dict[float, float]]:
+    """
+    Bounded memory equivalent of `compute_pair_drawdown` over two price
+    csvs of the price store (see `data_utils.price_cache_path`), without
+    loading them. The csvs are consumed in chunks of `chunksize` rows,
+    only the trailing window of each horizon is carried between chunks and
+    the drawdown samples are spilled to sorted runs on disk, so memory does
+    not grow with the length of the history.
+    Prices are aligned on the dates both csvs have, without forward fill.
+
+    Returns: dict of time horizon -> {percentile -> drawdown}
+    """
+    ratios = iter_ratio_chunks(
+        iter_price_chunks(numerator_path, chunksize, start_date),
+        iter_price_chunks(denominator_path, chunksize, start_date),
+    )
+    return stream_drawdowns(ratios, percentile_drawdowns, days, interval)
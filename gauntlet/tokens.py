@@ -7,6 +7,15 @@ class Token(NamedTuple):
     decimals: int
     coingecko_id: str
     total_supply: float = None
+    chain: str = "ethereum"
+
+
+def token_id(token: Token) -> str:
+    """
+    Chain qualified key of a token ("{chain}:{lowercase address}"), used to
+    key the token registry, price store and drawdown / swap size caches.
+    """
+    return f"{token.chain}:{token.address.lower()}"
 
 
 class Tokens(Token, Enum):
@@ -0,0 +1,130 @@
+from typing import Any
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class TraceStep(NamedTuple):
+    step: int
+    collateral_price: float
+    collateral_usd: float
+    debt_usd: float
+    ltv: float
+    repaid_usd: float
+    claimed_usd: float
+
+
+class SimTrace:
+    """
+    Records the per step state of a `simulate_insolvency` run into a
+    preallocated ring buffer. Only the most recent `capacity` steps are
+    kept, so tracing a long run never grows memory.
+
+    The inputs of the traced run are kept in `params`, so a trace can be
+    replayed step by step (`replay`), re-simulated (`simulate_insolvency(
+    **trace.params)`) or plotted (`plot`).
+
+    capacity: int, number of steps to keep
+    every: int, only record every `every` steps (the final step of the run
+        is always recorded)
+    """
+
+    FIELDS = TraceStep._fields
+
+    def __init__(self, capacity: int = 4096, every: int = 1):
+        if capacity <= 0 or every <= 0:
+            raise ValueError("capacity and every must be positive")
+        self.capacity = capacity
+        self.every = every
+        self.params: dict[str, Any] = {}
+        self.insolvency: Optional[float] = None
+        self._buf = np.empty((capacity, len(self.FIELDS)), dtype=np.float64)
+        self._n = 0
+        self._last_step = -1
+
+    def __len__(self) -> int:
+        return min(self._n, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of recorded steps that were overwritten in the ring buffer.
+        """
+        return max(0, self._n - self.capacity)
+
+    def reset(self, **params):
+        self.params = params
+        self.insolvency = None
+        self._n = 0
+        self._last_step = -1
+
+    def record(
+        self,
+        step: int,
+        collateral_price: float,
+        collateral_usd: float,
+        debt_usd: float,
+        repaid_usd: float,
+        claimed_usd: float,
+        force: bool = False,
+    ):
+        if not force and step % self.every:
+            return
+        if step == self._last_step:
+            return
+        ltv = debt_usd / collateral_usd if collateral_usd > 0 else np.inf
+        row = self._buf[self._n % self.capacity]
+        row[:] = (
+            step,
+            collateral_price,
+            collateral_usd,
+            debt_usd,
+            ltv,
+            repaid_usd,
+            claimed_usd,
+        )
+        self._n += 1
+        self._last_step = step
+
+    def finish(self, insolvency: float):
+        self.insolvency = insolvency
+
+    def to_array(self) -> np.ndarray:
+        """
+        Returns: (n_steps, n_fields) array of the recorded steps in
+            chronological order. Columns follow `SimTrace.FIELDS`.
+        """
+        if self._n <= self.capacity:
+            return self._buf[: self._n].copy()
+        start = self._n % self.capacity
+        return np.concatenate([self._buf[start:], self._buf[:start]])
+
+    def replay(self) -> Iterator[TraceStep]:
+        for row in self.to_array():
+            yield TraceStep(int(row[0]), *(float(x) for x in row[1:]))
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.to_array(), columns=self.FIELDS)
+        df["step"] = df["step"].astype(int)
+        return df.set_index("step")
+
+    def plot(self, ax=None):
+        """
+        Plots the LTV path of the traced run against its LLTV.
+        """
+        import matplotlib.pyplot as plt
+
+        if ax is None:
+            _, ax = plt.subplots()
+
+        arr = self.to_array()
+        ax.plot(arr[:, 0], arr[:, 4], label="LTV")
+        if "lltv" in self.params:
+            ax.axhline(self.params["lltv"], color="r", ls="--", label="LLTV")
+        ax.set_xlabel("step")
+        ax.set_ylabel("LTV")
+        ax.legend()
+        return ax
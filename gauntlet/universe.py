@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from .constants import UNIVERSE_TOML_PATH
+from .tokens import Token
+from .tokens import token_id
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # python < 3.11
+    import tomli as tomllib
+
+UNIVERSE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class Guardrails:
+    min_whale_position_usd: float
+    drawdown: float
+
+
+@dataclass
+class Universe:
+    """
+    Risk tiers of the token universe and the guardrails of the sim, loaded
+    from a versioned TOML file (see data/universe.toml).
+
+    Tiers are stored as arrays: the sorted token ids and their tier codes,
+    so the tiers of many tokens are looked up with one `searchsorted`, and
+    the guardrails of every pair of a universe are computed with array
+    operations instead of set lookups per pair.
+    """
+
+    version: int
+    # sorted token ids and the index in `tier_names` of their tier
+    token_ids: np.ndarray
+    tier_codes: np.ndarray
+    tier_names: list[str]
+    # (n_tiers,) whether each tier is a blue chip tier
+    blue_chip_tiers: np.ndarray
+    default_tier: int
+    blue_chip: Guardrails
+    default: Guardrails
+    low_drawdown: float
+    min_drawdown: float
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "Universe":
+        version = config.get("version")
+        if version != UNIVERSE_VERSION:
+            raise ValueError(
+                f"Unsupported universe config version {version}, "
+                + f"expected {UNIVERSE_VERSION}"
+            )
+        tier_names = list(config["tiers"])
+        tier_index = {name: k for k, name in enumerate(tier_names)}
+        tokens = {t["id"].lower(): t["tier"] for t in config["tokens"]}
+        for tid, tier in tokens.items():
+            if tier not in tier_index:
+                raise ValueError(f"Unknown tier {tier!r} of {tid}")
+
+        ids = np.array(sorted(tokens), dtype=str)
+        guardrails = config["guardrails"]
+        return cls(
+            version=version,
+            token_ids=ids,
+            tier_codes=np.array(
+                [tier_index[tokens[tid]] for tid in ids], dtype=np.int8
+            ),
+            tier_names=tier_names,
+            blue_chip_tiers=np.array(
+                [config["tiers"][n]["blue_chip"] for n in tier_names]
+            ),
+            default_tier=tier_index[config["default_tier"]],
+            blue_chip=Guardrails(**guardrails["blue_chip"]),
+            default=Guardrails(**guardrails["default"]),
+            low_drawdown=guardrails["low_drawdown"],
+            min_drawdown=guardrails["min_drawdown"],
+        )
+
+    @classmethod
+    def load(cls, path: Path = UNIVERSE_TOML_PATH) -> "Universe":
+        with open(path, "rb") as f:
+            return cls.from_dict(tomllib.load(f))
+
+    def tiers(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Tier codes of the token ids, `default_tier` for unlisted tokens.
+        """
+        ids = np.asarray(list(ids), dtype=str)
+        if not len(self.token_ids):
+            return np.full(len(ids), self.default_tier, dtype=np.int8)
+        pos = np.searchsorted(self.token_ids, ids).clip(
+            0, len(self.token_ids) - 1
+        )
+        found = self.token_ids[pos] == ids
+        return np.where(found, self.tier_codes[pos], self.default_tier)
+
+    def tier(self, token: Token) -> str:
+        return self.tier_names[self.tiers([token_id(token)])[0]]
+
+    def is_blue_chip(self, ids: Iterable[str]) -> np.ndarray:
+        return self.blue_chip_tiers[self.tiers(ids)]
+
+    def blue_chip_market(self, t1: Token, t2: Token) -> bool:
+        return bool(self.is_blue_chip([token_id(t1), token_id(t2)]).all())
+
+    def tokens(self, tier: str) -> list[str]:
+        """
+        Token ids listed in a tier.
+        """
+        code = self.tier_names.index(tier)
+        return self.token_ids[self.tier_codes == code].tolist()
+
+    def init_collateral_usd(
+        self, impact_size_usd: np.ndarray, blue_chip: np.ndarray
+    ) -> np.ndarray:
+        """
+        Usd size of a 25% price impact swap of the collateral clamped to
+        the minimum whale position of the market's tier, for arrays of
+        markets. Missing (NaN) sizes fall back to the minimum position.
+        """
+        floor = np.where(
+            blue_chip,
+            self.blue_chip.min_whale_position_usd,
+            self.default.min_whale_position_usd,
+        )
+        return np.fmax(floor, impact_size_usd)
+
+    def max_drawdown(
+        self, hist_dd: np.ndarray, blue_chip: np.ndarray
+    ) -> np.ndarray:
+        """
+        Max drawdown of the sim given the 30 day 99th percentile historical
+        drawdown of the markets' price ratios: low drawdowns (LSTs,
+        stablecoin depegs) are kept, floored at `min_drawdown`, others are
+        floored at the drawdown of the market's tier. Missing (NaN)
+        drawdowns fall back to the tier drawdown.
+        """
+        hist_dd = np.asarray(hist_dd, dtype=np.float64)
+        floor = np.where(
+            blue_chip, self.blue_chip.drawdown, self.default.drawdown
+        )
+        return np.where(
+            hist_dd < self.low_drawdown,
+            np.maximum(hist_dd, self.min_drawdown),
+            np.fmax(floor, hist_dd),
+        )
+
+
+@lru_cache
+def default_universe() -> Universe:
+    return Universe.load(UNIVERSE_TOML_PATH)
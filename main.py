@@ -1,19 +1,30 @@
 from __future__ import annotations
 
 import argparse
+import sys
+import time
+from dataclasses import fields
+from dataclasses import replace
 
-import numpy as np
-
+from gauntlet.chains import CHAINS
+from gauntlet.chains import DEFAULT_CHAIN
 from gauntlet.coingecko import CoinGecko
-from gauntlet.coingecko import current_price
 from gauntlet.coingecko import token_from_symbol_or_address
 from gauntlet.data_utils import get_drawdowns
+from gauntlet.data_utils import get_pct_decreases
 from gauntlet.data_utils import get_price_impacts
+from gauntlet.impact_table import market_liquidity
+from gauntlet.lltv_table import optimal_lltv
 from gauntlet.logger import get_logger
-from gauntlet.sim import compute_liquidation_incentive
-from gauntlet.sim import get_init_collateral_usd
-from gauntlet.sim import heuristic_drawdown
-from gauntlet.sim import simulate_insolvency
+from gauntlet.output import market_record
+from gauntlet.output import NdjsonWriter
+from gauntlet.runner import find_optimal_lltv
+from gauntlet.runner import insolvency_curve
+from gauntlet.runner import Market
+from gauntlet.runner import market_params
+from gauntlet.runner import MarketParams
+from gauntlet.sensitivity import lltv_sensitivities
+from gauntlet.tokens import token_id
 
 
 log = get_logger(__name__)
@@ -28,12 +39,19 @@ def main(args: argparse.Namespace):
     The resulting dict of LTV results (pair of tokens -> LTV value) will
     be saved in the save path specified by the input args.
     """
+    start = time.perf_counter()
+    pct_decrease = args.pct_decrease
+    params = None
+    liquidity = None
     if args.collateral and args.borrow:
-        collateral_token = token_from_symbol_or_address(args.collateral)
-        debt_token = token_from_symbol_or_address(args.borrow)
+        collateral_token = token_from_symbol_or_address(
+            args.collateral, chain=args.chain
+        )
+        debt_token = token_from_symbol_or_address(
+            args.borrow, chain=args.chain
+        )
 
         tokens = [collateral_token, debt_token]
-        prices = {t: current_price(t.address) for t in tokens}
         price_impacts = get_price_impacts(
             tokens,
             impacts=[0.005, 0.25],
@@ -41,58 +59,95 @@ def main(args: argparse.Namespace):
             use_cache=args.use_cache,
         )
         drawdowns = get_drawdowns(
-            tokens, update_cache=args.update_cache, use_cache=args.use_cache
-        )
-        repay_amount_usd = min(
-            price_impacts[collateral_token.symbol]["0.005"]
-            * prices[collateral_token],
-            price_impacts[debt_token.symbol]["0.005"] * prices[debt_token],
-        )
-        max_drawdown = heuristic_drawdown(
-            collateral_token, debt_token, drawdowns
+            tokens,
+            update_cache=args.update_cache,
+            use_cache=args.use_cache,
+            interval=args.interval,
         )
-        init_collateral_usd = get_init_collateral_usd(
-            collateral_token, debt_token, price_impacts
+        pair = (token_id(collateral_token), token_id(debt_token))
+        if args.pct_decrease_window:
+            pct_decrease = get_pct_decreases(
+                tokens, window=args.pct_decrease_window
+            )[pair]
+        params = market_params(
+            collateral_token, debt_token, price_impacts, drawdowns
         )
         log.debug(
-            f"{collateral_token} / {debt_token} | repay amount: ${repay_amount_usd:.2f}"
-            + f" | drawdown: {max_drawdown:.3f} | init collat usd: {init_collateral_usd}"
-            + f" | collateral price = ${prices[collateral_token]:.2f}, debt price = ${prices[debt_token]:.2f}"
-            + f" | emp drawdown: {drawdowns[(collateral_token.symbol, debt_token.symbol)]}"
+            f"{collateral_token} / {debt_token} | repay amount: ${params.repay_amount_usd:.2f}"
+            + f" | drawdown: {params.max_drawdown:.3f} | init collat usd: {params.initial_collateral_usd}"
+            + f" | collateral price = ${params.collateral_price:.2f}, debt price = ${params.debt_price:.2f}"
+            + f" | emp drawdown: {drawdowns[pair]}"
+            + f" | pct decrease: {pct_decrease:.4f}"
         )
+        if args.dynamic_repay:
+            liquidity = market_liquidity(
+                collateral_token,
+                debt_token,
+                price_impacts,
+                debt_price=args.debt_price or params.debt_price,
+            )
     else:
         debt_token = None
         collateral_token = None
         log.info("Running sim with fully parameterized values")
 
-    lltvs = np.arange(0.01, 1.0, 0.01)
-    opt_lltv = None
-    opt_li = None
-    for ltv in lltvs:
-        liq_bonus = max(
-            compute_liquidation_incentive(args.m, args.beta, ltv),
-            args.min_liq_bonus,
-        )
-        insolvency = simulate_insolvency(
-            initial_collateral_usd=args.initial_collateral_usd
-            or init_collateral_usd,
-            collateral_price=args.collateral_price
-            or prices.get(collateral_token),
-            debt_price=args.debt_price or prices.get(debt_token),
-            lltv=ltv,
-            repay_amount_usd=args.repay_amount_usd or repay_amount_usd,
-            liq_bonus=liq_bonus,
-            max_drawdown=args.max_drawdown or max_drawdown,
-            pct_decrease=args.pct_decrease,
+    # Explicitly provided sim inputs override the market derived ones
+    overrides = {
+        f.name: getattr(args, f.name)
+        for f in fields(MarketParams)
+        if getattr(args, f.name)
+    }
+    params = (
+        replace(params, **overrides) if params else MarketParams(**overrides)
+    )
+    sim_kwargs = dict(
+        pct_decrease=pct_decrease,
+        m=args.m,
+        beta=args.beta,
+        min_liq_bonus=args.min_liq_bonus,
+        liquidity=liquidity,
+        adaptive=args.adaptive,
+    )
+    inputs_sec = time.perf_counter() - start
+    if args.no_table:
+        opt_lltv, opt_li = find_optimal_lltv(params, **sim_kwargs)
+    else:
+        # Answered from the precomputed LLTV table when it covers the inputs
+        opt_lltv, opt_li = optimal_lltv(
+            params, max_error=args.table_max_error, **sim_kwargs
         )
+    search_sec = time.perf_counter() - start - inputs_sec
 
-        # Note: for the purpose of this tool, we are just interested in the largest
-        # LLTV that results in 0 insolvent debt.
-        if insolvency > 0:
-            break
-
-        opt_lltv = ltv
-        opt_li = liq_bonus
+    if args.output == "ndjson":
+        curve = None
+        if liquidity is None:
+            curve_kwargs = {
+                k: v for k, v in sim_kwargs.items() if v is not None
+            }
+            curve_sec = time.perf_counter()
+            curve = insolvency_curve(params, **curve_kwargs)
+            curve_sec = time.perf_counter() - curve_sec
+        market = None
+        if collateral_token is not None:
+            market = Market(
+                collateral=args.collateral,
+                borrow=args.borrow,
+                chain=args.chain,
+            )
+        NdjsonWriter(sys.stdout).write(
+            market_record(
+                market,
+                params,
+                (opt_lltv, opt_li),
+                curve,
+                {
+                    "inputs_sec": inputs_sec,
+                    "search_sec": search_sec,
+                    "curve_sec": curve_sec if curve is not None else None,
+                },
+                **sim_kwargs,
+            )
+        )
 
     if opt_lltv is None:
         raise ValueError(
@@ -106,6 +161,24 @@ def main(args: argparse.Namespace):
         f"Collateral: {_cs} | Debt: {_ds} | LI: {opt_li:.3f} | LLTV: {opt_lltv:.3f}"
     )
 
+    if args.sensitivities:
+        report = lltv_sensitivities(
+            {(_cs, _ds): params},
+            pct_decrease=pct_decrease,
+            m=args.m,
+            beta=args.beta,
+            min_liq_bonus=args.min_liq_bonus,
+        )
+        row = report.iloc[0]
+        log.info(
+            f"Insolvency boundary: LLTV {row['critical_lltv']:.4f} | "
+            + " | ".join(
+                f"dLLTV/d{c[2:]}: {row[c]:.4g}"
+                for c in report.columns
+                if c.startswith("d_")
+            )
+        )
+
 
 if __name__ == "__main__":
     log.info("Starting")
@@ -122,12 +195,38 @@ if __name__ == "__main__":
         type=str,
         help="symbol or address of the collateral asset",
     )
+    parser.add_argument(
+        "--chain",
+        type=str,
+        choices=list(CHAINS),
+        default=DEFAULT_CHAIN,
+        help="Chain the collateral and borrowable assets live on",
+    )
     parser.add_argument(
         "--pct_decrease",
         type=float,
         default=0.005,
         help="Per iter percent drop of the collateral price to debt price",
     )
+    parser.add_argument(
+        "--pct_decrease_window",
+        type=str,
+        default=None,
+        help="[Optional] Derive pct_decrease from hourly prices as the mean price ratio drawdown over this window (ex: 1h, 4h). Overrides --pct_decrease",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        default=False,
+        help="Simulate with variable size steps: jump over the steps at which the position stays healthy, batch runs of liquidations and solve the max drawdown floor in closed form. Same results as the fixed steps up to float rounding, much faster for small pct_decrease",
+    )
+    parser.add_argument(
+        "--interval",
+        type=str,
+        choices=["daily", "hourly"],
+        default="daily",
+        help="Granularity of the price history used for the historical drawdowns",
+    )
     parser.add_argument(
         "--initial_collateral_usd",
         type=int,
@@ -158,6 +257,37 @@ if __name__ == "__main__":
         default=None,
         help="[Optional] The maximum proportion the collateral price to debt price can drop during the simulation",
     )
+    parser.add_argument(
+        "--dynamic_repay",
+        action="store_true",
+        default=False,
+        help="Derive the amount repaid at each step from the cached price impact curves of the market's tokens: liquidators repay up to the size whose slippage eats the liquidation bonus, at the current collateral price. Requires 'collateral' and 'borrow'",
+    )
+    parser.add_argument(
+        "--no_table",
+        action="store_true",
+        default=False,
+        help="Always run the LLTV search instead of answering from the precomputed LLTV table (data/lltv_table.npz)",
+    )
+    parser.add_argument(
+        "--table_max_error",
+        type=float,
+        default=0.0,
+        help="Largest LLTV uncertainty of a table answer. Inputs whose table cell spans a wider LLTV range are simulated",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        choices=["log", "ndjson"],
+        default="log",
+        help="'ndjson' also writes the result as one json record to stdout: the sim inputs and settings, the optimal LLTV and liquidation incentive, the insolvency at every LLTV and timings. Logs go to stderr",
+    )
+    parser.add_argument(
+        "--sensitivities",
+        action="store_true",
+        default=False,
+        help="Also report the continuous LLTV at which the market turns insolvent and its derivatives with respect to max_drawdown, repay_amount_usd and pct_decrease (central differences, all scenarios simulated in one batch)",
+    )
     parser.add_argument(
         "--m",
         type=float,
@@ -203,4 +333,8 @@ if __name__ == "__main__":
             + "'initial_collateral_usd', 'repay_amount_usd'"
             + "'debt_price', 'collateral_price', 'max_drawdown'."
         )
+    if args.dynamic_repay and (args.collateral is None or args.borrow is None):
+        parser.error("--dynamic_repay requires 'collateral' and 'borrow'.")
+    if args.dynamic_repay and args.sensitivities:
+        parser.error("--sensitivities does not support --dynamic_repay.")
     main(args)
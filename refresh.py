@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import argparse
+import json
+
+from gauntlet.logger import get_logger
+from gauntlet.refresh import cached_tokens
+from gauntlet.refresh import refresh_caches
+from gauntlet.runner import Market
+from gauntlet.runner import resolve_markets
+
+
+log = get_logger(__name__)
+
+
+def main(args: argparse.Namespace):
+    """
+    Refreshes the price store, the pairwise drawdown caches and the swap
+    size cache for every token of the caches (and of the optional markets
+    file), then reports the throughput of the refresh.
+    """
+    tokens = cached_tokens()
+    if args.markets:
+        with open(args.markets, "r") as f:
+            markets = [Market(**m) for m in json.load(f)]
+        tokens += [
+            t for pair in resolve_markets(markets).values() for t in pair
+        ]
+
+    log.info(f"Refreshing the caches of {len(set(tokens))} tokens")
+    report = refresh_caches(
+        tokens,
+        intervals=args.intervals,
+        impacts=args.impacts,
+        max_workers=args.max_workers,
+        processes=args.processes,
+    )
+    report.log()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--markets",
+        type=str,
+        default=None,
+        help='[Optional] json file with a list of markets whose tokens are refreshed as well, ex: [{"chain": "base", "collateral": "0x...", "borrow": "0x..."}]',
+    )
+    parser.add_argument(
+        "--intervals",
+        type=str,
+        nargs="+",
+        choices=["daily", "hourly"],
+        default=["daily"],
+        help="Price history granularities to refresh the drawdowns of",
+    )
+    parser.add_argument(
+        "--impacts",
+        type=float,
+        nargs="+",
+        default=[0.005, 0.25],
+        help="Price impacts to refresh the swap sizes of",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="Number of concurrent fetches. Requests stay under each API's rate limit regardless",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="Number of worker processes the pair drawdowns are computed over, in blocks of pairs. 0 computes them in the main process",
+    )
+    main(parser.parse_args())
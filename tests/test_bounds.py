@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from gauntlet.bounds import classify_lltvs
+from gauntlet.bounds import last_solvent_index
+from gauntlet.bounds import Verdict
+from gauntlet.runner import liquidation_bonuses
+from gauntlet.runner import LLTVS
+from gauntlet.sim import simulate_insolvency
+
+N_SCENARIOS = 200
+
+
+def random_scenario(rng: np.random.Generator) -> dict:
+    """
+    Sim inputs of a random market, with a random subset of the LLTV grid
+    and random liquidation incentive parameters.
+    """
+    initial_collateral_usd = float(10 ** rng.uniform(4, 9))
+    lltvs = np.sort(rng.choice(LLTVS, size=rng.integers(5, 30), replace=False))
+    return dict(
+        initial_collateral_usd=initial_collateral_usd,
+        collateral_price=float(10 ** rng.uniform(-2, 4)),
+        repay_amount_usd=initial_collateral_usd
+        * float(10 ** rng.uniform(-3, 0)),
+        max_drawdown=float(rng.uniform(0.01, 0.95)),
+        pct_decrease=float(10 ** rng.uniform(-3, -1)),
+        lltvs=lltvs,
+        liq_bonuses=liquidation_bonuses(
+            lltvs,
+            m=float(rng.uniform(0.05, 0.2)),
+            beta=float(rng.uniform(0.1, 0.5)),
+            min_liq_bonus=0.005,
+        ),
+    )
+
+
+@pytest.mark.parametrize("seed", range(N_SCENARIOS))
+def test_verdicts_agree_with_sim(seed):
+    scenario = random_scenario(np.random.default_rng(seed))
+    verdicts = classify_lltvs(**scenario)
+    for lltv, bonus, verdict in zip(
+        scenario["lltvs"], scenario["liq_bonuses"], verdicts
+    ):
+        if verdict == Verdict.UNKNOWN:
+            continue
+        insolvency = simulate_insolvency(
+            initial_collateral_usd=scenario["initial_collateral_usd"],
+            collateral_price=scenario["collateral_price"],
+            debt_price=1.0,
+            lltv=lltv,
+            repay_amount_usd=scenario["repay_amount_usd"],
+            liq_bonus=bonus,
+            max_drawdown=scenario["max_drawdown"],
+            pct_decrease=scenario["pct_decrease"],
+        )
+        assert (insolvency > 0) == (verdict == Verdict.INSOLVENT), (
+            lltv,
+            Verdict(verdict),
+            insolvency,
+        )
+
+
+@pytest.mark.parametrize("seed", range(N_SCENARIOS))
+def test_bounds_do_not_change_last_solvent_index(seed):
+    scenario = random_scenario(np.random.default_rng(seed))
+    kwargs = dict(scenario, debt_price=1.0)
+    assert last_solvent_index(**kwargs, use_bounds=True) == last_solvent_index(
+        **kwargs, use_bounds=False
+    )
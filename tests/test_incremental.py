@@ -0,0 +1,67 @@
+from dataclasses import replace
+
+from gauntlet import incremental
+from gauntlet.incremental import evaluate_markets_incremental
+from gauntlet.runner import find_optimal_lltv
+from gauntlet.runner import Market
+from gauntlet.runner import MarketParams
+from gauntlet.tokens import Tokens
+
+MARKET = Market(collateral="link", borrow="usdc")
+PARAMS = MarketParams(
+    initial_collateral_usd=5e6,
+    collateral_price=15.0,
+    debt_price=1.0,
+    repay_amount_usd=2e5,
+    max_drawdown=0.3,
+)
+
+
+def run(monkeypatch, params, recommendations):
+    calls = []
+
+    def search(p, **kwargs):
+        calls.append(p)
+        return find_optimal_lltv(p, **kwargs)
+
+    monkeypatch.setattr(
+        incremental,
+        "resolve_markets",
+        lambda markets: {MARKET: (Tokens.LINK, Tokens.USDC)},
+    )
+    monkeypatch.setattr(
+        incremental, "market_inputs", lambda *args: {MARKET: params}
+    )
+    monkeypatch.setattr(incremental, "find_optimal_lltv", search)
+    results = evaluate_markets_incremental([MARKET], recommendations)
+    return results[MARKET], calls
+
+
+def test_price_move_keeps_recommendation(monkeypatch):
+    recommendations = {}
+    result, calls = run(monkeypatch, PARAMS, recommendations)
+    assert len(calls) == 1
+
+    # collateral doubles in price: the position and the repay amount
+    # (bound by the collateral liquidity) double in USD
+    moved = replace(
+        PARAMS,
+        collateral_price=2 * PARAMS.collateral_price,
+        initial_collateral_usd=2 * PARAMS.initial_collateral_usd,
+        repay_amount_usd=2 * PARAMS.repay_amount_usd,
+    )
+    reused, calls = run(monkeypatch, moved, recommendations)
+    assert not calls
+    assert reused == result
+    assert find_optimal_lltv(moved) == result
+
+
+def test_input_move_reruns(monkeypatch):
+    recommendations = {}
+    run(monkeypatch, PARAMS, recommendations)
+    for moved in (
+        replace(PARAMS, max_drawdown=0.4),
+        replace(PARAMS, repay_amount_usd=3e5),
+    ):
+        _, calls = run(monkeypatch, moved, recommendations)
+        assert calls == [moved]
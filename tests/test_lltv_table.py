@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from gauntlet.lltv_table import build_lltv_table
+from gauntlet.lltv_table import optimal_lltv
+from gauntlet.runner import find_optimal_lltv
+from gauntlet.runner import MarketParams
+
+N_MARKETS = 50
+MAX_ERROR = 0.05
+
+
+@pytest.fixture(scope="module")
+def table():
+    return build_lltv_table(
+        repay_ratios=np.geomspace(1e-3, 1, 13),
+        max_drawdowns=np.round(np.arange(0.05, 0.851, 0.05), 2),
+        processes=2,
+    )
+
+
+def random_market(rng: np.random.Generator) -> MarketParams:
+    """
+    Market inside the domain of the `table` fixture, at a random scale.
+    """
+    initial_collateral_usd = float(10 ** rng.uniform(5, 9))
+    return MarketParams(
+        initial_collateral_usd=initial_collateral_usd,
+        collateral_price=float(10 ** rng.uniform(-2, 4)),
+        debt_price=1.0,
+        repay_amount_usd=initial_collateral_usd
+        * float(10 ** rng.uniform(-3, 0)),
+        max_drawdown=float(rng.uniform(0.05, 0.85)),
+    )
+
+
+def lltv_or_none(result) -> float:
+    return -1.0 if result[0] is None else float(result[0])
+
+
+@pytest.mark.parametrize("seed", range(N_MARKETS))
+def test_exact_lookup_matches_search(table, seed):
+    params = random_market(np.random.default_rng(seed))
+    assert table.bracket(params) is not None
+    expected = lltv_or_none(find_optimal_lltv(params))
+    assert lltv_or_none(optimal_lltv(params, table=table)) == pytest.approx(
+        expected
+    )
+
+
+@pytest.mark.parametrize("seed", range(N_MARKETS))
+def test_approximate_lookup_is_conservative(table, seed):
+    params = random_market(np.random.default_rng(seed))
+    expected = lltv_or_none(find_optimal_lltv(params))
+    result = table.lookup(params, max_error=MAX_ERROR)
+    if result is not None:
+        lltv = lltv_or_none(result)
+        assert lltv <= expected + 1e-9
+        if lltv >= 0:
+            assert expected - lltv <= MAX_ERROR + 1e-9
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gauntlet.data_utils import pair_ratio
+from gauntlet.price_calendar import MAX_FILL
+from gauntlet.price_calendar import PriceCalendar
+from gauntlet.tokens import Token
+
+A = Token(symbol="a", address="0xa", decimals=18, coingecko_id="a")
+B = Token(symbol="b", address="0xb", decimals=18, coingecko_id="b")
+
+DATES = pd.date_range("2023-01-01", periods=30).strftime("%Y-%m-%d")
+
+
+def prices(values, dates=DATES) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"prices": np.asarray(values, dtype=np.float64)},
+        index=pd.Index(list(dates), name="date"),
+    )
+
+
+def test_aligns_on_the_union_of_dates():
+    # a trades on even days, b on odd days, listed out of order
+    a = prices(np.arange(15) + 1.0, DATES[::2])
+    b = prices(np.arange(15) + 100.0, DATES[1::2]).iloc[::-1]
+    calendar = PriceCalendar.from_prices({A: a, B: b}, max_fill=0)
+    assert list(calendar.dates) == list(DATES)
+    assert calendar.tokens == [A, B]
+    assert np.array_equal(calendar.mask(A), np.arange(30) % 2 == 0)
+    assert np.array_equal(calendar.mask(B), np.arange(30) % 2 == 1)
+    assert np.array_equal(calendar.column(A)[::2], a["prices"])
+    assert np.array_equal(calendar.column(B)[1::2], b["prices"][::-1])
+    assert np.isnan(calendar.column(A)[1::2]).all()
+
+
+def test_duplicate_dates_keep_the_last_price():
+    a = prices([1.0, 2.0, 3.0], [DATES[0], DATES[1], DATES[1]])
+    calendar = PriceCalendar.from_prices({A: a})
+    assert list(calendar.column(A)) == [1.0, 3.0]
+
+
+def test_start_date():
+    calendar = PriceCalendar.from_prices(
+        {A: prices(np.arange(30) + 1.0)}, start_date=DATES[10]
+    )
+    assert calendar.dates[0] == DATES[10]
+    assert calendar.column(A)[0] == 11.0
+
+
+@pytest.mark.parametrize("gap", [1, MAX_FILL, MAX_FILL + 2])
+def test_forward_fills_at_most_max_fill_dates(gap):
+    values = np.arange(30) + 1.0
+    values[5 : 5 + gap] = np.nan
+    calendar = PriceCalendar.from_prices(
+        {A: prices(values), B: prices(np.ones(30))}
+    )
+    filled = calendar.mask(A)[5 : 5 + gap]
+    assert filled.sum() == min(gap, MAX_FILL)
+    assert (calendar.column(A)[5 : 5 + gap][filled] == values[4]).all()
+    assert np.isnan(calendar.column(A)[5 : 5 + gap][~filled]).all()
+    assert calendar.mask(A)[5 + gap :].all()
+
+
+def test_invalid_prices_are_not_observations():
+    values = np.arange(30) + 1.0
+    values[[0, 10]] = [0.0, -1.0]
+    calendar = PriceCalendar.from_prices({A: prices(values)}, max_fill=0)
+    assert not calendar.mask(A)[[0, 10]].any()
+    assert calendar.mask(A).sum() == 28
+
+
+def test_ratio_matches_joined_series():
+    rng = np.random.default_rng(0)
+    a = np.exp(rng.normal(size=30))
+    b = np.exp(rng.normal(size=30))
+    a[[3, 4, 20]] = np.nan
+    b[np.arange(8, 14)] = np.nan
+    dfs = {A: prices(a), B: prices(b)}
+    calendar = PriceCalendar.from_prices(dfs)
+
+    filled = {t: df["prices"].ffill(limit=MAX_FILL) for t, df in dfs.items()}
+    expected = (filled[A] / filled[B]).dropna()
+    ratio = calendar.ratio(A, B)
+    assert list(ratio.index) == list(expected.index)
+    assert np.allclose(ratio, expected)
+
+    start = DATES[12]
+    assert ratio[start:].equals(calendar.ratio(A, B, start))
+    assert ratio.equals(pair_ratio(A, B, dfs, start_date=DATES[0]))
+    assert ratio.equals(pair_ratio(A, B, calendar, start_date=DATES[0]))
+
+
+def test_ratio_without_common_dates_is_empty():
+    calendar = PriceCalendar.from_prices(
+        {A: prices([1.0], DATES[:1]), B: prices([1.0], DATES[-1:])},
+        max_fill=0,
+    )
+    assert calendar.ratio(A, B).empty
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from gauntlet.impact_table import ImpactTable
+from gauntlet.impact_table import MarketLiquidity
+from gauntlet.runner import LLTVS
+from gauntlet.sim import simulate_insolvency
+from gauntlet.sim import simulate_insolvency_adaptive
+
+N_SCENARIOS = 200
+
+
+def random_scenario(rng: np.random.Generator) -> dict:
+    """
+    Sim inputs of a random market at a random LLTV, with the repay amount
+    derived from random impact tables in a third of the scenarios.
+    """
+    initial_collateral_usd = float(10 ** rng.uniform(4, 9))
+    collateral_price = float(10 ** rng.uniform(-2, 4))
+    scenario = dict(
+        initial_collateral_usd=initial_collateral_usd,
+        collateral_price=collateral_price,
+        debt_price=1.0,
+        lltv=float(rng.choice(LLTVS)),
+        repay_amount_usd=initial_collateral_usd
+        * float(10 ** rng.uniform(-3, 0)),
+        liq_bonus=float(rng.uniform(0.005, 0.15)),
+        max_drawdown=float(rng.uniform(0.01, 0.95)),
+        pct_decrease=float(10 ** rng.uniform(-3, -1)),
+    )
+    if rng.random() < 1 / 3:
+        sizes_usd = [10 ** rng.uniform(3, 6), 10 ** rng.uniform(6, 9)]
+        scenario["liquidity"] = MarketLiquidity(
+            collateral=ImpactTable.from_swap_sizes(
+                {
+                    "0.005": sizes_usd[0] / collateral_price,
+                    "0.25": sizes_usd[1] / collateral_price,
+                }
+            ),
+            debt=ImpactTable.from_swap_sizes(
+                {"0.005": sizes_usd[0], "0.25": sizes_usd[1]}
+            ),
+            debt_price=1.0,
+        )
+    return scenario
+
+
+@pytest.mark.parametrize("seed", range(N_SCENARIOS))
+def test_adaptive_matches_fixed_step_sim(seed):
+    scenario = random_scenario(np.random.default_rng(seed))
+    run = simulate_insolvency_adaptive(**scenario)
+    expected = simulate_insolvency(**scenario)
+    tol = run.error_usd + 1e-9 * scenario["initial_collateral_usd"]
+    assert run.insolvency == pytest.approx(expected, abs=tol)
+    assert (run.insolvency > 0) == (expected > 0)
+    assert run.n_steps <= max(run.n_fixed_steps, 1)
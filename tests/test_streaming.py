@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gauntlet.data_utils import compute_pair_drawdown
+from gauntlet.price_calendar import PriceCalendar
+from gauntlet.streaming import compute_pair_drawdown_streaming
+from gauntlet.streaming import SpilledPercentiles
+from gauntlet.tokens import Token
+
+PERCENTILES = [0, 1, 50, 90, 95, 99, 99.9, 100]
+A = Token("a", "0x" + "a" * 40, 18, "a")
+B = Token("b", "0x" + "b" * 40, 18, "b")
+
+
+def random_prices(n: int, freq: str, seed: int) -> dict[Token, pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    fmt = "%Y-%m-%d" if freq == "D" else "%Y-%m-%d %H:%M"
+    dates = pd.date_range("2022-07-01", periods=n, freq=freq).strftime(fmt)
+    return {
+        t: pd.DataFrame(
+            {"prices": np.exp(np.cumsum(rng.normal(0, 0.02, n)))},
+            index=pd.Index(dates, name="date"),
+        )
+        for t in (A, B)
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_spilled_percentiles_match_numpy(tmp_path, seed):
+    rng = np.random.default_rng(seed)
+    samples = rng.standard_t(3, size=10_000)
+    spilled = SpilledPercentiles(tmp_path, "x", run_size=777)
+    for chunk in np.array_split(samples, 13):
+        spilled.extend(chunk)
+    assert spilled.count == len(samples)
+    for q in PERCENTILES:
+        assert spilled.percentile(q) == pytest.approx(
+            np.percentile(samples, q), rel=1e-12, abs=1e-12
+        )
+
+
+@pytest.mark.parametrize(
+    "interval,freq,days",
+    [("daily", "D", [1, 7, 14, 30]), ("hourly", "h", [1, 7, "4h"])],
+)
+def test_streaming_drawdowns_match_in_memory(interval, freq, days):
+    calendar = PriceCalendar.from_prices(random_prices(3000, freq, 0))
+    kwargs = dict(days=days, interval=interval)
+    expected = compute_pair_drawdown(A, B, calendar, **kwargs)
+    streamed = compute_pair_drawdown(
+        A, B, calendar, streaming_min_obs=0, **kwargs
+    )
+    for d in days:
+        for p, dd in expected[d].items():
+            assert streamed[d][p] == pytest.approx(dd, rel=1e-9)
+
+
+def test_price_store_streaming_matches_in_memory(tmp_path):
+    prices = random_prices(2000, "D", 1)
+    paths = []
+    for t, df in prices.items():
+        paths.append(tmp_path / f"{t.symbol}.csv")
+        df.to_csv(paths[-1])
+    expected = compute_pair_drawdown(A, B, prices)
+    streamed = compute_pair_drawdown_streaming(*paths, chunksize=333)
+    for d, pcts in expected.items():
+        for p, dd in pcts.items():
+            assert streamed[d][p] == pytest.approx(dd, rel=1e-9)
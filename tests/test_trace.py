@@ -0,0 +1,27 @@
+from gauntlet.impact_table import ImpactTable
+from gauntlet.impact_table import MarketLiquidity
+from gauntlet.sim import simulate_insolvency
+from gauntlet.trace import SimTrace
+
+
+def test_trace_replays_dynamic_repay_run():
+    liquidity = MarketLiquidity(
+        collateral=ImpactTable.from_swap_sizes({"0.005": 100, "0.25": 5e4}),
+        debt=ImpactTable.from_swap_sizes({"0.005": 2e5, "0.25": 1e8}),
+        debt_price=1.0,
+    )
+    trace = SimTrace()
+    insolvency = simulate_insolvency(
+        initial_collateral_usd=5e7,
+        collateral_price=2000.0,
+        debt_price=1.0,
+        lltv=0.9,
+        repay_amount_usd=1e6,
+        liq_bonus=0.02,
+        max_drawdown=0.5,
+        pct_decrease=0.005,
+        trace=trace,
+        liquidity=liquidity,
+    )
+    assert trace.params["liquidity"] is liquidity
+    assert simulate_insolvency(**trace.params) == insolvency
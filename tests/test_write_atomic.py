@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from gauntlet.data_utils import update_swap_size_cache
+from gauntlet.io_utils import write_atomic
+
+
+def test_failed_write_keeps_file(tmp_path):
+    path = tmp_path / "cache.json"
+    write_atomic(path, lambda f: json.dump({"a": 1}, f))
+
+    def fail(f):
+        f.write("{")
+        raise RuntimeError("interrupted")
+
+    with pytest.raises(RuntimeError):
+        write_atomic(path, fail)
+    assert json.loads(path.read_text()) == {"a": 1}
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_update_swap_size_cache_merges(tmp_path):
+    path = tmp_path / "swap_sizes.json"
+    update_swap_size_cache({"ethereum:0xa": {"0.005": 1.0}}, path)
+    update_swap_size_cache(
+        {"ethereum:0xa": {"0.25": 2.0}, "base:0xb": {"0.005": 3.0}}, path
+    )
+    assert json.loads(path.read_text()) == {
+        "ethereum:0xa": {"0.005": 1.0, "0.25": 2.0},
+        "base:0xb": {"0.005": 3.0},
+    }